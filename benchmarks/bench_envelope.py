@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+"""
+benchmarks.bench_envelope
+~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Building and parsing envelopes
+"""
+
+from dploylib.transport import Envelope, Header
+from .runner import benchmark
+from .utils import SIZES, payload
+
+
+@benchmark('envelope.from_raw', size=SIZES, header=[False, True])
+def from_raw(size, header):
+    header = Header.new(trace_id='trace') if header else None
+    raw = Envelope.new('text/plain', payload(size),
+            header=header).transfer_object()
+
+    def run(iterations):
+        for i in xrange(iterations):
+            envelope = Envelope.from_raw(raw)
+            envelope.id
+            envelope.mimetype
+            envelope.data
+    return run
+
+
+@benchmark('envelope.transfer_object', size=SIZES)
+def transfer_object(size):
+    data = payload(size)
+
+    def run(iterations):
+        for i in xrange(iterations):
+            Envelope.new('text/plain', data, id='id').transfer_object()
+    return run
+
+
+@benchmark('envelope.forward', size=SIZES)
+def forward(size):
+    """A received envelope sent again as is"""
+    raw = ['client', ''] + Envelope.new('text/plain',
+            payload(size)).transfer_object()
+
+    def run(iterations):
+        for i in xrange(iterations):
+            Envelope.from_raw(raw).transfer_object()
+    return run
+
+
+@benchmark('envelope.response', size=SIZES)
+def response(size):
+    raw = ['client', ''] + Envelope.new('text/plain',
+            payload(size)).transfer_object()
+    data = payload(size)
+
+    def run(iterations):
+        for i in xrange(iterations):
+            Envelope.from_raw(raw).response_envelope('text/plain',
+                    data).transfer_object()
+    return run
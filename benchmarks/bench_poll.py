@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+"""
+benchmarks.bench_poll
+~~~~~~~~~~~~~~~~~~~~~
+
+Dispatching input from a :class:`~dploylib.transport.PollLoop`. One of the
+registered sockets receives a window of envelopes which are then dispatched
+one poll at a time, so the cost includes sending them.
+"""
+
+from dploylib.transport import Context, Envelope, PollLoop
+from .runner import benchmark
+from .utils import payload, windows
+
+
+@benchmark('poll.dispatch', sockets=[1, 10, 100])
+def dispatch(sockets):
+    context = Context.new()
+    poll_loop = PollLoop.new()
+    pairs = []
+    for index in xrange(sockets):
+        socket_uri = 'inproc://bench-poll-%d' % index
+        receiver = context.socket('pair')
+        receiver.bind(socket_uri)
+        sender = context.socket('pair')
+        sender.connect(socket_uri)
+        poll_loop.register(receiver, receive)
+        pairs.append((sender, receiver))
+    # The busy socket is registered last
+    sender = pairs[-1][0]
+    envelope = Envelope.new('text/plain', payload(64))
+
+    def run(iterations):
+        for window in windows(iterations):
+            for i in xrange(window):
+                sender.send_envelope(envelope)
+            for i in xrange(window):
+                poll_loop.poll(timeout=1000)
+
+    def close():
+        for sender, receiver in pairs:
+            sender.close(linger=0)
+            receiver.close(linger=0)
+        context.zmq_context.term()
+    run.close = close
+    return run
+
+
+def receive(socket):
+    socket.receive_envelope()
+
+
+@benchmark('poll.timers', timers=[1, 100])
+def timers(timers):
+    """Polling with timers scheduled but not due"""
+    poll_loop = PollLoop.new()
+    for i in xrange(timers):
+        poll_loop.call_every(3600, receive, None)
+
+    def run(iterations):
+        for i in xrange(iterations):
+            poll_loop.poll(timeout=0)
+    return run
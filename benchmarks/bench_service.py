@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+"""
+benchmarks.bench_service
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+Round trips from a req socket to an echo server run by a
+:class:`~dploylib.services.Service`
+"""
+
+from dploylib import servers
+from dploylib.services import Service
+from dploylib.services.coordinator import ThreadedServerCoordinator
+from dploylib.transport import Context, Envelope
+from .runner import benchmark
+from .utils import SIZES, TRANSPORTS, payload, uri
+
+
+class EchoServer(servers.Server):
+    @servers.bind_in('request', 'rep')
+    def echo_request(self, socket, received):
+        socket.send_envelope(received.envelope)
+
+
+@benchmark('service.echo', transport=TRANSPORTS, size=SIZES)
+def echo(transport, size):
+    context = Context.new()
+    echo_uri = uri(transport, 'service-echo')
+    service = Service(coordinator=ThreadedServerCoordinator(
+        control_uri='inproc://bench-service-control', context=context))
+    service.add_server('echo', EchoServer)
+    service.start(config_dict=dict(servers=dict(echo=dict(
+        request=dict(uri=echo_uri))), general=dict()), wait_ready=True,
+        ready_timeout=10)
+    client = context.socket('req')
+    client.connect(echo_uri)
+    envelope = Envelope.new('text/plain', payload(size))
+
+    def run(iterations):
+        for i in xrange(iterations):
+            client.send_envelope(envelope)
+            client.receive_envelope()
+
+    def close():
+        client.close(linger=0)
+        service.stop()
+    run.close = close
+    return run
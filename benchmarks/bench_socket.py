@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+"""
+benchmarks.bench_socket
+~~~~~~~~~~~~~~~~~~~~~~~
+
+Sending and receiving on connected sockets. Sockets that don't have to
+alternate send a window of envelopes before receiving them. Req and rep
+sockets make round trips.
+"""
+
+from dploylib.transport import Context, Envelope
+from .runner import benchmark
+from .utils import SIZES, TRANSPORTS, payload, uri, windows
+
+# The sending and receiving socket types of each pattern
+PATTERNS = {
+    'pair': ('pair', 'pair'),
+    'pushpull': ('push', 'pull'),
+    'dealerrouter': ('dealer', 'router'),
+    'reqrep': ('req', 'rep'),
+}
+
+
+class BenchData(object):
+    def __init__(self, data):
+        self.data = data
+
+    def serialize(self):
+        return self.data
+
+    @classmethod
+    def deserialize(cls, data):
+        return cls(data)
+
+
+def connected_sockets(pattern, transport, copy=True):
+    context = Context.new()
+    sender_type, receiver_type = PATTERNS[pattern]
+    socket_uri = uri(transport, 'socket-%s' % pattern)
+    receiver = context.socket(receiver_type, copy=copy)
+    receiver.bind(socket_uri)
+    sender = context.socket(sender_type, copy=copy)
+    sender.connect(socket_uri)
+
+    def close():
+        sender.close(linger=0)
+        receiver.close(linger=0)
+        context.zmq_context.term()
+    return sender, receiver, close
+
+
+@benchmark('socket.envelope', pattern=sorted(PATTERNS), transport=TRANSPORTS,
+        size=SIZES)
+def envelope(pattern, transport, size):
+    sender, receiver, close = connected_sockets(pattern, transport)
+    envelope = Envelope.new('text/plain', payload(size))
+
+    if pattern == 'reqrep':
+        def run(iterations):
+            for i in xrange(iterations):
+                sender.send_envelope(envelope)
+                received = receiver.receive_envelope()
+                receiver.send_envelope(received)
+                sender.receive_envelope()
+    else:
+        def run(iterations):
+            for window in windows(iterations):
+                for i in xrange(window):
+                    sender.send_envelope(envelope)
+                for i in xrange(window):
+                    receiver.receive_envelope()
+    run.close = close
+    return run
+
+
+@benchmark('socket.envelope_nocopy', transport=TRANSPORTS, size=SIZES)
+def envelope_nocopy(transport, size):
+    """Forwarding received envelopes without copying their frames"""
+    sender, receiver, close = connected_sockets('pair', transport,
+            copy=False)
+    envelope = Envelope.new('text/plain', payload(size))
+
+    def run(iterations):
+        for window in windows(iterations):
+            for i in xrange(window):
+                sender.send_envelope(envelope)
+            for i in xrange(window):
+                receiver.receive_envelope().body
+    run.close = close
+    return run
+
+
+@benchmark('socket.obj', transport=TRANSPORTS, size=SIZES)
+def obj(transport, size):
+    sender, receiver, close = connected_sockets('pair', transport)
+    data = BenchData(dict(items=['x' * 64] * max(1, size // 70)))
+
+    def run(iterations):
+        for window in windows(iterations):
+            for i in xrange(window):
+                sender.send_obj(data)
+            for i in xrange(window):
+                receiver.receive_obj(BenchData.deserialize)
+    run.close = close
+    return run
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+
+"""
+benchmarks.runner
+~~~~~~~~~~~~~~~~~
+
+Runs the registered benchmarks, writes their results as JSON and compares
+them with a saved baseline.
+
+A benchmark is a function that sets up a case and returns a callable that
+runs the case a given number of times. The function is called once for each
+combination of its matrix::
+
+    @benchmark('envelope.from_raw', size=[64, 4096])
+    def from_raw(size):
+        raw = Envelope.new('text/plain', 'x' * size).transfer_object()
+
+        def run(iterations):
+            for i in xrange(iterations):
+                Envelope.from_raw(raw).data
+        return run
+
+The returned callable can have a ``close`` attribute that is called once the
+case is done. The runner grows the number of iterations until a sample takes
+at least ``min_time`` seconds and then keeps the best and median of
+``repeat`` samples. Each result is keyed by the benchmark name and its
+parameters, for example ``envelope.from_raw[size=64]``.
+"""
+
+import sys
+import json
+import time
+import fnmatch
+import platform
+import itertools
+import argparse
+import zmq
+
+DEFAULT_MIN_TIME = 0.1
+DEFAULT_REPEAT = 5
+DEFAULT_TOLERANCE = 0.1
+
+
+class Benchmark(object):
+    """A registered benchmark
+
+    :param name: The name of the benchmark
+    :param factory: The function that sets up a case
+    :param matrix: A dictionary of parameter names to lists of values
+    """
+    def __init__(self, name, factory, matrix):
+        self.name = name
+        self.factory = factory
+        self.matrix = matrix
+
+    def cases(self):
+        """Yields the key and parameters of each case"""
+        names = sorted(self.matrix)
+        for values in itertools.product(*[self.matrix[name]
+                for name in names]):
+            params = dict(zip(names, values))
+            yield case_key(self.name, params), params
+
+
+class BenchmarkRegistry(object):
+    """Stores benchmarks in the order they are registered"""
+    def __init__(self):
+        self._benchmarks = []
+
+    def register(self, benchmark):
+        self._benchmarks.append(benchmark)
+
+    def __iter__(self):
+        return iter(self._benchmarks)
+
+
+registry = BenchmarkRegistry()
+
+
+def benchmark(name, **matrix):
+    """A decorator that registers a benchmark
+
+    :param name: The name of the benchmark
+    :param matrix: Lists of values for each parameter of the benchmark
+    """
+    def decorator(factory):
+        registry.register(Benchmark(name, factory, matrix))
+        return factory
+    return decorator
+
+
+def case_key(name, params):
+    """The key of a benchmark case's result"""
+    if not params:
+        return name
+    return '%s[%s]' % (name, ','.join('%s=%s' % (param, params[param])
+            for param in sorted(params)))
+
+
+def matches(key, pattern):
+    """True if a case key is the pattern or matches it as a shell style
+    pattern. Keys are compared exactly first because their brackets are
+    special in shell style patterns.
+    """
+    return key == pattern or fnmatch.fnmatch(key, pattern)
+
+
+def calibrate(run, min_time, clock=time.time):
+    """The number of iterations that takes at least ``min_time`` seconds"""
+    iterations = 1
+    while True:
+        start = clock()
+        run(iterations)
+        elapsed = clock() - start
+        if elapsed >= min_time:
+            return iterations
+        if elapsed <= 0:
+            iterations *= 10
+            continue
+        # Aim a little past the minimum so the next try usually passes
+        iterations = max(iterations * 2,
+                int(iterations * min_time * 1.2 / elapsed))
+
+
+def measure(run, min_time=DEFAULT_MIN_TIME, repeat=DEFAULT_REPEAT,
+        clock=time.time):
+    """Measure a case. Returns a dictionary of the iterations per sample and
+    the best and median operations per second and seconds per operation.
+
+    :param run: A callable that runs a case a number of times
+    :param min_time: (optional) The shortest time for a sample in seconds
+    :param repeat: (optional) The number of samples
+    """
+    iterations = calibrate(run, min_time, clock=clock)
+    samples = []
+    for i in xrange(repeat):
+        start = clock()
+        run(iterations)
+        samples.append((clock() - start) / iterations)
+    samples.sort()
+    best = samples[0]
+    median = samples[len(samples) // 2]
+    return dict(iterations=iterations, best=best, median=median,
+            ops_per_sec=1.0 / median if median else None,
+            best_ops_per_sec=1.0 / best if best else None)
+
+
+def run_benchmarks(benchmarks, patterns=None, min_time=DEFAULT_MIN_TIME,
+        repeat=DEFAULT_REPEAT, out=None):
+    """Run benchmark cases and return their results by key
+
+    :param benchmarks: An iterable of :class:`Benchmark`
+    :param patterns: (optional) Only cases whose key matches one of these
+        shell style patterns are run
+    :param min_time: (optional) The shortest time for a sample in seconds
+    :param repeat: (optional) The number of samples of each case
+    :param out: (optional) A file to write progress to
+    """
+    results = {}
+    for bench in benchmarks:
+        for key, params in bench.cases():
+            if patterns and not any(matches(key, pattern)
+                    for pattern in patterns):
+                continue
+            run = bench.factory(**params)
+            try:
+                result = measure(run, min_time=min_time, repeat=repeat)
+            finally:
+                close = getattr(run, 'close', None)
+                if close:
+                    close()
+            results[key] = result
+            if out:
+                out.write('%-68s %12.0f ops/s %10.2f us/op\n' % (key,
+                        result['ops_per_sec'], result['median'] * 1e6))
+                out.flush()
+    return results
+
+
+def environment():
+    """Describes where the benchmarks ran"""
+    return dict(python=platform.python_version(),
+            implementation=platform.python_implementation(),
+            platform=platform.platform(), zmq=zmq.zmq_version(),
+            pyzmq=zmq.__version__, time=time.time())
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Compare results with a baseline. Returns a list of tuples of the key,
+    the ratio of the current to the baseline operations per second and
+    whether it is a regression, for every key in both.
+
+    :param results: Results by key from :func:`run_benchmarks`
+    :param baseline: Results by key from an earlier run
+    :param tolerance: (optional) The fraction the operations per second can
+        drop before it is a regression
+    """
+    comparison = []
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        baseline_ops = baseline[key]['ops_per_sec']
+        if not baseline_ops:
+            continue
+        ratio = results[key]['ops_per_sec'] / baseline_ops
+        comparison.append((key, ratio, ratio < 1.0 - tolerance))
+    return comparison
+
+
+def load_modules():
+    """Import the modules that register the benchmarks"""
+    from . import bench_envelope, bench_socket, bench_poll, bench_service
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the dploylib '
+            'benchmarks')
+    parser.add_argument('patterns', nargs='*',
+            help='Only run cases matching these patterns, e.g. "socket.*"')
+    parser.add_argument('-o', '--output',
+            help='Write the results as JSON to this file')
+    parser.add_argument('-b', '--baseline',
+            help='Compare with the results in this JSON file')
+    parser.add_argument('-t', '--tolerance', type=float,
+            default=DEFAULT_TOLERANCE,
+            help='Fraction ops/s may drop before it is a regression')
+    parser.add_argument('--min-time', type=float, default=DEFAULT_MIN_TIME,
+            help='Shortest time for a sample in seconds')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+            help='Samples of each case')
+    parser.add_argument('-l', '--list', action='store_true',
+            help='List the cases instead of running them')
+    args = parser.parse_args(argv)
+
+    load_modules()
+    if args.list:
+        for bench in registry:
+            for key, params in bench.cases():
+                print key
+        return 0
+
+    results = run_benchmarks(registry, patterns=args.patterns,
+            min_time=args.min_time, repeat=args.repeat, out=sys.stdout)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(dict(environment=environment(), results=results),
+                    output, indent=2, sort_keys=True)
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)['results']
+    regressions = 0
+    print
+    for key, ratio, regressed in compare(results, baseline,
+            tolerance=args.tolerance):
+        marker = ''
+        if regressed:
+            marker = '  REGRESSION'
+            regressions += 1
+        print '%-68s %6.2fx%s' % (key, ratio, marker)
+    if regressions:
+        print '%d regression(s) compared with %s' % (regressions,
+                args.baseline)
+        return 1
+    return 0
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+"""
+benchmarks.utils
+~~~~~~~~~~~~~~~~
+
+Helpers shared by the benchmarks
+"""
+
+import os
+import socket
+import tempfile
+
+SIZES = [64, 4096, 262144]
+TRANSPORTS = ['inproc', 'ipc', 'tcp']
+# Envelopes sent before any are received so the sender never waits on the
+# receiver's high water mark
+WINDOW = 100
+
+
+def payload(size):
+    """A str of ``size`` bytes"""
+    return 'x' * size
+
+
+def free_tcp_port():
+    """A tcp port that nothing is listening on"""
+    probe = socket.socket()
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+
+def uri(transport, name):
+    """A uri for a transport that is unique to this process"""
+    if transport == 'inproc':
+        return 'inproc://bench-%s' % name
+    if transport == 'ipc':
+        return 'ipc://%s' % os.path.join(tempfile.gettempdir(),
+                'dploy-bench-%d-%s' % (os.getpid(), name))
+    return 'tcp://127.0.0.1:%d' % free_tcp_port()
+
+
+def windows(iterations, window=WINDOW):
+    """Splits iterations into windows"""
+    while iterations > 0:
+        size = min(window, iterations)
+        yield size
+        iterations -= size
@@ -4,6 +4,9 @@ dploylib.clients.base
 
 The base client for dploy services.
 """
+import time
+import random
+import zmq
 from dploylib.transport import *
 
 
@@ -11,27 +14,165 @@ class StopListening(Exception):
     pass
 
 
+class RequestTimeout(Exception):
+    pass
+
+
 class BaseRequestClient(object):
+    """A client for a service's request socket
+
+    Requests wait forever for a reply unless a timeout is set. A req socket
+    whose request times out can't send again, so it is closed and a new one
+    is connected. The request is then sent again, up to :attr:`retries`
+    times. The wait before each retry starts at :attr:`retry_backoff`
+    seconds, doubles for every retry and is jittered so that clients don't
+    retry in lockstep.
+
+    With a hedge uri, a copy of a request is sent to that uri if no reply
+    arrives within :attr:`hedge_after` seconds and the first reply from
+    either uri is used. Only use retries and hedging for requests that are
+    safe to handle twice.
+
+    :param request_uri: The uri requests are sent to
+    :param context: The :class:`~dploylib.transport.Context` for the sockets
+    :param hedge_uri: (optional) The uri hedged requests are sent to.
+        Defaults to the client's :attr:`hedge_uri`
+    """
     socket_type = 'req'
     obj = None
+    # Seconds to wait for a reply. None waits forever
+    timeout = None
+    # Times a request that timed out is sent again
+    retries = 0
+    # Seconds to wait before the first retry and the most to wait before any
+    retry_backoff = 0.1
+    max_retry_backoff = 5.0
+    # Seconds to wait for a reply before a request is also sent to the hedge
+    # uri. None never hedges
+    hedge_uri = None
+    hedge_after = None
 
-    def __init__(self, request_uri, context):
+    def __init__(self, request_uri, context, hedge_uri=None):
         self._request_uri = request_uri
         self._context = context
         self._request_socket = None
+        if hedge_uri is not None:
+            self.hedge_uri = hedge_uri
+        self._hedge_socket = None
 
     def connect(self):
-        context = self._context
-        # Setup request socket
-        request_socket = context.socket(self.socket_type)
-        request_socket.connect(self._request_uri)
-        self._request_socket = request_socket
+        self._request_socket = self._new_socket(self._request_uri)
+
+    def _new_socket(self, uri):
+        socket = self._context.socket(self.socket_type)
+        socket.connect(uri)
+        return socket
+
+    def request(self, request_obj, timeout=None, retries=None, **options):
+        """Send a request and wait for its reply
+
+        :param request_obj: An object with a ``serialize`` method
+        :param timeout: (optional) Seconds to wait for each attempt's reply.
+            Defaults to the client's :attr:`timeout`
+        :param retries: (optional) Times to send the request again after a
+            timeout. Defaults to the client's :attr:`retries`
+        :param options: Passed to :meth:`~dploylib.transport.Socket.send_obj`
+        :raises: :class:`RequestTimeout` if the last attempt times out
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if retries is None:
+            retries = self.retries
+        attempt = 0
+        while True:
+            try:
+                envelope = self._attempt(request_obj, timeout, options)
+            except RequestTimeout:
+                if attempt >= retries:
+                    raise
+                time.sleep(self.retry_delay(attempt))
+                attempt += 1
+                continue
+            return ReceivedData(envelope, self.obj)
+
+    def retry_delay(self, attempt):
+        """Seconds to wait before a retry. Between half and all of the
+        backoff for the attempt.
 
-    def request(self, request_obj, **options):
+        :param attempt: The number of retries so far
+        """
+        backoff = min(self.max_retry_backoff,
+                self.retry_backoff * 2 ** attempt)
+        return backoff * (0.5 + random.random() / 2)
+
+    def _hedge_delay(self, timeout):
+        hedge_after = self.hedge_after
+        if self.hedge_uri is None or hedge_after is None:
+            return None
+        if timeout is not None and hedge_after >= timeout:
+            return None
+        return hedge_after
+
+    def _attempt(self, request_obj, timeout, options):
         request_socket = self._request_socket
         request_socket.send_obj(request_obj, **options)
-        envelope = request_socket.receive_envelope()
-        return ReceivedData(envelope, self.obj)
+        hedge_after = self._hedge_delay(timeout)
+        if hedge_after is None:
+            if timeout is not None and not request_socket.poll(timeout * 1000):
+                self._reset_request_socket()
+                raise RequestTimeout('No reply from "%s" after %ss' %
+                        (self._request_uri, timeout))
+            return request_socket.receive_envelope()
+        if request_socket.poll(hedge_after * 1000):
+            return request_socket.receive_envelope()
+
+        hedge_socket = self._hedge_socket
+        if hedge_socket is None:
+            hedge_socket = self._hedge_socket = self._new_socket(
+                    self.hedge_uri)
+        hedge_socket.send_obj(request_obj, **options)
+        remaining = None
+        if timeout is not None:
+            remaining = timeout - hedge_after
+        replied = first_ready([request_socket, hedge_socket], remaining)
+        # Any socket without a reply is still waiting for one
+        if replied is not request_socket:
+            self._reset_request_socket()
+        if replied is not hedge_socket:
+            self._reset_hedge_socket()
+        if replied is None:
+            raise RequestTimeout('No reply from "%s" or "%s" after %ss' %
+                    (self._request_uri, self.hedge_uri, timeout))
+        return replied.receive_envelope()
+
+    def _reset_request_socket(self):
+        self._request_socket.close(linger=0)
+        self.connect()
+
+    def _reset_hedge_socket(self):
+        # Reconnected the next time a request is hedged
+        self._hedge_socket.close(linger=0)
+        self._hedge_socket = None
+
+
+def first_ready(sockets, timeout=None):
+    """Wait for the first of a list of sockets that can receive. Returns None
+    if none can before the timeout. Earlier sockets win ties.
+
+    :param sockets: A list of :class:`~dploylib.transport.Socket`
+    :param timeout: (optional) Seconds to wait. Defaults to None which waits
+        forever
+    """
+    poller = zmq.Poller()
+    for socket in sockets:
+        poller.register(socket.zmq_socket, zmq.POLLIN)
+    if timeout is not None:
+        timeout = timeout * 1000
+    ready = dict(poller.poll(timeout))
+    for socket in sockets:
+        if socket.zmq_socket in ready:
+            return socket
+    return None
 
 
 def stop_listening():
@@ -0,0 +1,118 @@
+"""
+dploylib.clients.green
+~~~~~~~~~~~~~~~~~~~~~~
+
+A gevent version of the
+:class:`~dploylib.clients.pipeline.PipelinedRequestClient`. Requests return
+``gevent.event.AsyncResult`` objects that are resolved by a receiver
+greenlet, so any number of greenlets can wait on replies at once::
+
+    client = GreenPipelinedRequestClient('tcp://status:5555', context)
+    client.connect()
+    results = [client.request(StatusRequest(host), timeout=5)
+            for host in hosts]
+    statuses = [result.get() for result in results]
+
+gevent is not a requirement of dploylib. It must be installed to use this
+module.
+"""
+
+import functools
+import gevent
+from gevent.event import AsyncResult
+from gevent.lock import Semaphore
+from dploylib.transport import ReceivedData
+from dploylib.transport.green import GreenContext
+from .base import RequestTimeout
+from .pipeline import PendingRequests, ClientClosed, delimited
+
+
+class GreenPipelinedRequestClient(object):
+    """A request client for many requests in flight from greenlets
+
+    :param request_uri: The uri requests are sent to
+    :param context: The :class:`~dploylib.transport.Context` for the socket.
+        Plain contexts are shared through a
+        :class:`~dploylib.transport.green.GreenContext`
+    """
+    socket_type = 'dealer'
+    obj = None
+    # Seconds to wait for a reply. None waits forever
+    timeout = None
+
+    def __init__(self, request_uri, context):
+        self._request_uri = request_uri
+        self._context = GreenContext.from_context(context)
+        self._pending = PendingRequests()
+        self._request_socket = None
+        # Keeps the frames of two requests from interleaving
+        self._send_lock = Semaphore()
+        self._receiver = None
+
+    @property
+    def pending_count(self):
+        """The number of requests waiting for replies"""
+        return len(self._pending)
+
+    def connect(self):
+        """Connect to the request uri and start the receiver greenlet"""
+        request_socket = self._context.socket(self.socket_type)
+        request_socket.connect(self._request_uri)
+        self._request_socket = request_socket
+        self._receiver = gevent.spawn(self._receive)
+
+    def request(self, request_obj, timeout=None, **options):
+        """Send a request. Returns an ``AsyncResult`` for its
+        :class:`~dploylib.transport.ReceivedData` reply.
+
+        :param request_obj: An object with a ``serialize`` method
+        :param timeout: (optional) Seconds to wait for the reply before the
+            result fails with a
+            :class:`~dploylib.clients.base.RequestTimeout`. Defaults to the
+            client's :attr:`timeout`
+        :param options: Passed to
+            :meth:`~dploylib.transport.Socket.obj_envelope`
+        """
+        if self._receiver is None or self._receiver.ready():
+            raise ClientClosed('Client is not connected')
+        if timeout is None:
+            timeout = self.timeout
+        result = AsyncResult()
+        request_id = self._pending.add(result, timeout=timeout)
+        request_socket = self._request_socket
+        envelope = request_socket.obj_envelope(request_obj, id=request_id,
+                **options)
+        if timeout is not None:
+            timer = gevent.spawn_later(timeout, self._expire, request_id)
+            self._pending.set_timer(request_id,
+                    functools.partial(timer.kill, block=False))
+        with self._send_lock:
+            request_socket.send_envelope(delimited(envelope))
+        return result
+
+    def close(self):
+        """Stop the receiver. Requests still waiting for replies fail with
+        :class:`~dploylib.clients.pipeline.ClientClosed`.
+        """
+        receiver = self._receiver
+        if receiver is None or receiver.ready():
+            return
+        receiver.kill()
+        self._request_socket.close(linger=0)
+        self._pending.fail_all(ClientClosed('Client has been closed'))
+
+    def _receive(self):
+        request_socket = self._request_socket
+        while True:
+            envelope = request_socket.receive_envelope()
+            result = self._pending.pop(envelope.id)
+            if result is None:
+                # The request already timed out
+                continue
+            result.set(ReceivedData(envelope, self.obj))
+
+    def _expire(self, request_id):
+        result = self._pending.pop(request_id, cancel=False)
+        if result is not None:
+            result.set_exception(RequestTimeout('No reply from "%s"' %
+                self._request_uri))
@@ -0,0 +1,308 @@
+"""
+dploylib.clients.pipeline
+~~~~~~~~~~~~~~~~~~~~~~~~~
+
+A request client that can have many requests in flight at once. Requests are
+sent on a dealer socket and tagged with a unique envelope id. Each request
+returns a :class:`Future` that is resolved when the reply with the same id
+arrives::
+
+    client = PipelinedRequestClient('tcp://status:5555', context)
+    client.connect()
+    futures = [client.request(StatusRequest(host), timeout=5)
+            for host in hosts]
+    statuses = [future.result() for future in futures]
+    client.close()
+
+Replies must keep the id of their request. Replies created with
+:meth:`~dploylib.transport.Envelope.response_envelope` or envelopes echoed
+back as is do. Requests are sent with the empty delimiter frame that req
+sockets send, so servers can use rep or router sockets.
+
+A background thread owns the dealer socket. Callers hand requests to it over
+an inproc socket, so the client can be used from any number of threads. See
+:mod:`dploylib.clients.green` for a gevent version.
+"""
+
+import itertools
+import threading
+from dploylib.transport import Envelope, PollLoop, ReceivedData
+from .base import RequestTimeout
+
+STOP_MIMETYPE = 'application/x-dploy-pipeline-stop'
+
+
+class ClientClosed(Exception):
+    pass
+
+
+def delimited(envelope):
+    """The envelope with an empty delimiter frame in front, like a req socket
+    sends it
+    """
+    return Envelope.from_raw([''] + list(envelope.transfer_object()))
+
+
+class Future(object):
+    """The eventual reply to a request"""
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._done.is_set()
+
+    def set_result(self, result):
+        self._resolve(result, None)
+
+    def set_exception(self, exception):
+        self._resolve(None, exception)
+
+    def _resolve(self, result, exception):
+        with self._lock:
+            if self._done.is_set():
+                return
+            self._result = result
+            self._exception = exception
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        """Call a callable with the future once it is resolved. It is called
+        right away if the future is already resolved.
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def exception(self, timeout=None):
+        """Wait for the future and return its exception or None
+
+        :param timeout: (optional) Seconds to wait. Defaults to None which
+            waits forever
+        :raises: :class:`~dploylib.clients.base.RequestTimeout` if the
+            timeout passes first
+        """
+        if not self._done.wait(timeout):
+            raise RequestTimeout('Future not resolved after %ss' % timeout)
+        return self._exception
+
+    def result(self, timeout=None):
+        """Wait for the future and return its result. Raises the future's
+        exception if it has one.
+
+        :param timeout: (optional) Seconds to wait. Defaults to None which
+            waits forever
+        :raises: :class:`~dploylib.clients.base.RequestTimeout` if the
+            timeout passes first
+        """
+        exception = self.exception(timeout=timeout)
+        if exception:
+            raise exception
+        return self._result
+
+
+class PendingRequests(object):
+    """Requests that are waiting for replies by envelope id. Each request can
+    keep a function that cancels its timeout, which is called once the
+    request is no longer pending.
+    """
+    def __init__(self):
+        self._ids = itertools.count()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def add(self, future, timeout=None):
+        """Add a request's future. Returns the request's id."""
+        with self._lock:
+            request_id = '%x' % next(self._ids)
+            self._pending[request_id] = [future, timeout, None]
+        return request_id
+
+    def set_timer(self, request_id, cancel):
+        """Keep the function that cancels a request's timeout. It is called
+        right away if the request is no longer pending.
+        """
+        with self._lock:
+            entry = self._pending.get(request_id)
+            if entry is not None:
+                entry[2] = cancel
+        if entry is None:
+            cancel()
+
+    def timeout(self, request_id):
+        """The timeout of a pending request or None"""
+        entry = self._pending.get(request_id)
+        if entry is None:
+            return None
+        return entry[1]
+
+    def pop(self, request_id, cancel=True):
+        """Remove a request and return its future. None if it isn't
+        pending.
+
+        :param cancel: (optional) Whether to cancel the request's timeout.
+            The timeout's own callback pops without cancelling. Defaults to
+            True
+        """
+        with self._lock:
+            entry = self._pending.pop(request_id, None)
+        if entry is None:
+            return None
+        future, timeout, cancel_timer = entry
+        if cancel and cancel_timer is not None:
+            cancel_timer()
+        return future
+
+    def fail_all(self, exception):
+        """Fail every pending request"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future, timeout, cancel_timer in pending.itervalues():
+            if cancel_timer is not None:
+                cancel_timer()
+            future.set_exception(exception)
+
+    def __len__(self):
+        return len(self._pending)
+
+
+class PipelinedRequestClient(object):
+    """A request client for many requests in flight
+
+    :param request_uri: The uri requests are sent to
+    :param context: The :class:`~dploylib.transport.Context` for the sockets
+    """
+    socket_type = 'dealer'
+    obj = None
+    # Seconds to wait for a reply. None waits forever
+    timeout = None
+
+    def __init__(self, request_uri, context):
+        self._request_uri = request_uri
+        self._context = context
+        self._pending = PendingRequests()
+        self._queue_socket = None
+        self._queue_lock = threading.Lock()
+        self._receiver = None
+        self._stopped = False
+        self._running = False
+
+    @property
+    def pending_count(self):
+        """The number of requests waiting for replies"""
+        return len(self._pending)
+
+    def connect(self):
+        """Connect to the request uri and start the background receiver"""
+        context = self._context
+        queue_uri = 'inproc://dploy-pipeline-%x' % id(self)
+        request_socket = context.socket(self.socket_type)
+        request_socket.connect(self._request_uri)
+        queue_in = context.socket('pull')
+        queue_in.bind(queue_uri)
+        queue_socket = context.socket('push')
+        queue_socket.connect(queue_uri)
+        self._queue_socket = queue_socket
+        # The sockets are only used by the receiver from now on
+        self._running = True
+        receiver = threading.Thread(target=self._run,
+                args=(request_socket, queue_in))
+        receiver.daemon = True
+        receiver.start()
+        self._receiver = receiver
+
+    def request(self, request_obj, timeout=None, **options):
+        """Send a request. Returns a :class:`Future` for its
+        :class:`~dploylib.transport.ReceivedData` reply.
+
+        :param request_obj: An object with a ``serialize`` method
+        :param timeout: (optional) Seconds to wait for the reply before the
+            future fails with a
+            :class:`~dploylib.clients.base.RequestTimeout`. Defaults to the
+            client's :attr:`timeout`
+        :param options: Passed to
+            :meth:`~dploylib.transport.Socket.obj_envelope`
+        """
+        queue_socket = self._queue_socket
+        if queue_socket is None:
+            raise ClientClosed('Client is not connected')
+        if timeout is None:
+            timeout = self.timeout
+        future = Future()
+        request_id = self._pending.add(future, timeout=timeout)
+        envelope = queue_socket.obj_envelope(request_obj, id=request_id,
+                **options)
+        with self._queue_lock:
+            if self._stopped:
+                self._pending.pop(request_id)
+                raise ClientClosed('Client has been closed')
+            queue_socket.send_envelope(envelope)
+        return future
+
+    def close(self):
+        """Stop the receiver. Requests still waiting for replies fail with
+        :class:`ClientClosed`. Can be called from a done callback, in which
+        case the receiver stops once the callback returns.
+        """
+        in_receiver = threading.current_thread() is self._receiver
+        with self._queue_lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            if in_receiver:
+                # The receiver can't wait for itself to stop
+                self._running = False
+            else:
+                self._queue_socket.send_envelope(
+                        Envelope.new(STOP_MIMETYPE, ''))
+        if not in_receiver:
+            self._receiver.join()
+        self._queue_socket.close(linger=0)
+
+    def _run(self, request_socket, queue_in):
+        poll_loop = PollLoop.new()
+
+        def forward(socket):
+            envelope = socket.receive_envelope()
+            if envelope.mimetype == STOP_MIMETYPE:
+                self._running = False
+                return
+            request_id = envelope.id
+            timeout = self._pending.timeout(request_id)
+            if timeout is not None:
+                timer = poll_loop.call_later(timeout, self._expire,
+                        request_id)
+                self._pending.set_timer(request_id, timer.cancel)
+            request_socket.send_envelope(delimited(envelope))
+
+        def resolve(socket):
+            envelope = socket.receive_envelope()
+            future = self._pending.pop(envelope.id)
+            if future is None:
+                # The request already timed out
+                return
+            future.set_result(ReceivedData(envelope, self.obj))
+
+        poll_loop.register(queue_in, forward)
+        poll_loop.register(request_socket, resolve)
+        try:
+            while self._running:
+                poll_loop.poll()
+        finally:
+            request_socket.close(linger=0)
+            queue_in.close(linger=0)
+            self._pending.fail_all(ClientClosed('Client has been closed'))
+
+    def _expire(self, request_id):
+        future = self._pending.pop(request_id, cancel=False)
+        if future is not None:
+            future.set_exception(RequestTimeout('No reply from "%s"' %
+                self._request_uri))
@@ -0,0 +1,238 @@
+"""
+dploylib.clients.pool
+~~~~~~~~~~~~~~~~~~~~~
+
+Pools of connected request sockets that are shared between threads. Sockets
+stay connected between requests, so a request doesn't pay for a new
+connection::
+
+    pools = RequestSocketPools(context, max_size=20)
+    client = PooledRequestClient('tcp://queue:5555', context, pools=pools)
+
+    # Any number of threads can use the same client
+    received = client.request(job, timeout=2.0)
+
+zeromq sockets must not be used by two threads at once. A checked out socket
+is only used by the thread that checked it out and the pool's lock makes it
+safe to hand the socket to another thread afterwards.
+
+A req socket that never gets its reply can't send again, so a socket that
+times out or fails is closed and replaced by a new one on a later checkout.
+"""
+
+import collections
+import threading
+import time
+from .base import BaseRequestClient, RequestTimeout
+
+DEFAULT_POOL_SIZE = 10
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class SocketPool(object):
+    """A bounded pool of sockets connected to a single uri
+
+    :param context: The :class:`~dploylib.transport.Context` the sockets are
+        created in
+    :param uri: The uri the sockets connect to
+    :param socket_type: (optional) The type of the sockets. Defaults to 'req'
+    :param max_size: (optional) The most sockets that can exist at once.
+        Defaults to 10
+    :param options: (optional) A list of 2-tuple options set on new sockets
+    :param warm: (optional) The number of sockets created right away.
+        Defaults to 0
+    """
+    def __init__(self, context, uri, socket_type='req',
+            max_size=DEFAULT_POOL_SIZE, options=None, warm=0):
+        self._context = context
+        self._uri = uri
+        self._socket_type = socket_type
+        self._max_size = max_size
+        self._options = options or []
+        # Idle sockets. The most recently used is reused first.
+        self._idle = collections.deque()
+        # Sockets that exist, whether idle or checked out
+        self._size = 0
+        self._closed = False
+        self._available = threading.Condition(threading.Lock())
+        for i in xrange(min(warm, max_size)):
+            self._idle.append(self._new_socket())
+            self._size += 1
+
+    @property
+    def size(self):
+        """The number of sockets that exist"""
+        return self._size
+
+    @property
+    def idle_count(self):
+        """The number of sockets waiting to be checked out"""
+        return len(self._idle)
+
+    def _new_socket(self):
+        socket = self._context.socket(self._socket_type)
+        for option_name, option_value in self._options:
+            socket.set_option(option_name, option_value)
+        socket.connect(self._uri)
+        return socket
+
+    def checkout(self, timeout=None):
+        """Take a socket from the pool. A new socket is created if none are
+        idle and the pool isn't full. Otherwise this waits for a socket to be
+        returned.
+
+        :param timeout: (optional) Seconds to wait for a socket. Defaults to
+            None which waits forever
+        :raises: :class:`PoolExhausted` if the timeout passes first
+        """
+        available = self._available
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with available:
+            while True:
+                if self._closed:
+                    raise PoolExhausted('Pool for "%s" is closed' % self._uri)
+                if self._idle:
+                    return self._idle.pop()
+                if self._size < self._max_size:
+                    self._size += 1
+                    break
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise PoolExhausted('All %d sockets for "%s" are in '
+                                'use' % (self._max_size, self._uri))
+                available.wait(remaining)
+        # Connecting doesn't need the lock. The slot is already reserved.
+        try:
+            return self._new_socket()
+        except:
+            self._release_slot()
+            raise
+
+    def checkin(self, socket):
+        """Return a socket that is ready for its next use to the pool"""
+        with self._available:
+            if self._closed:
+                socket.close(linger=0)
+                self._size -= 1
+                return
+            self._idle.append(socket)
+            self._available.notify()
+
+    def discard(self, socket):
+        """Close a socket that can't be reused. Its place in the pool is
+        freed for a new socket.
+        """
+        socket.close(linger=0)
+        self._release_slot()
+
+    def _release_slot(self):
+        with self._available:
+            self._size -= 1
+            self._available.notify()
+
+    def close(self):
+        """Close the idle sockets. Sockets that are checked out are closed
+        when they are returned.
+        """
+        with self._available:
+            self._closed = True
+            while self._idle:
+                self._idle.pop().close(linger=0)
+                self._size -= 1
+            self._available.notify_all()
+
+
+class RequestSocketPools(object):
+    """Socket pools for any number of uris on a shared context
+
+    :param context: The :class:`~dploylib.transport.Context` for every pool
+    :param socket_type: (optional) The type of the sockets. Defaults to 'req'
+    :param max_size: (optional) The most sockets for each uri. Defaults to 10
+    :param options: (optional) A list of 2-tuple options set on new sockets
+    """
+    def __init__(self, context, socket_type='req', max_size=DEFAULT_POOL_SIZE,
+            options=None):
+        self._context = context
+        self._socket_type = socket_type
+        self._max_size = max_size
+        self._options = options
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    @property
+    def context(self):
+        return self._context
+
+    def pool(self, uri):
+        """The :class:`SocketPool` for a uri. Created on first use."""
+        with self._lock:
+            pool = self._pools.get(uri)
+            if pool is None:
+                pool = self._pools[uri] = SocketPool(self._context, uri,
+                        socket_type=self._socket_type,
+                        max_size=self._max_size, options=self._options)
+            return pool
+
+    def close(self):
+        """Close every pool"""
+        with self._lock:
+            for pool in self._pools.itervalues():
+                pool.close()
+            self._pools.clear()
+
+
+class PooledRequestClient(BaseRequestClient):
+    """A thread-safe request client. Each attempt at a request checks out a
+    socket from the pool of the client's request uri. Timed out requests are
+    retried like :class:`~dploylib.clients.base.BaseRequestClient` retries
+    them. Pooled requests can't be hedged, so a client with a
+    :attr:`hedge_uri` or :attr:`hedge_after` raises a ``ValueError``.
+
+    :param request_uri: The uri requests are sent to
+    :param context: The :class:`~dploylib.transport.Context` for the sockets
+    :param pools: (optional) :class:`RequestSocketPools` shared with other
+        clients. Defaults to pools of this client's own
+    :param checkout_timeout: (optional) Seconds to wait for a socket when all
+        of them are in use. Defaults to None which waits forever
+    """
+    def __init__(self, request_uri, context, pools=None,
+            checkout_timeout=None):
+        super(PooledRequestClient, self).__init__(request_uri, context)
+        self._check_not_hedged()
+        if pools is None:
+            pools = RequestSocketPools(context, socket_type=self.socket_type)
+        self._pool = pools.pool(request_uri)
+        self._checkout_timeout = checkout_timeout
+
+    def connect(self):
+        """Sockets are connected as they are needed. This does nothing."""
+
+    def _check_not_hedged(self):
+        if self.hedge_uri is not None or self.hedge_after is not None:
+            raise ValueError('PooledRequestClient does not hedge requests. '
+                    'Remove hedge_uri and hedge_after')
+
+    def _attempt(self, request_obj, timeout, options):
+        # Hedging may have been configured after the client was created
+        self._check_not_hedged()
+        pool = self._pool
+        socket = pool.checkout(timeout=self._checkout_timeout)
+        try:
+            socket.send_obj(request_obj, **options)
+            if timeout is not None and not socket.poll(timeout * 1000):
+                raise RequestTimeout('No reply from "%s" after %ss' %
+                        (self._request_uri, timeout))
+            envelope = socket.receive_envelope()
+        except:
+            # The socket is stuck waiting for a reply
+            pool.discard(socket)
+            raise
+        pool.checkin(socket)
+        return envelope
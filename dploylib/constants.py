@@ -1,3 +1,9 @@
 COORDINATOR_SHUTDOWN = '!shutdown!'
+SERVER_STARTED = '!started!'
+SERVER_STOPPED = '!stopped!'
+SERVER_FAILED = '!failed!'
+# Servers also subscribe to this prefix and their name on the control socket
+# so the coordinator can tell which servers have subscribed
+SERVER_CONTROL_TOPIC = '!server!'
 SETTINGS_GENERAL_SECTION = 'general'
 SETTINGS_SERVER_SECTION = 'servers'
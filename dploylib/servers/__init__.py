@@ -1,3 +1,5 @@
 # -*- coding: utf-8 -*-
 
 from server import *
+from execution import ThreadPool, ProcessPool
+from shedding import Shedding, SHED_MIMETYPE
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+
+"""
+dploylib.servers.execution
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Execution policies decide where a socket's input handler runs. By default
+handlers run inline on the server's poll loop. A socket description can
+instead run its handler in a pool of threads or processes::
+
+    class ThumbnailServer(servers.Server):
+        @servers.bind_in('jobs', 'router', execution=servers.ProcessPool(4))
+        def make_thumbnail(self, socket, received):
+            socket.send_envelope(...)
+
+Handlers in a pool receive a :class:`ReplySocket` instead of the real
+socket and a :class:`PooledServer` instead of the server. The pooled server's
+``sockets`` are reply sockets too, so a handler can still send on any of the
+server's sockets, for example with ``self.sockets.out.send_envelope(...)``.
+Anything sent is passed back to the server's poll loop over an inproc socket
+and sent on the real socket from there, so zeromq sockets are never used
+outside of the poll loop's thread.
+
+Pooled handlers must not call server methods that use the poll loop, such as
+:meth:`~dploylib.servers.server.DployServer.send_envelope` or
+:meth:`~dploylib.servers.server.DployServer.call_later`. They can't set
+attributes on the server either.
+
+Process pools fork their workers right before the server starts polling.
+Forking a process that runs other threads is unsafe, so servers with process
+pools must run in the main thread of their own process, as they do with the
+:class:`~dploylib.services.coordinator.ProcessServerCoordinator`.
+
+Requests on ``rep`` and ``req`` sockets must be answered before the next one
+is received, so those sockets can only run their handlers inline.
+"""
+
+import types
+import itertools
+import logging
+import threading
+import multiprocessing.pool
+from dploylib.transport import Envelope, ReceivedData, Socket, frame_bytes
+
+logger = logging.getLogger('dploylib.servers.execution')
+
+# Handlers that run in process pools. A process pool is forked after its
+# handler is stored here so every worker process inherits it.
+process_handlers = {}
+process_handler_keys = itertools.count()
+
+
+class ForkError(Exception):
+    pass
+
+
+class ReplySocket(Socket):
+    """Stands in for a socket in handlers that run in a pool. Envelopes sent
+    on it are collected so the server can send them on the real socket.
+    Nothing can be received on a reply socket.
+
+    :param name: (optional) The name of the server socket it stands in for.
+        Defaults to '' which is the socket the handler's input came from
+    :param outbox: (optional) A list shared with other reply sockets that
+        gets a tuple of the name and envelope of everything sent
+    """
+    def __init__(self, name='', outbox=None):
+        super(ReplySocket, self).__init__(None, None)
+        self.name = name
+        self.envelopes = []
+        self._outbox = outbox
+
+    def send_envelope(self, envelope, copy=None, track=False):
+        self.envelopes.append(envelope)
+        if self._outbox is not None:
+            self._outbox.append((self.name, envelope))
+
+
+class ReplySockets(object):
+    """Stands in for a server's sockets in handlers that run in a pool. Each
+    socket is a :class:`ReplySocket` named after the server socket.
+
+    :param outbox: The list shared by the reply sockets
+    """
+    def __init__(self, outbox):
+        self._outbox = outbox
+        self._sockets = {}
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        socket = self._sockets.get(name)
+        if socket is None:
+            socket = self._sockets[name] = ReplySocket(name, self._outbox)
+        return socket
+
+
+class PooledServer(object):
+    """Stands in for the server in handlers that run in a pool. Attributes are
+    read from the server, except for ``sockets`` which are
+    :class:`ReplySockets`. The server's methods are bound to the stand in so
+    they send on the reply sockets too. Attributes can't be set because the
+    poll loop uses the server at the same time, and a process pool only has a
+    copy of it.
+
+    :param server: The server
+    :param outbox: The list shared by the reply sockets
+    """
+    def __init__(self, server, outbox):
+        object.__setattr__(self, '_server', server)
+        object.__setattr__(self, 'sockets', ReplySockets(outbox))
+
+    def __getattr__(self, name):
+        server = self._server
+        value = getattr(server, name)
+        if isinstance(value, types.MethodType) and value.__self__ is server:
+            return types.MethodType(value.__func__, self)
+        return value
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Pooled handlers can\'t set "%s" on the server'
+                % name)
+
+
+def run_handler(handler, server, received):
+    """Runs a handler with a :class:`ReplySocket` and a :class:`PooledServer`.
+    Returns a tuple of the socket name and transfer object of each envelope
+    it sent, in the order they were sent. The name is '' for the socket the
+    input came from.
+    """
+    outbox = []
+    reply_socket = ReplySocket(outbox=outbox)
+    try:
+        handler(PooledServer(server, outbox), reply_socket, received)
+    except Exception:
+        logger.exception('Handler %r failed in a worker' % handler)
+    return [(name, envelope.transfer_object()) for name, envelope in outbox]
+
+
+def raw_received(received):
+    """Turn received data into frames that can be sent to another process"""
+    if isinstance(received, list):
+        return [raw_received(item) for item in received]
+    return map(frame_bytes, received.envelope.transfer_object())
+
+
+def run_process_handler(key, raw):
+    """Runs a handler stored in :data:`process_handlers` inside of a worker
+    process
+    """
+    server, handler, deserializer = process_handlers[key]
+    if raw and isinstance(raw[0], list):
+        received = [ReceivedData(Envelope.from_raw(item), deserializer)
+                for item in raw]
+    else:
+        received = ReceivedData(Envelope.from_raw(raw), deserializer)
+    replies = run_handler(handler, server, received)
+    return [(name, map(frame_bytes, reply)) for name, reply in replies]
+
+
+class PoolExecutor(object):
+    """Runs a socket's handler in a pool on behalf of a server. Used as the
+    ``spawn`` of a :class:`~dploylib.servers.server.SocketHandlerWrapper`.
+
+    :param size: The number of workers in the pool
+    :param server: The server the socket belongs to
+    :param socket_name: The name of the socket
+    """
+    def __init__(self, size, server, socket_name):
+        self._size = size
+        self._server = server
+        self._pool = None
+        self._origin_socket = None
+        self._reply_sender = None
+        self._reply_uri = 'inproc://dploy-replies-%s-%x' % (socket_name,
+                id(self))
+        reply_receiver = server.context.socket('pull', copy=False)
+        reply_receiver.bind(self._reply_uri)
+        server.add_socket('_%s_replies' % socket_name, reply_receiver,
+                handler=self.send_reply)
+        server.add_teardown(self.close)
+
+    def create_pool(self):
+        raise NotImplementedError('create_pool must create a worker pool')
+
+    def task(self, handler, server, received):
+        """The function and arguments run by a worker"""
+        raise NotImplementedError('task must return a function and arguments')
+
+    def __call__(self, handler, server, socket, received):
+        self._origin_socket = socket
+        pool = self._pool
+        if not pool:
+            pool = self._pool = self.create_pool()
+        func, args = self.task(handler, server, received)
+        pool.apply_async(func, args, callback=self.queue_replies)
+
+    def queue_replies(self, replies):
+        """Pass replies from the workers back to the poll loop. This is
+        always called from the pool's result handling thread.
+        """
+        reply_sender = self._reply_sender
+        if not reply_sender:
+            reply_sender = self._server.context.socket('push')
+            reply_sender.connect(self._reply_uri)
+            self._reply_sender = reply_sender
+        for name, reply in replies:
+            # The name of the socket to send on goes in front of the frames
+            reply_sender.zmq_socket.send_multipart([name] + list(reply))
+
+    def send_reply(self, socket):
+        """Send a reply from a worker on the socket it was sent on"""
+        frames = socket.zmq_socket.recv_multipart(copy=socket.copy)
+        name = frame_bytes(frames[0])
+        envelope = Envelope.from_raw(frames[1:])
+        if name:
+            target = getattr(self._server.sockets, name)
+        else:
+            target = self._origin_socket
+        target.send_envelope(envelope)
+
+    def close(self):
+        pool = self._pool
+        if pool:
+            pool.terminate()
+        # The pool's threads are gone so the sender can be closed here
+        reply_sender = self._reply_sender
+        if reply_sender:
+            reply_sender.close(linger=0)
+            self._reply_sender = None
+
+
+class ThreadPoolExecutor(PoolExecutor):
+    def create_pool(self):
+        return multiprocessing.pool.ThreadPool(self._size)
+
+    def task(self, handler, server, received):
+        return run_handler, (handler, server, received)
+
+
+class ProcessPoolExecutor(PoolExecutor):
+    def __init__(self, size, server, socket_name, handler, deserializer):
+        if not isinstance(threading.current_thread(), threading._MainThread):
+            raise ForkError('Process pools can only be used by servers that '
+                    'run in the main thread of their process')
+        super(ProcessPoolExecutor, self).__init__(size, server, socket_name)
+        self._key = next(process_handler_keys)
+        process_handlers[self._key] = (server, handler, deserializer)
+        server.add_startup(self.start_pool)
+
+    def start_pool(self):
+        """Fork the workers before the poll loop runs so no handler or pool
+        thread of the server is running yet
+        """
+        if not self._pool:
+            self._pool = self.create_pool()
+
+    def create_pool(self):
+        return multiprocessing.Pool(self._size)
+
+    def task(self, handler, server, received):
+        return run_process_handler, (self._key, raw_received(received))
+
+    def close(self):
+        super(ProcessPoolExecutor, self).close()
+        process_handlers.pop(self._key, None)
+
+
+class ThreadPool(object):
+    """Run a socket's handler in a pool of threads. Suited to handlers that
+    block on I/O.
+
+    :param size: The number of threads
+    """
+    def __init__(self, size):
+        self.size = size
+
+    def executor(self, server, socket_name, handler, deserializer):
+        return ThreadPoolExecutor(self.size, server, socket_name)
+
+
+class ProcessPool(object):
+    """Run a socket's handler in a pool of processes. Suited to CPU heavy
+    handlers. The handler runs with a copy of the server taken when the pool
+    starts, right before the server starts polling, so it can't change the
+    server's state. The server must run in the main thread of its process.
+
+    :param size: The number of processes
+    """
+    def __init__(self, size):
+        self.size = size
+
+    def executor(self, server, socket_name, handler, deserializer):
+        return ProcessPoolExecutor(self.size, server, socket_name, handler,
+                deserializer)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+"""
+dploylib.servers.green
+~~~~~~~~~~~~~~~~~~~~~~
+
+Defines the GreenServer. A GreenServer runs each of its input handlers in its
+own greenlet so that handlers waiting on I/O don't hold up the rest of the
+server.
+
+gevent is not a requirement of dploylib. It must be installed to use this
+module.
+"""
+
+from gevent.pool import Pool
+from dploylib.transport.green import GreenContext, GreenPollLoop
+from .server import Server
+
+
+class GreenServer(Server):
+    """A :class:`~dploylib.servers.Server` whose handlers run concurrently as
+    greenlets. Handlers are defined exactly like a normal server's handlers.
+    Any socket operation or gevent friendly I/O in a handler lets the other
+    handlers run.
+
+    Since a ``rep`` socket can't receive until it has replied, requests on a
+    ``rep`` socket are still handled one at a time. Use ``router``, ``pull``
+    or ``sub`` sockets to handle many inputs at once.
+
+    :attr handler_pool_size: The most handlers that can run at once. Defaults
+        to None which doesn't limit the handlers
+    """
+    handler_pool_size = None
+
+    @classmethod
+    def create(cls, name, settings, control_uri, context=None):
+        if context:
+            # Share the given context so inproc sockets still work
+            context = GreenContext.from_context(context)
+        else:
+            context = GreenContext.new()
+        return super(GreenServer, cls).create(name, settings, control_uri,
+                context=context)
+
+    def __init__(self, name, settings, control_uri, context,
+            poll_loop=None):
+        poll_loop = poll_loop or GreenPollLoop.new()
+        super(GreenServer, self).__init__(name, settings, control_uri,
+                context, poll_loop=poll_loop)
+        self._handler_pool = Pool(self.handler_pool_size)
+
+    def start(self):
+        try:
+            super(GreenServer, self).start()
+        finally:
+            self._handler_pool.kill()
+            # The server's green sockets must be closed before the context
+            # they share is terminated
+            self.close(linger=0)
+
+    def spawn_handler(self, handler, *args):
+        """Run a handler in a new greenlet"""
+        return self._handler_pool.spawn(handler, *args)
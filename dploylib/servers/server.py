@@ -1,14 +1,30 @@
+import time
 import logging
 from dploylib import constants
 from dploylib.transport import Context, PollLoop, ReceivedData
+from dploylib.transport.metrics import Metrics
+from dploylib.transport.compression import Compression
+from .shedding import Shedding, REPLY_SOCKET_TYPES
 
 logger = logging.getLogger('dploylib.servers.server')
 
+# Socket types that must alternate between receiving and sending
+LOCKSTEP_SOCKET_TYPES = ('rep', 'req')
+
+# Seconds between publishing stats on a server's stats socket
+DEFAULT_STATS_INTERVAL = 10
+
 
 class Handler(object):
     """Base class based handler"""
     socket_type = None
     deserializer = None
+    copy = True
+    batch_size = 1
+    batch = False
+    execution = None
+    shedding = None
+    compression = None
 
     @classmethod
     def bind(cls, name):
@@ -22,13 +38,17 @@ class Handler(object):
     def socket_description(cls, name, setup_type):
         handler = cls()
         return SocketDescription(name, cls.socket_type, setup_type,
-                input_handler=handler, deserializer=cls.deserializer)
+                input_handler=handler, deserializer=cls.deserializer,
+                copy=cls.copy, batch_size=cls.batch_size, batch=cls.batch,
+                execution=cls.execution, shedding=cls.shedding,
+                compression=cls.compression)
 
     def __call__(self, server, socket, received):
         raise NotImplementedError('Handler is not handling the input')
 
 
-def bind_in(name, socket_type, obj=None):
+def bind_in(name, socket_type, obj=None, copy=True, batch_size=1,
+        batch=False, execution=None, shedding=None, compression=None):
     """A decorator that creates a SocketDescription describing a socket bound
     to receive input. The decorated function or method is used as the input
     event handler.
@@ -38,17 +58,35 @@ def bind_in(name, socket_type, obj=None):
     :type socket_type: str
     :param obj: (optional) A class or object that implements the
         ``deserialize`` method to deserialize incoming data
+    :param copy: (optional) Set to False to receive envelopes without copying
+        their frames. Defaults to True
+    :param batch_size: (optional) The most envelopes handled each time the
+        socket is ready. Defaults to 1
+    :param batch: (optional) Set to True to call the handler once with a list
+        of received data instead of once per envelope. Defaults to False
+    :param execution: (optional) An execution policy such as
+        :class:`~dploylib.servers.ThreadPool` or
+        :class:`~dploylib.servers.ProcessPool`. Defaults to running the
+        handler inline
+    :param shedding: (optional) A :class:`~dploylib.servers.Shedding` policy
+        that drops or fails expired requests before the handler is called
+    :param compression: (optional) A
+        :class:`~dploylib.transport.compression.Compression` used by default
+        for the socket's ``send_obj`` and ``send_text``
     :returns: A :class:`SocketDescription`
     """
     setup_type = 'bind'
 
     def decorator(f):
         return SocketDescription(name, socket_type, setup_type,
-                input_handler=f, deserializer=obj)
+                input_handler=f, deserializer=obj, copy=copy,
+                batch_size=batch_size, batch=batch, execution=execution,
+                shedding=shedding, compression=compression)
     return decorator
 
 
-def connect_in(name, socket_type, obj=None):
+def connect_in(name, socket_type, obj=None, copy=True, batch_size=1,
+        batch=False, execution=None, shedding=None, compression=None):
     """A decorator that creates a SocketDescription describing a socket
     connected to receive input. The decorated function or method is used as the
     input event handler.
@@ -58,51 +96,171 @@ def connect_in(name, socket_type, obj=None):
     :type socket_type: str
     :param obj: (optional) A class or object that implements the
         ``deserialize`` method to deserialize incoming data
+    :param copy: (optional) Set to False to receive envelopes without copying
+        their frames. Defaults to True
+    :param batch_size: (optional) The most envelopes handled each time the
+        socket is ready. Defaults to 1
+    :param batch: (optional) Set to True to call the handler once with a list
+        of received data instead of once per envelope. Defaults to False
+    :param execution: (optional) An execution policy such as
+        :class:`~dploylib.servers.ThreadPool` or
+        :class:`~dploylib.servers.ProcessPool`. Defaults to running the
+        handler inline
+    :param shedding: (optional) A :class:`~dploylib.servers.Shedding` policy
+        that drops or fails expired requests before the handler is called
+    :param compression: (optional) A
+        :class:`~dploylib.transport.compression.Compression` used by default
+        for the socket's ``send_obj`` and ``send_text``
     :returns: A :class:`SocketDescription`
     """
     setup_type = 'connect'
 
     def decorator(f):
         return SocketDescription(name, socket_type, setup_type,
-                input_handler=f, deserializer=obj)
+                input_handler=f, deserializer=obj, copy=copy,
+                batch_size=batch_size, batch=batch, execution=execution,
+                shedding=shedding, compression=compression)
     return decorator
 
 
-def bind(name, socket_type):
+def bind(name, socket_type, copy=True, compression=None):
     """A decorator that creates a SocketDescription that describes a bound
     socket. This socket does not listen for input.
 
     :param name: The name of the socket (for configuration purposes)
     :param socket_type: The lowercase name of the zeromq socket type
     :type socket_type: str
+    :param copy: (optional) Set to False to receive envelopes without copying
+        their frames. Defaults to True
+    :param compression: (optional) A
+        :class:`~dploylib.transport.compression.Compression` used by default
+        for the socket's ``send_obj`` and ``send_text``
     """
     setup_type = 'bind'
-    return SocketDescription(name, socket_type, setup_type)
+    return SocketDescription(name, socket_type, setup_type, copy=copy,
+            compression=compression)
 
 
-def connect(name, socket_type):
+def connect(name, socket_type, copy=True, compression=None):
     """A decorator that creates a SocketDescription that describes a connected
     socket. This socket does not listen for input.
 
     :param name: The name of the socket (for configuration purposes)
     :param socket_type: The lowercase name of the zeromq socket type
     :type socket_type: str
+    :param copy: (optional) Set to False to receive envelopes without copying
+        their frames. Defaults to True
+    :param compression: (optional) A
+        :class:`~dploylib.transport.compression.Compression` used by default
+        for the socket's ``send_obj`` and ``send_text``
     """
     setup_type = 'connect'
-    return SocketDescription(name, socket_type, setup_type)
+    return SocketDescription(name, socket_type, setup_type, copy=copy,
+            compression=compression)
+
+
+def call_handler(handler, *args):
+    """Calls a handler directly"""
+    return handler(*args)
 
 
 class SocketHandlerWrapper(object):
-    """Wraps the handling function for a socket"""
-    def __init__(self, server, handler, deserializer=None):
+    """Wraps the handling function for a socket
+
+    Each time the socket is ready up to ``batch_size`` envelopes are drained
+    from it without blocking. Capping the drain keeps one busy socket from
+    starving the others registered on the same poll loop.
+
+    :param server: The server the handler belongs to
+    :param handler: The handling function/method for the socket
+    :param deserializer: (optional) Deserializer for received data
+    :param batch_size: (optional) The most envelopes handled each time the
+        socket is ready. Defaults to 1
+    :param batch: (optional) Set to True to call the handler once with a list
+        of :class:`~dploylib.transport.ReceivedData`. Defaults to False
+    :param spawn: (optional) A callable used to call the handler, given the
+        handler and its arguments. This allows handlers to run concurrently.
+        Defaults to calling the handler directly
+    :param shedder: (optional) A :class:`~dploylib.servers.shedding.Shedder`
+        that decides which received data is shed instead of handled
+    :param metrics: (optional) The
+        :class:`~dploylib.transport.metrics.SocketMetrics` of the socket.
+        Received envelopes, handler calls, handler errors and handler
+        latencies are recorded. With a spawn the latency is the time taken to
+        hand off the handler
+    :param clock: (optional) Function returning the current time in seconds.
+        Used to time the handler
+    """
+    def __init__(self, server, handler, deserializer=None, batch_size=1,
+            batch=False, spawn=None, shedder=None, metrics=None,
+            clock=time.time):
         self._server = server
         self._handler = handler
         self._deserializer = deserializer
+        self._batch_size = batch_size
+        self._batch = batch
+        self._spawn = spawn or call_handler
+        self.shedder = shedder
+        self.metrics = metrics
+        self._clock = clock
 
     def __call__(self, socket):
+        spawn = self._spawn
+        handler = self._handler
+        server = self._server
+        metrics = self.metrics
+        if self._batch:
+            received_list = list(self.drain(socket))
+            if received_list:
+                if metrics:
+                    self._measured(metrics, len(received_list), spawn,
+                            handler, server, socket, received_list)
+                else:
+                    spawn(handler, server, socket, received_list)
+            return
+        for received in self.drain(socket):
+            if metrics:
+                self._measured(metrics, 1, spawn, handler, server, socket,
+                        received)
+            else:
+                spawn(handler, server, socket, received)
+
+    def _measured(self, metrics, count, spawn, *args):
+        clock = self._clock
+        start = clock()
+        try:
+            spawn(*args)
+        except Exception:
+            metrics.errors += 1
+            raise
+        metrics.record_handled(clock() - start, count=count)
+
+    def drain(self, socket):
+        """Yields the received data on the socket. The first envelope is
+        expected to be waiting. Afterwards, it stops as soon as the socket has
+        nothing left or the batch size is reached. Shed data counts towards
+        the batch size but isn't yielded.
+        """
+        deserializer = self._deserializer
+        compression = socket.compression
+        shedder = self.shedder
+        metrics = self.metrics
         envelope = socket.receive_envelope()
-        received = ReceivedData(envelope, self._deserializer)
-        self._handler(self._server, socket, received)
+        for i in xrange(self._batch_size):
+            if i:
+                envelope = socket.receive_envelope(block=False)
+                if envelope is None:
+                    break
+            if metrics:
+                metrics.record_received(envelope)
+            received = ReceivedData(envelope, deserializer,
+                    compression=compression)
+            if shedder:
+                reason = shedder.reason(received, shedder.clock())
+                if reason:
+                    shedder.shed(socket, received, reason)
+                    continue
+            yield received
 
 
 class SocketDescription(object):
@@ -120,34 +278,121 @@ class SocketDescription(object):
         data in the envelope
     :param default_options: (optional) Default list of 2-tuple options to apply
         to the socket
+    :param copy: (optional) Set to False so that the socket receives envelopes
+        without copying their frames. Useful for servers that mostly forward
+        data. Defaults to True
+    :param batch_size: (optional) The most envelopes handled each time the
+        socket is ready. Can be overridden by the ``batch_size`` in the
+        socket's settings. 'rep' and 'req' sockets whose handlers are
+        spawned, such as in a green server, always handle one at a time.
+        Defaults to 1
+    :param batch: (optional) Set to True to call the input handler once with a
+        list of received data. Not allowed for 'rep' and 'req' sockets.
+        Defaults to False
+    :param execution: (optional) An execution policy that runs the input
+        handler somewhere other than the poll loop. Not allowed for 'rep' and
+        'req' sockets. Defaults to None which runs the handler inline
+    :param shedding: (optional) A :class:`~dploylib.servers.Shedding` policy
+        for requests received on the socket. Only 'rep' and 'router' sockets
+        can fail shed requests. Defaults to None which handles every request
+    :param compression: (optional) A
+        :class:`~dploylib.transport.compression.Compression` used by default
+        for the socket's ``send_obj`` and ``send_text``. Can be overridden by
+        the ``compression`` in the socket's settings, either the name of a
+        compressor or a dictionary of its arguments. Defaults
+        to None which doesn't compress
     """
     def __init__(self, name, socket_type, setup_type, input_handler=None,
-            deserializer=None, default_options=None):
+            deserializer=None, default_options=None, copy=True, batch_size=1,
+            batch=False, execution=None, shedding=None, compression=None):
+        if execution and socket_type in LOCKSTEP_SOCKET_TYPES:
+            raise ValueError('"%s" sockets must reply before receiving again '
+                    'so their handlers can only run inline' % socket_type)
+        if batch and socket_type in LOCKSTEP_SOCKET_TYPES:
+            raise ValueError('"%s" sockets must reply before receiving again '
+                    'so their handlers can\'t take batches' % socket_type)
+        if (shedding and shedding.fail and
+                socket_type not in REPLY_SOCKET_TYPES):
+            raise ValueError('"%s" sockets can\'t reply to shed requests' %
+                    socket_type)
         self._socket_type = socket_type
         self._setup_type = setup_type
         self._input_handler = input_handler
         self._deserializer = deserializer
         self._name = name
-
-    def create_socket(self, context, uri, options):
-        socket = context.socket(self._socket_type)
-        setup_method = getattr(socket, self._setup_type)
-        setup_method(uri)
+        self._copy = copy
+        self._batch_size = batch_size
+        self._batch = batch
+        self._execution = execution
+        self._shedding = shedding
+        self._compression = compression
+
+    def create_socket(self, context, uri, options, setup_type=None):
+        """Create the described socket. Options are set before the socket is
+        bound or connected so options like ``hwm`` apply to every connection.
+
+        :param context: A :class:`~dploylib.transport.Context`
+        :param uri: The uri to bind or connect to
+        :param options: A list of 2-tuple options to apply to the socket
+        :param setup_type: (optional) Overrides the described setup type
+        """
+        socket = context.socket(self._socket_type, copy=self._copy)
         for option_name, option_value in options:
             socket.set_option(option_name, option_value)
+        setup_method = getattr(socket, setup_type or self._setup_type)
+        setup_method(uri)
         return socket
 
     @property
     def name(self):
         return self._name
 
-    def handler(self, server):
-        """A SocketHandlerWrapper"""
+    @property
+    def socket_type(self):
+        return self._socket_type
+
+    @property
+    def setup_type(self):
+        return self._setup_type
+
+    @property
+    def compression(self):
+        return self._compression
+
+    def handler(self, server, batch_size=None, spawn=None, max_age=None,
+            metrics=None):
+        """A SocketHandlerWrapper
+
+        :param server: The server the handler belongs to
+        :param batch_size: (optional) Overrides the description's batch size
+        :param spawn: (optional) A callable used to call the input handler
+        :param max_age: (optional) Sheds requests older than this many
+            seconds. Overrides the max age of the description's shedding
+            policy
+        :param metrics: (optional) The
+            :class:`~dploylib.transport.metrics.SocketMetrics` of the socket
+        """
         input_handler = self._input_handler
         if not input_handler:
             return None
+        execution = self._execution
+        if execution:
+            spawn = execution.executor(server, self._name, input_handler,
+                    self._deserializer)
+        shedding = self._shedding
+        if max_age is not None and not shedding:
+            shedding = Shedding()
+        shedder = None
+        if shedding:
+            shedder = shedding.shedder(self._socket_type, max_age=max_age)
+        batch_size = batch_size or self._batch_size
+        if spawn and self._socket_type in LOCKSTEP_SOCKET_TYPES:
+            # A spawned handler may not have replied before the next receive
+            batch_size = 1
         return SocketHandlerWrapper(server, self._input_handler,
-                self._deserializer)
+                self._deserializer, batch_size=batch_size,
+                batch=self._batch, spawn=spawn, shedder=shedder,
+                metrics=metrics)
 
 
 class ServerMeta(type):
@@ -180,8 +425,21 @@ class ServerDescription(object):
 
 
 class DployServer(object):
-    """The actual server behind the scenes"""
+    """The actual server behind the scenes
+
+    Every socket added from a description collects metrics in
+    :attr:`metrics`. Set ``stats`` in the server's settings to publish
+    :meth:`stats` periodically on a pub socket::
+
+        "stats": {"uri": "tcp://127.0.0.1:5600", "interval": 5}
+
+    The stats socket binds unless ``setup_type`` is ``connect``. The
+    interval is in seconds and defaults to 10.
+    """
     logger = logger
+    # Called with a handler and its arguments to run input handlers. None
+    # runs them directly on the poll loop
+    spawn_handler = None
 
     def __init__(self, name, settings, control_uri, context,
             poll_loop=None):
@@ -191,12 +449,22 @@ class DployServer(object):
         self._control_uri = control_uri
         self._control_socket = None
         self._poll_loop = poll_loop or PollLoop.new()
+        self._startups = []
+        self._teardowns = []
+        self._shedders = {}
+        self.metrics = Metrics()
         self.sockets = SocketStorage()
 
+    @property
+    def context(self):
+        return self._context
+
     def connect_to_control(self):
         control_uri = self._control_uri
         control_socket = self._context.socket('sub')
         control_socket.set_option('subscribe', '')
+        control_socket.set_option('subscribe',
+                constants.SERVER_CONTROL_TOPIC + self._name)
         control_socket.connect(control_uri)
         self._control_socket = control_socket
         self.add_socket('_server_control', control_socket,
@@ -210,15 +478,108 @@ class DployServer(object):
     def add_setup(self, setup_func):
         setup_func(self)
 
+    def add_startup(self, startup_func):
+        """Add a function that is called before the server starts polling"""
+        self._startups.append(startup_func)
+
+    def add_teardown(self, teardown_func):
+        """Add a function that is called after the server stops"""
+        self._teardowns.append(teardown_func)
+
+    def call_later(self, delay, callback, *args):
+        """Run a callback once on the server's poll loop after a delay in
+        seconds. Returns a timer that can be cancelled.
+        """
+        return self._poll_loop.call_later(delay, callback, *args)
+
+    def call_every(self, interval, callback, *args):
+        """Run a callback on the server's poll loop every interval seconds.
+        Returns a timer that can be cancelled.
+        """
+        return self._poll_loop.call_every(interval, callback, *args)
+
+    def send_envelope(self, socket, envelope):
+        """Send an envelope without blocking the server. Envelopes that the
+        socket can't take because it is at its high water mark are queued
+        and sent as soon as the socket is writable. Returns True if the
+        envelope was sent immediately.
+
+        A socket's queue is limited by ``max_queue`` in its settings. When
+        the queue is full ``queue_overflow`` decides if
+        :class:`~dploylib.transport.poll.OutputQueueFull` is raised
+        (``raise``, the default), the new envelope is dropped (``drop_new``)
+        or the oldest waiting envelope is dropped (``drop_oldest``).
+
+        :param socket: The :class:`~dploylib.transport.Socket` to send on
+        :param envelope: The :class:`~dploylib.transport.Envelope` to send
+        """
+        return self._poll_loop.send_envelope(socket, envelope)
+
+    def output_stats(self):
+        """Counters for the output of each socket sent on with
+        :meth:`send_envelope`. See
+        :meth:`~dploylib.transport.poll.OutputQueue.stats`
+        """
+        poll_loop = self._poll_loop
+        return dict((name, poll_loop.output_stats(socket))
+                for name, socket in self.sockets.iteritems())
+
+    def shed_counts(self):
+        """The number of requests shed on each socket by reason"""
+        return dict((name, shedder.counts())
+                for name, shedder in self._shedders.iteritems())
+
+    def stats(self):
+        """A dictionary of everything known about how the server is doing.
+        The metrics, output stats and shed counts of each socket by name.
+        """
+        return dict(name=self._name, time=time.time(),
+                metrics=self.metrics.snapshot(), output=self.output_stats(),
+                shed=self.shed_counts())
+
+    def publish_stats(self):
+        """Publish :meth:`stats` on the stats socket"""
+        self.sockets._stats.send_obj(StatsData(self.stats()), id=self._name)
+
+    def setup_stats(self, stats_info):
+        """Create the stats socket and publish on it periodically
+
+        :param stats_info: A dictionary with the ``uri`` of the stats socket
+            and optionally its ``setup_type``, ``options`` and ``interval``
+        """
+        socket = self._context.socket('pub')
+        for option_name, option_value in stats_info.get('options', []):
+            socket.set_option(option_name, option_value)
+        setup_method = getattr(socket, stats_info.get('setup_type', 'bind'))
+        setup_method(stats_info['uri'])
+        self.sockets.register('_stats', socket)
+        return self.call_every(stats_info.get('interval',
+            DEFAULT_STATS_INTERVAL), self.publish_stats)
+
     def start(self):
-        """Run the poll loop for the server"""
+        """Run the poll loop for the server. Once the server stops, even if a
+        handler raised, the teardown functions are called and the server's
+        sockets are closed so a restarted server can bind the same uris.
+        """
         self.logger.debug('Starting server "%s"' % self._name)
-        while True:
-            try:
-                self._poll_loop.poll()
-            except ServerStopped:
-                self.logger.debug('Stopping server "%s"' % self._name)
-                break
+        try:
+            for startup_func in self._startups:
+                startup_func()
+            while True:
+                try:
+                    self._poll_loop.poll()
+                except ServerStopped:
+                    self.logger.debug('Stopping server "%s"' % self._name)
+                    break
+        finally:
+            for teardown_func in self._teardowns:
+                teardown_func()
+            self.close(linger=0)
+
+    def close(self, linger=None):
+        """Close all of the server's sockets"""
+        for socket in self.sockets:
+            socket.close(linger=linger)
 
     def add_socket(self, name, socket, handler=None):
         """Add the socket and it's handler"""
@@ -230,15 +591,46 @@ class DployServer(object):
         socket_info = self.settings.socket_info(name)
         uri = socket_info['uri']
         options = socket_info.get('options', [])
-        socket = description.create_socket(self._context, uri, options)
-        handler = description.handler(self)
+        hwm = socket_info.get('hwm')
+        if hwm is not None:
+            options = [('hwm', hwm)] + list(options)
+        socket = description.create_socket(self._context, uri, options,
+                setup_type=socket_info.get('setup_type'))
+        socket_metrics = socket.metrics = self.metrics.socket(name)
+        compression = description.compression
+        compression_settings = socket_info.get('compression')
+        if compression_settings is not None:
+            compression = Compression.from_settings(compression_settings)
+        if compression:
+            socket.compression = compression
+        handler = description.handler(self,
+                batch_size=socket_info.get('batch_size'),
+                spawn=self.spawn_handler,
+                max_age=socket_info.get('max_age'),
+                metrics=socket_metrics)
+        if handler and handler.shedder:
+            self._shedders[name] = handler.shedder
         self.add_socket(name, socket, handler)
+        max_queue = socket_info.get('max_queue')
+        if max_queue is not None:
+            self._poll_loop.configure_output(socket, max_depth=max_queue,
+                    overflow=socket_info.get('queue_overflow', 'raise'))
 
 
 class ServerStopped(Exception):
     pass
 
 
+class StatsData(object):
+    """Sends a server's stats with :meth:`~dploylib.transport.Socket.send_obj`
+    """
+    def __init__(self, stats):
+        self._stats = stats
+
+    def serialize(self):
+        return self._stats
+
+
 class SocketStorage(object):
     """The storage of the sockets"""
     def __init__(self):
@@ -247,6 +639,13 @@ class SocketStorage(object):
     def register(self, name, socket):
         self._storage[name] = socket
 
+    def __iter__(self):
+        return self._storage.itervalues()
+
+    def iteritems(self):
+        """Iterate over the names and sockets"""
+        return self._storage.iteritems()
+
     def __getattr__(self, name):
         return self._storage[name]
 
@@ -271,6 +670,9 @@ class Server(DployServer):
         server = cls.initialize(name, settings, control_uri, context)
         server.connect_to_control()
         server.setup_sockets()
+        stats_info = settings.stats_info()
+        if stats_info:
+            server.setup_stats(stats_info)
         server.setup()
         return server
 
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+"""
+dploylib.servers.shedding
+~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Load shedding drops requests that are no longer worth handling before their
+input handler is called. When a server falls behind this keeps it working on
+requests that clients are still waiting for instead of a stale backlog::
+
+    class QueueServer(servers.Server):
+        @servers.bind_in('jobs', 'router',
+                shedding=servers.Shedding(max_age=0.5, fail=True))
+        def queue_job(self, socket, received):
+            ...
+
+A request is shed if the deadline in its envelope
+:class:`~dploylib.transport.Header` has passed or, when ``max_age`` is set,
+if it was sent more than ``max_age`` seconds ago. Requests sent without a
+header are never shed. Ages are measured against the sender's clock so
+servers and clients on different hosts need synchronized clocks.
+
+Shed requests are dropped. With ``fail=True`` the sender is sent a reply with
+the mimetype :data:`SHED_MIMETYPE` and a body of ``expired`` or ``stale`` so
+it can fail fast instead of waiting. Requests on ``rep`` sockets must be
+answered so they are always failed.
+"""
+
+import time
+
+SHED_MIMETYPE = 'application/x-dploy-shed'
+SHED_EXPIRED = 'expired'
+SHED_STALE = 'stale'
+
+# Socket types that can reply to the sender of a request
+REPLY_SOCKET_TYPES = ('rep', 'router')
+
+
+class Shedding(object):
+    """A load shedding policy for an input socket
+
+    :param max_age: (optional) Seconds a request can wait before it is shed.
+        Defaults to None which only sheds requests past their deadline
+    :param fail: (optional) Set to True to reply to shed requests instead of
+        dropping them. Only for 'rep' and 'router' sockets. Defaults to False
+    """
+    def __init__(self, max_age=None, fail=False):
+        self.max_age = max_age
+        self.fail = fail
+
+    def shedder(self, socket_type, max_age=None):
+        """Creates a :class:`Shedder` for a socket
+
+        :param socket_type: The type of the socket
+        :param max_age: (optional) Overrides the policy's max age
+        """
+        if max_age is None:
+            max_age = self.max_age
+        fail = self.fail or socket_type == 'rep'
+        return Shedder(max_age=max_age, fail=fail)
+
+
+class Shedder(object):
+    """Sheds requests for a single socket and counts them
+
+    :param max_age: (optional) Seconds a request can wait before it is shed
+    :param fail: (optional) Set to True to reply to shed requests
+    :param clock: (optional) Function returning the current unix time
+    """
+    def __init__(self, max_age=None, fail=False, clock=time.time):
+        self._max_age = max_age
+        self._fail = fail
+        self.clock = clock
+        self.expired = 0
+        self.stale = 0
+
+    def reason(self, received, now):
+        """The reason to shed received data. None if it should be handled
+
+        :param received: A :class:`~dploylib.transport.ReceivedData`
+        :param now: The current unix time
+        """
+        header = received.header
+        if header is None:
+            return None
+        if header.expired(now=now):
+            return SHED_EXPIRED
+        max_age = self._max_age
+        if max_age is not None:
+            age = header.age(now=now)
+            if age is not None and age > max_age:
+                return SHED_STALE
+        return None
+
+    def shed(self, socket, received, reason):
+        """Counts shed data and fails the request if configured to
+
+        :param socket: The socket the data was received on
+        :param received: The shed :class:`~dploylib.transport.ReceivedData`
+        :param reason: The reason returned by :meth:`reason`
+        """
+        if reason == SHED_EXPIRED:
+            self.expired += 1
+        else:
+            self.stale += 1
+        if self._fail:
+            envelope = received.envelope
+            socket.send_envelope(envelope.response_envelope(SHED_MIMETYPE,
+                    reason))
+
+    def counts(self):
+        """A dictionary of the number of requests shed for each reason"""
+        return {SHED_EXPIRED: self.expired, SHED_STALE: self.stale}
@@ -99,6 +99,38 @@ class ServerSettings(object):
     def socket_info(self, socket_name):
         return self._settings.socket_info(self._server_name, socket_name)
 
+    def stats_info(self):
+        """The server's stats socket settings or None"""
+        return self._settings.server_stats(self._server_name)
+
+
+class ReplicaServerSettings(ServerSettings):
+    """Settings for a replica of a server. Any socket that is fronted by a
+    replica broker is replaced by the broker's internal socket.
+
+    :param server_name: The name of the replicated server
+    :param settings: The :class:`Settings`
+    :param socket_overrides: A dictionary of socket names to socket info
+    :param stats_override: (optional) The stats socket settings used instead
+        of the server's
+    """
+    def __init__(self, server_name, settings, socket_overrides,
+            stats_override=None):
+        super(ReplicaServerSettings, self).__init__(server_name, settings)
+        self._socket_overrides = socket_overrides
+        self._stats_override = stats_override
+
+    def socket_info(self, socket_name):
+        socket_info = self._socket_overrides.get(socket_name)
+        if socket_info:
+            return socket_info
+        return super(ReplicaServerSettings, self).socket_info(socket_name)
+
+    def stats_info(self):
+        if self._stats_override:
+            return self._stats_override
+        return super(ReplicaServerSettings, self).stats_info()
+
 
 class Settings(object):
     def __init__(self, data):
@@ -129,6 +161,26 @@ class Settings(object):
                     'Server "%s" not included in configuration' % server_name)
         return server_info
 
+    def server_replicas(self, server_name):
+        """The number of instances of a server to run. This is the optional
+        ``replicas`` key of the server's settings. Returns None if it isn't
+        set.
+        """
+        return self.server_info(server_name).get('replicas')
+
+    def server_supervision(self, server_name):
+        """The supervision settings of a server. This is the optional
+        ``supervision`` key of the server's settings. Returns None if it
+        isn't set.
+        """
+        return self.server_info(server_name).get('supervision')
+
+    def server_stats(self, server_name):
+        """The settings of a server's stats socket. This is the optional
+        ``stats`` key of the server's settings. Returns None if it isn't set.
+        """
+        return self.server_info(server_name).get('stats')
+
     def server_settings(self, server_name):
         # Verify the server exists
         self.server_info(server_name)
@@ -7,19 +7,66 @@ dploylib.services.coordinator
 This module defines the ServerCoordinator.
 """
 
+import os
+import heapq
+import time
+import tempfile
 import threading
+import warnings
+import multiprocessing
 import logging
-from dploylib.transport import Context
+import zmq
+from dploylib.transport import Context, PollLoop
 from .. import constants
+from .replicas import replica_spawn_settings
+from .supervision import Supervision
+from .utils import ServerConfigError
 
 
 logger = logging.getLogger('dploylib.services.coordinator')
 
+# Milliseconds a server's status report can wait to be sent
+STATUS_TIMEOUT = 1000
+
 
 class ServerCoordinatorFailing(Exception):
     pass
 
 
+class ServersNotReady(ServerCoordinatorFailing):
+    pass
+
+
+def ipc_uri(uri):
+    """Convert an ``inproc://`` uri into an ``ipc://`` uri that is unique to
+    the current process. Other uris are returned untouched.
+
+    :param uri: A zeromq uri
+    """
+    if not uri.startswith('inproc://'):
+        return uri
+    name = uri[len('inproc://'):]
+    filename = 'dploy-%d-%s' % (os.getpid(), name)
+    return 'ipc://%s' % os.path.join(tempfile.gettempdir(), filename)
+
+
+def report_status(status_socket, name, status):
+    """Report a server's status to its coordinator if it has a status socket
+
+    :param status_socket: A socket connected to the coordinator's status
+        socket or None
+    :param name: The name of the server
+    :param status: The status of the server
+    """
+    if not status_socket:
+        return
+    try:
+        status_socket.send_text(status, id=name)
+    except zmq.Again:
+        # The coordinator has given up waiting for the server
+        logger.warning('Server "%s" could not report "%s"' % (name, status))
+
+
 class ServerCoordinator(object):
     """A generic server coordinator meant to be subclassed. It does not do any
     of the spawning of servers on it's own.
@@ -31,12 +78,27 @@ class ServerCoordinator(object):
     # This must be compatible with threading.Thread
     spawner = None
     logger = logger
+    # Set to True so servers report when they start and stop over the status
+    # socket
+    status_reports = False
+    # Set to True if the coordinator restarts supervised servers
+    supervises = False
 
     def __init__(self, control_uri='inproc://control', context=None):
         self._control_uri = control_uri
         self._context = context
         self._control_socket = None
+        self._status_uri = None
+        self._status_socket = None
         self._spawns = []
+        # Names of the servers that have started and that have stopped or
+        # failed
+        self._ready = set()
+        self._stopped = set()
+        # Names of the servers subscribed to the control socket
+        self._subscribed = set()
+        self._spawn_settings = []
+        self._supervisors = {}
 
     @property
     def context(self):
@@ -46,28 +108,186 @@ class ServerCoordinator(object):
         return context
 
     def setup_servers(self, server_config, settings):
-        """Setup the servers"""
+        """Setup the servers. Servers with more than one replica are set up
+        as their replicas and a broker that fronts them.
+
+        :raises: :class:`~dploylib.services.utils.ServerConfigError` if a
+            server is supervised but the coordinator doesn't restart servers
+        """
         spawn_settings = []
+        supervisors = {}
         for name, server in server_config:
-            server_settings = settings.server_settings(name)
-            spawn_settings.append((name, server, server_settings))
+            supervision = self.supervision(name, server_config, settings)
+            replicas = self.replica_count(name, server_config, settings)
+            if replicas > 1:
+                server_spawn_settings = replica_spawn_settings(name, server,
+                    settings, replicas, self.internal_uri)
+            else:
+                server_spawn_settings = [(name, server,
+                    settings.server_settings(name))]
+            if supervision:
+                if not self.supervises:
+                    raise ServerConfigError('Server "%s" is supervised but '
+                            '%s doesn\'t restart servers' %
+                            (name, self.__class__.__name__))
+                for spawn_name, spawn_server, spawn_server_settings in \
+                        server_spawn_settings:
+                    supervisors[spawn_name] = supervision.supervisor()
+            spawn_settings.extend(server_spawn_settings)
         self._spawn_settings = spawn_settings
+        self._supervisors = supervisors
+
+    def replica_count(self, name, server_config, settings):
+        """The number of instances of a server to run. The settings take
+        precedence over the server configuration.
+        """
+        replicas = settings.server_replicas(name)
+        if replicas is None and hasattr(server_config, 'replicas'):
+            replicas = server_config.replicas(name)
+        return replicas or 1
+
+    def supervision(self, name, server_config, settings):
+        """The :class:`~dploylib.services.supervision.Supervision` of a
+        server or None if it isn't supervised. The settings take precedence
+        over the server configuration.
+        """
+        supervision_settings = settings.server_supervision(name)
+        if supervision_settings is not None:
+            return Supervision.from_settings(supervision_settings)
+        if hasattr(server_config, 'supervision'):
+            return server_config.supervision(name)
+        return None
+
+    def internal_uri(self, name):
+        """A uri for sockets that are only used between the coordinated
+        servers
+        """
+        return 'inproc://%s' % name
 
     def start_control_socket(self):
         """Start the control socket. The control socket allows a coordinator to
         stop any of it's controlled servers
+
+        It is an xpub socket so the coordinator can see each server subscribe.
+        Every server subscribes to its own topic,
+        :data:`~dploylib.constants.SERVER_CONTROL_TOPIC` followed by its name.
         """
         control_uri = self._control_uri
         self.logger.debug('Starting control socket @ "%s"' % control_uri)
-        control_socket = self.context.socket('pub')
+        control_socket = self.context.socket('xpub')
+        # Report every subscription instead of only the first for each topic
+        control_socket.set_option('xpub_verbose', 1)
         control_socket.bind(control_uri)
         self._control_socket = control_socket
 
+    def start_status_socket(self):
+        """Start the status socket. Servers report to the coordinator over
+        the status socket when they have started and when they stop.
+        """
+        status_uri = self.internal_uri('dploy-status-%x' % id(self))
+        self.logger.debug('Starting status socket @ "%s"' % status_uri)
+        status_socket = self.context.socket('pull')
+        status_socket.bind(status_uri)
+        self._status_uri = status_uri
+        self._status_socket = status_socket
+
+    def receive_status(self, timeout=None):
+        """Wait for a server to report its status. Returns a tuple of the
+        server name and its status or None if the timeout passes first.
+
+        :param timeout: (optional) Seconds to wait. Defaults to None which
+            waits forever
+        """
+        status_socket = self._status_socket
+        if timeout is not None:
+            if not status_socket.poll(timeout * 1000):
+                return None
+        envelope = status_socket.receive_envelope()
+        return envelope.id, envelope.data
+
+    def _record_status(self, name, status):
+        """Record a server's status. Returns True if the server has stopped"""
+        self.logger.debug('Server "%s" reported "%s"' % (name, status))
+        if status == constants.SERVER_STARTED:
+            self._ready.add(name)
+            return False
+        if status in (constants.SERVER_STOPPED, constants.SERVER_FAILED):
+            self._ready.discard(name)
+            self._stopped.add(name)
+            return True
+        return False
+
+    def _handle_status(self, status_socket):
+        envelope = status_socket.receive_envelope()
+        self._record_status(envelope.id, envelope.data)
+
+    def _handle_subscription(self, control_socket):
+        # An xpub socket receives a single frame for each (un)subscription
+        # that starts with 1 for a subscription, followed by the topic
+        frame = control_socket.zmq_socket.recv()
+        topic = frame[1:]
+        prefix = constants.SERVER_CONTROL_TOPIC
+        if not topic.startswith(prefix):
+            return
+        name = topic[len(prefix):]
+        if frame.startswith('\x01'):
+            self._subscribed.add(name)
+        else:
+            self._subscribed.discard(name)
+
+    def drain_subscriptions(self):
+        """Handle the subscriptions waiting on the control socket so they
+        don't pile up while servers connect and restart
+        """
+        control_socket = self._control_socket
+        while control_socket.poll(0):
+            self._handle_subscription(control_socket)
+
+    def wait_until_ready(self, timeout=None):
+        """Wait until every server is ready. A server is ready once it has
+        set up all of its sockets and its subscription to the control socket
+        has reached the coordinator. Servers start in parallel so this takes
+        as long as the slowest server.
+
+        Supervised servers are only restarted by :meth:`wait`, so a
+        supervised server that fails while it is being set up makes this
+        raise as well.
+
+        :param timeout: (optional) Seconds to wait. Defaults to None which
+            waits forever
+        :raises: :class:`ServersNotReady` if the timeout passes first or
+            :class:`ServerCoordinatorFailing` if a server stops
+        """
+        names = set(name for name, spawn in self._spawns)
+        poll_loop = PollLoop.new()
+        poll_loop.register(self._status_socket, self._handle_status)
+        poll_loop.register(self._control_socket, self._handle_subscription)
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            if names & self._stopped:
+                raise ServerCoordinatorFailing('Servers %s stopped before '
+                        'they were ready' % sorted(names & self._stopped))
+            waiting = (names - self._ready) | (names - self._subscribed)
+            if not waiting:
+                break
+            poll_timeout = None
+            if deadline is not None:
+                poll_timeout = (deadline - time.time()) * 1000
+                if poll_timeout <= 0:
+                    raise ServersNotReady('Servers %s not ready after %ss' %
+                            (sorted(waiting), timeout))
+            poll_loop.poll(timeout=poll_timeout)
+        self.logger.debug('All %d server(s) are ready' % len(names))
+
     def start(self):
         """Start the servers that are controlled by the server coordinator"""
         self.logger.debug('Starting coordinator')
         spawns = self._spawns
         self.start_control_socket()
+        if self.status_reports:
+            self.start_status_socket()
         for name, server, server_settings in self._spawn_settings:
             context = self.server_context(name, server)
             spawn = self.spawn(server, name, server_settings, context=context)
@@ -104,33 +324,193 @@ class ServerCoordinator(object):
             **kwargs):
         """Start a server. Meant to be used in a new thread, process or
         greenlet
+
+        If the coordinator has a status socket the server reports when it has
+        started and when it stops or fails.
         """
-        new_server = server.new(name, server_settings, control_uri, **kwargs)
-        new_server.start()
+        status_socket = None
+        status_context = None
+        if self._status_uri:
+            context = kwargs.get('context')
+            if not context:
+                # Spawned processes can't use the coordinator's context
+                context = status_context = Context.new()
+            status_socket = context.socket('push')
+            status_socket.set_option('sndtimeo', STATUS_TIMEOUT)
+            status_socket.connect(self._status_uri)
+        # Anything that ends the server other than a clean stop, including
+        # exceptions that aren't an Exception, is reported as a failure
+        stopped_status = constants.SERVER_FAILED
+        try:
+            new_server = server.new(name, server_settings, control_uri,
+                    **kwargs)
+            report_status(status_socket, name, constants.SERVER_STARTED)
+            new_server.start()
+            stopped_status = constants.SERVER_STOPPED
+        finally:
+            report_status(status_socket, name, stopped_status)
+            if status_socket:
+                status_socket.close(linger=STATUS_TIMEOUT)
+            if status_context:
+                # Waits for the reports to be sent before a process exits
+                status_context.zmq_context.term()
 
 
 class ThreadedServerCoordinator(ServerCoordinator):
     """A :class:`ServerCoordinator` that uses threads to spawn servers
 
-    :param thread_poll_duration: Duration in seconds to wait for each server
-        during the wait method of the coordinator. Defaults to 0.5.
+    Servers report over an inproc status socket when they stop, so waiting
+    and stopping only wake up when something has actually happened.
+
+    Supervised servers that stop are restarted in a new thread while the
+    coordinator waits. See :mod:`dploylib.services.supervision`.
+
+    :param shutdown_resend_interval: Seconds to wait for a server to stop
+        before the shutdown is published again. A server that connects to the
+        control socket just as the shutdown is published can miss it.
+        Defaults to 1.0
+    :param stop_timeout: Seconds :meth:`stop` waits for the servers to stop.
+        Servers that haven't stopped by then are left running. Defaults to
+        10.0
+    :param thread_poll_duration: Deprecated and ignored. Waiting no longer
+        polls the threads
     """
     spawner = threading.Thread
+    status_reports = True
+    supervises = True
 
     def __init__(self, *args, **kwargs):
-        self._thread_poll_duration = kwargs.pop('thread_poll_duration', 0.5)
-        self._starting_thread_count = threading.active_count()
+        if 'thread_poll_duration' in kwargs:
+            kwargs.pop('thread_poll_duration')
+            warnings.warn('thread_poll_duration is deprecated and ignored',
+                    DeprecationWarning, stacklevel=2)
+        self._shutdown_resend_interval = kwargs.pop(
+                'shutdown_resend_interval', 1.0)
+        self._stop_timeout = kwargs.pop('stop_timeout', 10.0)
         super(ThreadedServerCoordinator, self).__init__(*args, **kwargs)
 
     def wait(self):
-        # Threads are stored as the spawns of a server coordinator
-        threads = self._spawns
+        # A heap of the times and names of servers waiting to restart
+        restarts = []
+        while True:
+            self.drain_subscriptions()
+            timeout = None
+            if restarts:
+                timeout = max(0, restarts[0][0] - time.time())
+            status = self.receive_status(timeout=timeout)
+            if status is None:
+                restart_at, name = heapq.heappop(restarts)
+                self.restart(name)
+                continue
+            name, status = status
+            if not self._record_status(name, status):
+                continue
+            delay = self.restart_delay(name, status)
+            if delay is None:
+                self.logger.debug('Server "%s" has died' % name)
+                raise ServerCoordinatorFailing(
+                        'Some servers have stopped working')
+            self.logger.warning('Server "%s" stopped. Restarting in %.2fs' %
+                    (name, delay))
+            heapq.heappush(restarts, (time.time() + delay, name))
+
+    def restart_delay(self, name, status):
+        """Seconds to wait before restarting a server that has stopped or
+        None if it isn't restarted
+        """
+        supervisor = self._supervisors.get(name)
+        if not supervisor:
+            return None
+        return supervisor.restart_delay(status == constants.SERVER_FAILED)
+
+    def restart(self, name):
+        """Restart a server that has stopped in a new thread"""
+        spawns = self._spawns
+        for index, (spawn_name, thread) in enumerate(spawns):
+            if spawn_name == name:
+                break
+        for spawn_name, server, server_settings in self._spawn_settings:
+            if spawn_name == name:
+                break
+        # The old thread exits right after it reports that it stopped
+        thread.join()
+        context = self.server_context(name, server)
+        spawns[index] = (name, self.spawn(server, name, server_settings,
+            context=context))
+        self._stopped.discard(name)
+        self.logger.debug('Server "%s" restarted' % name)
+
+    def stop(self):
+        control_socket = self._control_socket
+        remaining = set(name for name, thread in self._spawns)
+        remaining -= self._stopped
+        deadline = time.time() + self._stop_timeout
+        control_socket.send_text(constants.COORDINATOR_SHUTDOWN)
+        while remaining:
+            timeout = min(self._shutdown_resend_interval,
+                    deadline - time.time())
+            if timeout <= 0:
+                logger.warning('Servers %s did not stop after %ss' %
+                        (sorted(remaining), self._stop_timeout))
+                break
+            status = self.receive_status(timeout=timeout)
+            if status is None:
+                logger.debug('Still waiting for %d server(s)' %
+                        len(remaining))
+                control_socket.send_text(constants.COORDINATOR_SHUTDOWN)
+                continue
+            name, status = status
+            if self._record_status(name, status):
+                remaining.discard(name)
+        # Servers that have reported are already finishing
+        for name, thread in self._spawns:
+            if name not in remaining:
+                thread.join(max(0, deadline - time.time()))
+        self._status_socket.close(linger=0)
+
+
+class ProcessServerCoordinator(ServerCoordinator):
+    """A :class:`ServerCoordinator` that spawns each server in its own process
+    so that servers aren't limited to sharing a single CPU core.
+
+    Processes can't share ``inproc://`` sockets, so an ``inproc://`` control
+    uri is automatically switched to an ``ipc://`` uri. Each server process
+    also creates its own :class:`~dploylib.transport.Context`.
+
+    Servers aren't restarted. Setting up a supervised server raises a
+    :class:`~dploylib.services.utils.ServerConfigError`.
+
+    :param process_poll_duration: Duration in seconds to wait for each server
+        during the wait method of the coordinator. Defaults to 0.5.
+    """
+    spawner = multiprocessing.Process
+    status_reports = True
+
+    def __init__(self, control_uri='inproc://control', context=None,
+            process_poll_duration=0.5):
+        self._process_poll_duration = process_poll_duration
+        super(ProcessServerCoordinator, self).__init__(
+                control_uri=ipc_uri(control_uri), context=context)
+
+    def server_context(self, name, server):
+        """A context can't be shared between processes. Returns None so that
+        every server creates its own.
+        """
+        return None
+
+    def internal_uri(self, name):
+        return ipc_uri(super(ProcessServerCoordinator, self).internal_uri(name))
+
+    def wait(self):
+        processes = self._spawns
         while True:
+            self.drain_subscriptions()
             some_dead = False
-            for name, thread in threads:
-                thread.join(self._thread_poll_duration)
-                if not thread.is_alive():
-                    self.logger.debug('Server "%s" has died' % name)
+            for name, process in processes:
+                process.join(self._process_poll_duration)
+                if not process.is_alive():
+                    self.logger.debug('Server "%s" has died with exit code '
+                            '%s' % (name, process.exitcode))
                     some_dead = True
             if some_dead:
                 raise ServerCoordinatorFailing(
@@ -138,14 +518,18 @@ class ThreadedServerCoordinator(ServerCoordinator):
 
     def stop(self):
         control_socket = self._control_socket
-        starting_thread_count = self._starting_thread_count
+        processes = self._spawns
         while True:
             control_socket.send_text(constants.COORDINATOR_SHUTDOWN)
-            for name, thread in self._spawns:
-                thread.join(0.5)
-            remaining = threading.active_count() - starting_thread_count
+            for name, process in processes:
+                process.join(self._process_poll_duration)
+            remaining = len([name for name, process in processes
+                    if process.is_alive()])
             if remaining <= 0:
-                # All threads are done
+                # All processes are done
                 break
             else:
-                logger.debug('Still waiting for %d thread(s)' % remaining)
+                logger.debug('Still waiting for %d process(es)' % remaining)
+        # Closing the control and status sockets removes their ipc files
+        control_socket.close(linger=0)
+        self._status_socket.close(linger=0)
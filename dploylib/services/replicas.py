@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+"""
+dploylib.services.replicas
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Runs several instances of a server behind a broker. The broker binds the
+server's public uris and forwards to the replicas over internal sockets. The
+replicas connect to the broker instead of binding, so clients don't need to
+know how many replicas exist.
+
+Only bound sockets that spread work can be fronted by a broker. These are the
+``rep``, ``router`` and ``pull`` sockets. Connected sockets are left alone,
+every replica simply connects.
+
+A bound stats socket is fronted by the broker too. Each replica publishes its
+stats to the broker, which republishes all of them on the server's stats
+uri.
+"""
+
+from dploylib.servers.server import DployServer
+from dploylib.transport import Context
+from .config import ReplicaServerSettings
+from .utils import ServerConfigError
+
+# The socket types of the broker's frontend and backend for each socket type
+# that can be replicated.
+BROKER_SOCKET_TYPES = {
+    'rep': ('router', 'dealer'),
+    'router': ('router', 'dealer'),
+    'pull': ('pull', 'push'),
+}
+# Routes to the broker can also carry the replicas' stats
+BROKER_ROUTE_TYPES = dict(BROKER_SOCKET_TYPES, pub=('pub', 'sub'))
+
+STATS_ROUTE_NAME = '_stats'
+
+DEFAULT_FORWARD_BATCH_SIZE = 100
+
+
+class BrokerRoute(object):
+    """Describes one of the sockets fronted by a :class:`ReplicaBroker`
+
+    :param name: The name of the server's socket
+    :param socket_type: The server's socket type
+    :param frontend_info: The socket info of the server's socket
+    :param backend_uri: The internal uri that replicas connect to
+    """
+    def __init__(self, name, socket_type, frontend_info, backend_uri):
+        self.name = name
+        self.frontend_type, self.backend_type = \
+                BROKER_ROUTE_TYPES[socket_type]
+        self.frontend_info = frontend_info
+        self.backend_uri = backend_uri
+
+    @property
+    def bidirectional(self):
+        return self.backend_type == 'dealer'
+
+    @property
+    def fan_in(self):
+        """True if envelopes flow from the replicas to the frontend"""
+        return self.backend_type == 'sub'
+
+
+class BrokerSettings(object):
+    """Settings for a :class:`ReplicaBroker`
+
+    :param routes: A list of :class:`BrokerRoute`
+    """
+    def __init__(self, routes):
+        self.routes = routes
+
+
+class Forwarder(object):
+    """A poll loop handler that forwards envelopes to another socket without
+    decoding or copying them
+
+    :param target: The socket to forward to
+    :param batch_size: (optional) The most envelopes forwarded each time the
+        socket is ready
+    """
+    def __init__(self, target, batch_size=DEFAULT_FORWARD_BATCH_SIZE):
+        self._target = target
+        self._batch_size = batch_size
+
+    def __call__(self, socket):
+        target = self._target
+        target.send_envelope(socket.receive_envelope())
+        for i in xrange(self._batch_size - 1):
+            envelope = socket.receive_envelope(block=False)
+            if envelope is None:
+                break
+            target.send_envelope(envelope)
+
+
+class ReplicaBroker(DployServer):
+    """Forwards data between a server's public sockets and its replicas. The
+    broker stops like any other server when the coordinator shuts down.
+    """
+    @classmethod
+    def new(cls, name, settings, control_uri, context=None):
+        context = context or Context.new()
+        broker = cls(name, settings, control_uri, context)
+        broker.connect_to_control()
+        broker.setup_routes()
+        return broker
+
+    def setup_routes(self):
+        for route in self.settings.routes:
+            self.add_route(route)
+
+    def add_route(self, route):
+        context = self._context
+        frontend_info = route.frontend_info
+        frontend = context.socket(route.frontend_type, copy=False)
+        for option_name, option_value in frontend_info.get('options', []):
+            frontend.set_option(option_name, option_value)
+        frontend.bind(frontend_info['uri'])
+        backend = context.socket(route.backend_type, copy=False)
+        if route.fan_in:
+            backend.set_option('subscribe', '')
+        backend.bind(route.backend_uri)
+
+        if route.fan_in:
+            # A pub socket never has input
+            self.sockets.register('%s-frontend' % route.name, frontend)
+            self.add_socket('%s-backend' % route.name, backend,
+                    handler=Forwarder(frontend))
+            return
+        self.add_socket('%s-frontend' % route.name, frontend,
+                handler=Forwarder(backend))
+        if route.bidirectional:
+            self.add_socket('%s-backend' % route.name, backend,
+                    handler=Forwarder(frontend))
+        else:
+            # A push socket never has input
+            self.sockets.register('%s-backend' % route.name, backend)
+
+
+def replica_spawn_settings(name, server, settings, replicas, internal_uri):
+    """Creates the spawn settings to run replicas of a server and their
+    broker. The broker is always first.
+
+    :param name: The name of the server
+    :param server: The :class:`~dploylib.servers.Server` to replicate
+    :param settings: The service's :class:`~dploylib.services.config.Settings`
+    :param replicas: The number of replicas
+    :param internal_uri: A callable that creates an internal uri from a name
+    :returns: A list of 3-tuples of the name, server and settings to spawn
+    """
+    server_settings = settings.server_settings(name)
+    routes = []
+    socket_overrides = {}
+    for attr_name, description in server.socket_descriptions:
+        if description.setup_type != 'bind':
+            continue
+        socket_name = description.name
+        socket_type = description.socket_type
+        if socket_type not in BROKER_SOCKET_TYPES:
+            raise ServerConfigError('Server "%s" can\'t be replicated. '
+                    'Socket "%s" binds a "%s" socket' % (name, socket_name,
+                    socket_type))
+        socket_info = server_settings.socket_info(socket_name)
+        backend_uri = internal_uri('%s-%s-replicas' % (name, socket_name))
+        routes.append(BrokerRoute(socket_name, socket_type, socket_info,
+                backend_uri))
+        socket_overrides[socket_name] = dict(socket_info, uri=backend_uri,
+                setup_type='connect')
+    stats_override = None
+    stats_info = server_settings.stats_info()
+    if stats_info and stats_info.get('setup_type', 'bind') == 'bind':
+        backend_uri = internal_uri('%s-stats-replicas' % name)
+        routes.append(BrokerRoute(STATS_ROUTE_NAME, 'pub', stats_info,
+                backend_uri))
+        stats_override = dict(stats_info, uri=backend_uri,
+                setup_type='connect')
+
+    spawn_settings = [('%s-broker' % name, ReplicaBroker,
+            BrokerSettings(routes))]
+    for index in range(replicas):
+        replica_settings = ReplicaServerSettings(name, settings,
+                socket_overrides, stats_override=stats_override)
+        spawn_settings.append(('%s-%d' % (name, index), server,
+                replica_settings))
+    return spawn_settings
@@ -20,6 +20,10 @@ class ServiceFailing(Exception):
     pass
 
 
+class ServiceNotReady(ServiceFailing):
+    pass
+
+
 class Service(object):
     """The Service object provides a way to create a zeromq-based dploy
     service. In dploy, a the service object is in charge of a combination of
@@ -42,14 +46,26 @@ class Service(object):
         self._config_mapper = config_mapper or YAMLConfigMapper()
         self._coordinator = coordinator or ThreadedServerCoordinator()
 
-    def add_server(self, name, server_cls):
+    def add_server(self, name, server_cls, replicas=None, supervision=None):
         """Register a :class:`~dploylib.servers.server.Server` to the Service
         instance
 
         :param name: name of the server
         :param server_cls: A :class:`~dploylib.servers.server.Server`
+        :param replicas: (optional) The number of instances of the server to
+            run. The ``replicas`` key in the server's settings takes
+            precedence. Defaults to 1
+        :param supervision: (optional) A
+            :class:`~dploylib.services.supervision.Supervision` to restart
+            the server if it stops. The ``supervision`` key in the server's
+            settings takes precedence. Defaults to None which fails the
+            service when the server stops
         """
         self._server_config[name] = server_cls
+        if replicas:
+            self._server_config.set_replicas(name, replicas)
+        if supervision:
+            self._server_config.set_supervision(name, supervision)
 
     def _apply_templates(self):
         self._server_config.apply_templates(self._templates)
@@ -62,7 +78,8 @@ class Service(object):
             return self._server_config
         return self._server_config
 
-    def start(self, config_file=None, config_string=None, config_dict=None):
+    def start(self, config_file=None, config_string=None, config_dict=None,
+            wait_ready=False, ready_timeout=None):
         """Starts the service with the given configuration information.
         Configuration data is accepted from one of three different types: *a
         file path*, *a string*, or *a dictionary*.
@@ -70,6 +87,14 @@ class Service(object):
         :param config_file: file path for the configuration
         :param config_string: a string of the configuration
         :param config_dict: a dictionary for the configuration
+        :param wait_ready: (optional) Set to True to return only once every
+            server has bound its sockets and subscribed to the coordinator.
+            Defaults to False
+        :param ready_timeout: (optional) Seconds to wait for the servers to
+            be ready. Defaults to None which waits forever
+        :raises: :class:`ServiceNotReady` if the servers aren't ready in time
+            and :class:`ServiceFailing` if a server stops while starting. The
+            service should still be stopped.
         """
         if not (config_file or config_string or config_dict):
             raise TypeError('One of config_file, config_string or config_dict'
@@ -89,6 +114,23 @@ class Service(object):
             settings = Settings(config_dict)
         coordinator.setup_servers(server_config, settings)
         coordinator.start()
+        if wait_ready:
+            self.wait_until_ready(timeout=ready_timeout)
+
+    def wait_until_ready(self, timeout=None):
+        """Wait until every server is ready
+
+        :param timeout: (optional) Seconds to wait. Defaults to None which
+            waits forever
+        """
+        try:
+            self._coordinator.wait_until_ready(timeout=timeout)
+        except ServersNotReady:
+            self.logger.exception('Service is not ready')
+            raise ServiceNotReady('Service is not ready')
+        except ServerCoordinatorFailing:
+            self.logger.exception('Service is failing')
+            raise ServiceFailing('Service has stopped working')
 
     def wait(self):
         """Wait for the service forever or until it fails"""
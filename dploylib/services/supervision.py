@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""
+dploylib.services.supervision
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Supervision restarts a server that stops on its own instead of stopping the
+whole service. Each server is supervised on its own (one for one), so a
+crashing server doesn't restart any of the others.
+
+Supervision is set for a server in its settings::
+
+    {
+        "servers": {
+            "queue": {
+                "supervision": {
+                    "restart": "on_failure",
+                    "max_restarts": 3,
+                    "period": 60,
+                    "backoff": 0.5,
+                    "max_backoff": 30
+                },
+                ...
+            }
+        }
+    }
+
+or when the server is added to a service::
+
+    service.add_server('queue', QueueServer,
+            supervision=Supervision(max_restarts=3, period=60))
+
+``restart`` is ``on_failure`` to only restart a server that raised an
+exception or ``always`` to also restart a server that returned. A server is
+restarted after a delay that starts at ``backoff`` seconds and doubles for
+each restart within the last ``period`` seconds, up to ``max_backoff``. If a
+server needs more than ``max_restarts`` restarts within ``period`` seconds
+it is not restarted and the service fails as if it wasn't supervised.
+
+Replicas of a server and their broker are each supervised with the server's
+supervision. Only the
+:class:`~dploylib.services.coordinator.ThreadedServerCoordinator` restarts
+servers. Other coordinators raise a
+:class:`~dploylib.services.utils.ServerConfigError` for supervised servers.
+"""
+
+import collections
+import time
+
+RESTART_ON_FAILURE = 'on_failure'
+RESTART_ALWAYS = 'always'
+RESTART_POLICIES = (RESTART_ON_FAILURE, RESTART_ALWAYS)
+
+
+class Supervision(object):
+    """A restart policy for a server
+
+    :param restart: (optional) :data:`RESTART_ON_FAILURE` or
+        :data:`RESTART_ALWAYS`. Defaults to :data:`RESTART_ON_FAILURE`
+    :param max_restarts: (optional) The most restarts allowed within
+        ``period``. Defaults to 3
+    :param period: (optional) Seconds over which restarts are counted.
+        Defaults to 60
+    :param backoff: (optional) Seconds to wait before the first restart.
+        Defaults to 0.5
+    :param max_backoff: (optional) The longest wait in seconds before a
+        restart. Defaults to 30
+    """
+    def __init__(self, restart=RESTART_ON_FAILURE, max_restarts=3, period=60.0,
+            backoff=0.5, max_backoff=30.0):
+        if restart not in RESTART_POLICIES:
+            raise ValueError('Unknown restart policy "%s"' % restart)
+        self.restart = restart
+        self.max_restarts = max_restarts
+        self.period = period
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    @classmethod
+    def from_settings(cls, supervision_settings):
+        """Creates supervision from the ``supervision`` key of a server's
+        settings
+
+        :param supervision_settings: A dictionary of the keyword arguments of
+            :class:`Supervision`
+        """
+        return cls(**supervision_settings)
+
+    def restarts(self, failed):
+        """True if a server that stopped should be restarted
+
+        :param failed: True if the server raised an exception
+        """
+        return failed or self.restart == RESTART_ALWAYS
+
+    def supervisor(self, clock=time.time):
+        """Creates a :class:`Supervisor` for a single server"""
+        return Supervisor(self, clock=clock)
+
+
+class Supervisor(object):
+    """Decides when a single server is restarted and counts its restarts
+
+    :param supervision: The server's :class:`Supervision`
+    :param clock: (optional) Function returning the current time in seconds
+    """
+    def __init__(self, supervision, clock=time.time):
+        self.supervision = supervision
+        self.clock = clock
+        self.restart_count = 0
+        self._recent = collections.deque()
+
+    def restart_delay(self, failed):
+        """Seconds to wait before restarting a server that stopped. Returns
+        None if the server shouldn't be restarted.
+
+        :param failed: True if the server raised an exception
+        """
+        supervision = self.supervision
+        if not supervision.restarts(failed):
+            return None
+        now = self.clock()
+        recent = self._recent
+        while recent and now - recent[0] > supervision.period:
+            recent.popleft()
+        if len(recent) >= supervision.max_restarts:
+            return None
+        delay = min(supervision.max_backoff,
+                supervision.backoff * 2 ** len(recent))
+        recent.append(now)
+        self.restart_count += 1
+        return delay
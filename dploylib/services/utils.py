@@ -15,6 +15,8 @@ class ServerConfigError(Exception):
 class ServerConfig(object):
     def __init__(self):
         self._servers = {}
+        self._replicas = {}
+        self._supervision = {}
 
     def apply_templates(self, templates):
         """Apply's the templates the settings"""
@@ -35,6 +37,26 @@ class ServerConfig(object):
     def __setitem__(self, name, server):
         self._servers[name] = server
 
+    def set_replicas(self, name, replicas):
+        """Set the number of instances of a server to run"""
+        self._replicas[name] = replicas
+
+    def replicas(self, name):
+        """The number of instances of a server to run or None if it hasn't
+        been set
+        """
+        return self._replicas.get(name)
+
+    def set_supervision(self, name, supervision):
+        """Set the :class:`~dploylib.services.supervision.Supervision` of a
+        server
+        """
+        self._supervision[name] = supervision
+
+    def supervision(self, name):
+        """The supervision of a server or None if it hasn't been set"""
+        return self._supervision.get(name)
+
     def names(self):
         return self._servers.keys()
 
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""
+dploylib.transport.codec
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+Codecs encode serialized objects into an envelope's body and decode them
+again. Every codec is registered by mimetype. The envelope's mimetype tells
+the receiving side which codec to use, so senders can pick any registered
+codec without the receiver being told in advance.
+
+The following codecs are registered by default:
+
+    * ``application/json`` - Uses the standard library's json
+    * ``application/x-msgpack`` - Only if msgpack is installed
+    * ``application/octet-stream`` - Passes a str through untouched
+
+Faster JSON libraries decode some values differently than the standard
+library. For example simplejson returns str for ASCII strings and ujson
+rounds floats. They are only used when registered explicitly, on every host
+that talks to each other::
+
+    import ujson
+    codecs.register(JSONCodec(ujson))
+"""
+
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+RAW_MIMETYPE = 'application/octet-stream'
+
+
+class UnknownMimetype(Exception):
+    pass
+
+
+class Codec(object):
+    """Base class for codecs"""
+    mimetype = None
+
+    def encode(self, data):
+        """Encode serialized data as a str"""
+        raise NotImplementedError('Codec must encode data')
+
+    def decode(self, raw):
+        """Decode a str into serialized data"""
+        raise NotImplementedError('Codec must decode data')
+
+
+class JSONCodec(Codec):
+    """Encodes JSON
+
+    :param json_module: (optional) A module with the ``dumps`` and ``loads``
+        functions of the standard library's json, such as ujson or
+        simplejson. Defaults to the standard library's json
+    """
+    mimetype = JSON_MIMETYPE
+
+    def __init__(self, json_module=None):
+        self._json = json_module or json
+
+    def encode(self, data):
+        return self._json.dumps(data)
+
+    def decode(self, raw):
+        return self._json.loads(raw)
+
+
+class MsgpackCodec(Codec):
+    mimetype = MSGPACK_MIMETYPE
+
+    def encode(self, data):
+        return msgpack.packb(data, use_bin_type=True)
+
+    def decode(self, raw):
+        return msgpack.unpackb(raw, raw=False)
+
+
+class RawCodec(Codec):
+    """Sends a str as is. Useful for data that is already encoded"""
+    mimetype = RAW_MIMETYPE
+
+    def encode(self, data):
+        return data
+
+    def decode(self, raw):
+        return raw
+
+
+class CodecRegistry(object):
+    """Stores codecs by mimetype"""
+    def __init__(self):
+        self._codecs = {}
+
+    def register(self, codec):
+        """Register a codec for its mimetype
+
+        :param codec: A :class:`Codec`
+        """
+        self._codecs[codec.mimetype] = codec
+
+    def get(self, mimetype):
+        """Get the codec for a mimetype
+
+        :raises: :class:`UnknownMimetype` if no codec is registered
+        """
+        codec = self._codecs.get(mimetype)
+        if not codec:
+            raise UnknownMimetype('No codec registered for "%s"' % mimetype)
+        return codec
+
+    def __contains__(self, mimetype):
+        return mimetype in self._codecs
+
+    def encode(self, mimetype, data):
+        return self.get(mimetype).encode(data)
+
+    def decode(self, mimetype, raw):
+        return self.get(mimetype).decode(raw)
+
+
+codecs = CodecRegistry()
+codecs.register(JSONCodec())
+codecs.register(RawCodec())
+if msgpack:
+    codecs.register(MsgpackCodec())
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+
+"""
+dploylib.transport.compression
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Compresses envelope bodies. A compressed body is signalled with a
+``compression`` parameter on the envelope's mimetype::
+
+    application/json; compression=zlib
+
+Receivers that use :class:`~dploylib.transport.ReceivedData`,
+``receive_obj`` or ``receive_text`` decompress the body and see the original
+mimetype, so compression is transparent to handlers. Envelopes that are only
+forwarded are never decompressed. The envelope itself is left untouched, so
+``received.envelope.data`` is still the compressed body.
+
+Decompressed bodies are limited to :data:`DEFAULT_MAX_DECOMPRESSED_SIZE`
+bytes so a small message from a peer can't expand into gigabytes. A socket's
+:class:`Compression` can set another ``max_size``, which is used when data is
+received on that socket.
+
+The following compressors are registered by default:
+
+    * ``zlib`` - Always available
+    * ``lz4`` - Only if lz4 is installed
+    * ``zstd`` - Only if zstandard is installed
+"""
+
+import zlib
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_PARAM = '; compression='
+# Bodies smaller than this many bytes aren't worth compressing
+DEFAULT_COMPRESSION_THRESHOLD = 1024
+# Bodies that decompress to more than this many bytes are rejected
+DEFAULT_MAX_DECOMPRESSED_SIZE = 64 * 1024 * 1024
+
+
+class UnknownCompression(Exception):
+    pass
+
+
+class DecompressedTooLarge(Exception):
+    pass
+
+
+def check_size(data, max_size):
+    """Raises :class:`DecompressedTooLarge` if decompressed data is larger
+    than the maximum size
+    """
+    if max_size is not None and len(data) > max_size:
+        raise DecompressedTooLarge('Decompressed data is larger than %d bytes'
+                % max_size)
+    return data
+
+
+class Compressor(object):
+    """Base class for compressors"""
+    name = None
+
+    def compress(self, data):
+        """Compress a str"""
+        raise NotImplementedError('Compressor must compress data')
+
+    def decompress(self, data, max_size=None):
+        """Decompress a str. Implementations stop decompressing once there
+        is more than ``max_size`` bytes of output.
+
+        :param data: The compressed data
+        :param max_size: (optional) The most bytes allowed after
+            decompressing. None means there's no limit
+        :raises: :class:`DecompressedTooLarge` if there is more
+        """
+        raise NotImplementedError('Compressor must decompress data')
+
+
+class ZlibCompressor(Compressor):
+    name = 'zlib'
+
+    def __init__(self, level=6):
+        self._level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self._level)
+
+    def decompress(self, data, max_size=None):
+        if max_size is None:
+            return zlib.decompress(data)
+        decompressor = zlib.decompressobj()
+        # One byte more than allowed shows that the limit is exceeded
+        decompressed = check_size(decompressor.decompress(data, max_size + 1),
+                max_size)
+        return check_size(decompressed + decompressor.flush(), max_size)
+
+
+class LZ4Compressor(Compressor):
+    name = 'lz4'
+
+    def compress(self, data):
+        return lz4_frame.compress(data)
+
+    def decompress(self, data, max_size=None):
+        if max_size is None:
+            return lz4_frame.decompress(data)
+        decompressor = lz4_frame.LZ4FrameDecompressor()
+        return check_size(decompressor.decompress(data,
+            max_length=max_size + 1), max_size)
+
+
+class ZstdCompressor(Compressor):
+    name = 'zstd'
+
+    def __init__(self, level=3):
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def decompress(self, data, max_size=None):
+        if max_size is None:
+            return self._decompressor.decompress(data)
+        # The frame's content size can't be trusted so read at most one byte
+        # more than allowed
+        reader = self._decompressor.stream_reader(data)
+        chunks = []
+        remaining = max_size + 1
+        while remaining > 0:
+            chunk = reader.read(remaining)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return check_size(''.join(chunks), max_size)
+
+
+class CompressorRegistry(object):
+    """Stores compressors by name"""
+    def __init__(self):
+        self._compressors = {}
+
+    def register(self, compressor):
+        """Register a compressor for its name
+
+        :param compressor: A :class:`Compressor`
+        """
+        self._compressors[compressor.name] = compressor
+
+    def get(self, name):
+        """Get the compressor for a name
+
+        :raises: :class:`UnknownCompression` if no compressor is registered
+        """
+        compressor = self._compressors.get(name)
+        if not compressor:
+            raise UnknownCompression('No compressor registered for "%s"' %
+                    name)
+        return compressor
+
+    def __contains__(self, name):
+        return name in self._compressors
+
+
+compressors = CompressorRegistry()
+compressors.register(ZlibCompressor())
+if lz4_frame:
+    compressors.register(LZ4Compressor())
+if zstandard:
+    compressors.register(ZstdCompressor())
+
+
+def split_mimetype(mimetype):
+    """Splits a mimetype into the original mimetype and the name of the
+    compressor used on the body. The name is None for uncompressed bodies.
+
+    :param mimetype: An envelope's mimetype
+    """
+    base, param, name = mimetype.partition(COMPRESSION_PARAM)
+    if not param:
+        return mimetype, None
+    return base, name
+
+
+def decompress(mimetype, data, max_size=DEFAULT_MAX_DECOMPRESSED_SIZE):
+    """Decompresses an envelope body if its mimetype says it is compressed.
+    Returns the original mimetype and the decompressed data.
+
+    :param mimetype: An envelope's mimetype
+    :param data: The envelope's data as a str
+    :param max_size: (optional) The most bytes the body may decompress to.
+        Defaults to :data:`DEFAULT_MAX_DECOMPRESSED_SIZE`. None means there's
+        no limit
+    :raises: :class:`DecompressedTooLarge` if the body decompresses to more
+    """
+    mimetype, name = split_mimetype(mimetype)
+    if name is None:
+        return mimetype, data
+    return mimetype, compressors.get(name).decompress(data, max_size=max_size)
+
+
+class Compression(object):
+    """Decides when and how envelope bodies are compressed
+
+    :param name: (optional) The name of a registered compressor. Defaults to
+        'zlib'
+    :param threshold: (optional) Smallest body in bytes that is compressed.
+        Defaults to :data:`DEFAULT_COMPRESSION_THRESHOLD`
+    :param max_size: (optional) The most bytes a received body may decompress
+        to. Defaults to :data:`DEFAULT_MAX_DECOMPRESSED_SIZE`. None means
+        there's no limit
+    """
+    def __init__(self, name='zlib', threshold=DEFAULT_COMPRESSION_THRESHOLD,
+            max_size=DEFAULT_MAX_DECOMPRESSED_SIZE):
+        self._compressor = compressors.get(name)
+        self._threshold = threshold
+        self._max_size = max_size
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    @classmethod
+    def from_settings(cls, compression_settings):
+        """Creates compression from the ``compression`` key of a socket's
+        settings. Returns None if the settings are empty or false.
+
+        :param compression_settings: The name of a registered compressor or a
+            dictionary of the keyword arguments of :class:`Compression`
+        """
+        if not compression_settings:
+            return None
+        if isinstance(compression_settings, basestring):
+            return cls(compression_settings)
+        return cls(**compression_settings)
+
+    def compress(self, mimetype, data):
+        """Compresses data at least as large as the threshold. Returns the
+        mimetype and data to send. Data that doesn't get smaller is sent
+        uncompressed.
+
+        :param mimetype: The mimetype of the data
+        :param data: The data as a str
+        """
+        if len(data) < self._threshold:
+            return mimetype, data
+        compressor = self._compressor
+        compressed = compressor.compress(data)
+        if len(compressed) >= len(data):
+            return mimetype, data
+        return mimetype + COMPRESSION_PARAM + compressor.name, compressed
+
+    def decompress(self, mimetype, data):
+        """Decompresses a received body with this compression's limit. See
+        :func:`decompress`
+        """
+        return decompress(mimetype, data, max_size=self._max_size)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+"""
+dploylib.transport.credit
+~~~~~~~~~~~~~~~~~~~~~~~~~
+
+An optional credit based protocol for pipelines between dploy servers. A
+consumer grants credits to its producer over a separate socket and the
+producer only sends while it has credits, so a slow consumer is never sent
+more than its window of envelopes::
+
+    # Producer, with a push socket for output and a pull socket for credits
+    sender = CreditedSender(poll_loop, output_socket, credit_socket)
+    sender.send_envelope(envelope)
+
+    # Consumer, with a pull socket for input and a push socket for credits
+    granter = CreditGranter(credit_socket, window=100)
+    granter.start()
+    ...
+    # After each envelope is handled
+    granter.handled()
+
+With several consumers the producer's push socket picks which consumer gets
+each envelope, so the credits only bound the total number of envelopes in
+flight. Envelopes that are waiting for credits are kept in order by the
+producer until credits arrive.
+"""
+
+import collections
+import logging
+from .envelope import Envelope
+
+logger = logging.getLogger('dploylib.transport.credit')
+
+CREDIT_MIMETYPE = 'application/x-dploy-credit'
+
+
+class CreditedSender(object):
+    """Sends envelopes on a socket while a consumer has granted credits
+
+    :param poll_loop: The :class:`~dploylib.transport.PollLoop` that sends
+        the envelopes and receives credits
+    :param socket: The :class:`~dploylib.transport.Socket` to send on
+    :param credit_socket: The :class:`~dploylib.transport.Socket` credits are
+        received on. It is registered with the poll loop
+    """
+    logger = logger
+
+    def __init__(self, poll_loop, socket, credit_socket):
+        self._poll_loop = poll_loop
+        self._socket = socket
+        self._credits = 0
+        self._waiting = collections.deque()
+        poll_loop.register(credit_socket, self.receive_credits)
+
+    @property
+    def credits(self):
+        """Credits that haven't been used yet"""
+        return self._credits
+
+    @property
+    def waiting_count(self):
+        """The number of envelopes waiting for credits"""
+        return len(self._waiting)
+
+    def send_envelope(self, envelope):
+        """Send an envelope if there are credits otherwise keep it until
+        there are. Returns True if the envelope was handed to the poll loop.
+
+        :param envelope: The :class:`~dploylib.transport.Envelope` to send
+        """
+        if self._credits and not self._waiting:
+            self._credits -= 1
+            self._poll_loop.send_envelope(self._socket, envelope)
+            return True
+        self._waiting.append(envelope)
+        return False
+
+    def grant(self, credits):
+        """Add credits and send any envelopes waiting for them"""
+        self._credits += credits
+        waiting = self._waiting
+        while self._credits and waiting:
+            self._credits -= 1
+            self._poll_loop.send_envelope(self._socket, waiting.popleft())
+
+    def receive_credits(self, socket):
+        """Handles envelopes received on the credit socket"""
+        envelope = socket.receive_envelope()
+        if envelope.mimetype != CREDIT_MIMETYPE:
+            self.logger.warning('Ignoring "%s" envelope on a credit socket' %
+                    envelope.mimetype)
+            return
+        self.grant(int(envelope.data))
+
+
+class CreditGranter(object):
+    """Grants credits to a producer as envelopes are handled. Credits are
+    granted in batches of half the window so that the producer doesn't run
+    out while the consumer is still busy.
+
+    :param socket: The :class:`~dploylib.transport.Socket` connected to the
+        producer's credit socket
+    :param window: The most envelopes the producer may have in flight
+    """
+    def __init__(self, socket, window):
+        self._socket = socket
+        self._window = window
+        self._batch = max(1, window // 2)
+        self._handled = 0
+
+    def start(self):
+        """Grant the initial window of credits"""
+        self._send_credits(self._window)
+
+    def handled(self, count=1):
+        """Record handled envelopes and grant credits for them
+
+        :param count: (optional) The number of envelopes handled. Defaults to
+            1
+        """
+        self._handled += count
+        if self._handled >= self._batch:
+            self._send_credits(self._handled)
+            self._handled = 0
+
+    def _send_credits(self, credits):
+        self._socket.send_envelope(Envelope.new(CREDIT_MIMETYPE,
+                str(credits)))
@@ -8,9 +8,157 @@ Defines the envelope. The envelope is how all of the communication occurs
 between dploy services. This does not include dploy web services. Those differ
 from zeromq based services.
 """
+import base64
+import struct
+import time
+
 ENVELOPE_SCHEMA = ['id', 'mimetype', 'body']
 MINIMUM_ENVELOPE_LEN = len(ENVELOPE_SCHEMA)
 
+# Marks envelope parts that haven't been read from the raw frames yet
+UNPARSED = object()
+
+# The header is sent as the last parameter of the mimetype
+HEADER_PARAM = '; header='
+HEADER_SENT_AT = 0x01
+HEADER_DEADLINE = 0x02
+HEADER_TRACE_ID = 0x04
+TIMESTAMP_STRUCT = struct.Struct('!d')
+
+
+def frame_bytes(frame):
+    """Materialize a frame as a str.
+
+    Frames received without copying are ``zmq.Frame`` objects (or buffers
+    taken from them). Anything else is returned untouched.
+
+    :param frame: A ``zmq.Frame``, a ``memoryview`` or a str
+    """
+    if isinstance(frame, memoryview):
+        return frame.tobytes()
+    return getattr(frame, 'bytes', frame)
+
+
+def split_header(mimetype):
+    """Splits a mimetype frame into the mimetype and the encoded header. The
+    header is None if the frame doesn't have one.
+
+    :param mimetype: A mimetype frame as a str
+    """
+    mimetype, param, header = mimetype.partition(HEADER_PARAM)
+    if not param:
+        return mimetype, None
+    return mimetype, header
+
+
+class Header(object):
+    """Optional metadata sent along with an envelope.
+
+    The header is encoded compactly as a byte of flags saying which fields
+    are present and then only those fields, in base64 so it can be sent as a
+    parameter of the envelope's mimetype.
+
+    :param sent_at: (optional) Unix time the envelope was sent
+    :param deadline: (optional) Unix time after which the envelope is no
+        longer useful to the sender
+    :param trace_id: (optional) A str id used to correlate messages across
+        servers. Up to 255 bytes
+    """
+    __slots__ = ('sent_at', 'deadline', 'trace_id')
+
+    @classmethod
+    def new(cls, trace_id=None, timeout=None, clock=time.time):
+        """Creates a header stamped with the current time
+
+        :param trace_id: (optional) A str id used to correlate messages
+        :param timeout: (optional) Seconds from now until the deadline
+        :param clock: (optional) Function returning the current unix time
+        """
+        now = clock()
+        deadline = None
+        if timeout is not None:
+            deadline = now + timeout
+        return cls(sent_at=now, deadline=deadline, trace_id=trace_id)
+
+    @classmethod
+    def decode(cls, encoded):
+        """Decodes a header created by :meth:`encode`
+
+        :param encoded: An encoded header
+        """
+        frame = base64.urlsafe_b64decode(encoded)
+        offset = 0
+        flags = ord(frame[offset])
+        offset += 1
+        header = cls()
+        if flags & HEADER_SENT_AT:
+            header.sent_at = TIMESTAMP_STRUCT.unpack_from(frame, offset)[0]
+            offset += TIMESTAMP_STRUCT.size
+        if flags & HEADER_DEADLINE:
+            header.deadline = TIMESTAMP_STRUCT.unpack_from(frame, offset)[0]
+            offset += TIMESTAMP_STRUCT.size
+        if flags & HEADER_TRACE_ID:
+            length = ord(frame[offset])
+            offset += 1
+            header.trace_id = frame[offset:offset + length]
+        return header
+
+    def __init__(self, sent_at=None, deadline=None, trace_id=None):
+        self.sent_at = sent_at
+        self.deadline = deadline
+        self.trace_id = trace_id
+
+    def encode(self):
+        """Encodes the header as a str without spaces or semicolons"""
+        flags = 0
+        parts = []
+        if self.sent_at is not None:
+            flags |= HEADER_SENT_AT
+            parts.append(TIMESTAMP_STRUCT.pack(self.sent_at))
+        if self.deadline is not None:
+            flags |= HEADER_DEADLINE
+            parts.append(TIMESTAMP_STRUCT.pack(self.deadline))
+        trace_id = self.trace_id
+        if trace_id is not None:
+            if len(trace_id) > 255:
+                raise ValueError('trace_id must be at most 255 bytes')
+            flags |= HEADER_TRACE_ID
+            parts.append(chr(len(trace_id)))
+            parts.append(trace_id)
+        return base64.urlsafe_b64encode(chr(flags) + ''.join(parts))
+
+    def age(self, now=None):
+        """Seconds since the envelope was sent. None if it isn't known
+
+        :param now: (optional) The current unix time
+        """
+        if self.sent_at is None:
+            return None
+        if now is None:
+            now = time.time()
+        return now - self.sent_at
+
+    def expired(self, now=None):
+        """Checks if the deadline has passed. False if there isn't one
+
+        :param now: (optional) The current unix time
+        """
+        if self.deadline is None:
+            return False
+        if now is None:
+            now = time.time()
+        return now >= self.deadline
+
+    def __eq__(self, other):
+        if not isinstance(other, Header):
+            return NotImplemented
+        return (self.sent_at == other.sent_at and
+                self.deadline == other.deadline and
+                self.trace_id == other.trace_id)
+
+    def __ne__(self, other):
+        return not self == other
+
 
 class Envelope(object):
     """Dploy's message envelope.
@@ -29,6 +177,12 @@ class Envelope(object):
         | body                  |
          -----------------------
 
+    An optional :class:`Header` is sent as a ``header`` parameter at the end
+    of the mimetype frame, such as ``text/plain; header=AQ...``. The
+    envelope's :attr:`mimetype` never includes it. Keeping the header out of
+    its own frame leaves the ``id`` as the first frame on pub sockets, where
+    subscriptions match it.
+
     .. note::
 
         The ``id`` portion of the envelope may seem like unnecessary data, but
@@ -38,75 +192,152 @@ class Envelope(object):
     :type id: str
     :param mimetype: The mimetype for the envelope
     :type mimetype: str
-    :param data: The envelope's body
+    :param data: The envelope's body. This can be a str or, for envelopes
+        received without copying, a ``zmq.Frame`` that is only converted to a
+        str when :attr:`data` is read
+    :param header: (optional) A :class:`Header` with metadata for the
+        envelope
     """
+    __slots__ = ('_raw', '_routing', '_routing_len', '_id', '_mimetype',
+            '_data', '_header')
+
     @classmethod
-    def new(cls, mimetype, data, id='', request_frames=None):
+    def new(cls, mimetype, data, id='', request_frames=None, header=None):
         """Create a new envelope. This is the preferred way to create a new
         envelope.
 
         :param mimetype: The mimetype for the envelope
         :param data: The envelope's body
         :param id: (optional) A string id for the envelope. Defaults to ''
+        :param header: (optional) A :class:`Header` for the envelope
         """
-        return cls(id, mimetype, data, request_frames=request_frames)
+        return cls(id, mimetype, data, request_frames=request_frames,
+                header=header)
 
     @classmethod
     def from_raw(cls, raw):
         """Creates an envelope from a tuple or list
 
+        Nothing is copied or parsed here. The envelope keeps a reference to
+        ``raw`` and the ``id``, ``mimetype`` and body frames are only read
+        from it when they are used. The ``id`` and ``mimetype`` are always
+        converted to strings. The body is left as is so that frames received
+        without copying stay uncopied until the data is actually used.
+
         :param raw: Raw data for an envelope
         :type raw: tuple or list
         """
-        request_frames = []
-        raw_len = len(raw)
-        request_frames_len = raw_len - MINIMUM_ENVELOPE_LEN - 1
-        for i in range(request_frames_len):
-            request_frames.append(raw[i])
-        id, mimetype, data = raw[-MINIMUM_ENVELOPE_LEN:]
-        return cls(id, mimetype, data, request_frames=request_frames)
-
-    def __init__(self, id, mimetype, data, request_frames=None):
+        envelope = cls.__new__(cls)
+        envelope._raw = raw
+        envelope._routing = raw
+        envelope._routing_len = max(len(raw) - MINIMUM_ENVELOPE_LEN - 1, 0)
+        envelope._id = envelope._mimetype = envelope._data = UNPARSED
+        envelope._header = UNPARSED
+        return envelope
+
+    def __init__(self, id, mimetype, data, request_frames=None, header=None):
         self._id = id
         self._mimetype = mimetype
         self._data = data
-        self._request_frames = request_frames or []
+        # Routing frames are the first ``_routing_len`` items of
+        # ``_routing``. This lets response envelopes share the frame list of
+        # the envelope they respond to.
+        self._routing = request_frames
+        self._routing_len = len(request_frames) if request_frames else 0
+        # A Header, an encoded header that hasn't been decoded yet or None
+        self._header = header
+        # The raw frames this envelope was created from (if any). Envelopes
+        # can't be changed so these can be sent again as is.
+        self._raw = None
 
     @property
     def id(self):
-        return self._id
+        id = self._id
+        if id is UNPARSED:
+            id = self._id = frame_bytes(self._raw[-3])
+        return id
 
     @property
     def mimetype(self):
-        return self._mimetype
+        mimetype = self._mimetype
+        if mimetype is UNPARSED:
+            mimetype, self._header = split_header(frame_bytes(self._raw[-2]))
+            self._mimetype = mimetype
+        return mimetype
 
     @property
     def data(self):
-        return self._data
+        """The envelope's body as a str"""
+        data = self._data = frame_bytes(self.body)
+        return data
+
+    @property
+    def body(self):
+        """The envelope's body as it was given to the envelope. Use this when
+        the body is only being forwarded so that it is never copied.
+        """
+        data = self._data
+        if data is UNPARSED:
+            data = self._data = self._raw[-1]
+        return data
+
+    @property
+    def header(self):
+        """The envelope's :class:`Header`. None if it wasn't sent with one"""
+        if self._header is UNPARSED:
+            # Parsing the mimetype frame finds the header
+            self.mimetype
+        header = self._header
+        if header is not None and not isinstance(header, Header):
+            header = self._header = Header.decode(header)
+        return header
 
     @property
     def request_frames(self):
-        return self._request_frames
+        """A copy of the routing frames. The frames themselves may be shared
+        with the caller's list and with response envelopes.
+        """
+        routing_len = self._routing_len
+        if not routing_len:
+            return []
+        # Raw frames may be a tuple
+        return list(self._routing[:routing_len])
 
     def transfer_object(self):
         """This is the object to be sent over the wire. The reverse of this is
         Envelope.from_raw
 
-        For zmq this should be an list
+        For zmq this should be an list. An envelope created by
+        Envelope.from_raw returns the raw frames it was created from so that
+        forwarding a received envelope doesn't rebuild or copy any part.
         """
-        transfer_object = []
-        if self._request_frames:
-            transfer_object.extend(self._request_frames)
+        raw = self._raw
+        if raw is not None:
+            return raw
+        routing_len = self._routing_len
+        if routing_len:
+            # Routing frames may be a tuple of raw frames
+            transfer_object = list(self._routing[:routing_len])
             transfer_object.append('')
-        transfer_object.extend([self._id, self._mimetype, self._data])
+        else:
+            transfer_object = []
+        mimetype = self._mimetype
+        header = self._header
+        if header is not None:
+            if isinstance(header, Header):
+                header = header.encode()
+            mimetype = mimetype + HEADER_PARAM + header
+        transfer_object.extend((self._id, mimetype, self._data))
         return transfer_object
 
-    def response_envelope(self, mimetype, data, id=None):
+    def response_envelope(self, mimetype, data, id=None, header=None):
         """Shortcut to create a response envelope from the current envelope
 
-        By default this will create an envelope with the same request_frames,
-        id and mimetype as this envelope.
+        By default this will create an envelope with the same request_frames
+        and id as this envelope. The routing frames are shared with this
+        envelope rather than copied.
         """
-        id = id or self._id
-        return Envelope.new(mimetype, data, id=id,
-                request_frames=self._request_frames)
+        response = Envelope(id or self.id, mimetype, data, header=header)
+        response._routing = self._routing
+        response._routing_len = self._routing_len
+        return response
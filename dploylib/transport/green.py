@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+"""
+dploylib.transport.green
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+A cooperative flavour of the transport built on gevent. Sockets created from
+a :class:`GreenContext` are regular :class:`~dploylib.transport.Socket`
+objects, but any send or receive that would block only suspends the current
+greenlet. Other greenlets keep running in the meantime.
+
+gevent is not a requirement of dploylib. It must be installed to use this
+module.
+"""
+
+import zmq.green as green_zmq
+from .wrapper import Context
+from .poll import PollLoop
+
+
+class GreenContext(Context):
+    """A :class:`~dploylib.transport.Context` that creates gevent friendly
+    sockets
+    """
+    @classmethod
+    def new(cls):
+        context = green_zmq.Context()
+        return cls(context)
+
+    @classmethod
+    def from_context(cls, context):
+        """Create a green context that shares the underlying zeromq context
+        of a :class:`~dploylib.transport.Context`. Sockets from either context
+        can talk to each other over ``inproc://``.
+
+        :param context: A :class:`~dploylib.transport.Context`
+        """
+        if isinstance(context, cls):
+            return context
+        zmq_context = context.zmq_context
+        green_context = cls(green_zmq.Context.shadow(zmq_context.underlying))
+        # The shadow doesn't own the zeromq context. Keep the original alive
+        # for as long as the shadow's sockets so it isn't terminated under
+        # them.
+        green_context._shadowed_context = context
+        return green_context
+
+
+class GreenPollLoop(PollLoop):
+    """A :class:`~dploylib.transport.PollLoop` that waits cooperatively"""
+    @classmethod
+    def new(cls):
+        poller = green_zmq.Poller()
+        return cls(poller)
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+"""
+dploylib.transport.metrics
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Low overhead counters and latency histograms for sockets. A socket with
+:class:`SocketMetrics` set as its ``metrics`` counts every envelope it sends
+and the bytes in their bodies::
+
+    metrics = Metrics()
+    socket.metrics = metrics.socket('requests')
+    ...
+    metrics.snapshot()
+    # {'requests': {'sent': 10, 'sent_bytes': 4096, ...}}
+
+Servers collect these automatically for every described socket. See
+:attr:`dploylib.servers.server.DployServer.metrics`.
+
+Latencies are recorded in a :class:`Histogram`. Like an HDR histogram it
+keeps counts in buckets whose width grows with the value, so recording is a
+few integer operations and a dictionary update, memory doesn't grow with the
+number of values and every percentile is accurate to within about 1.6%.
+"""
+
+# Histogram values are stored as integer multiples of this many seconds
+DEFAULT_HISTOGRAM_UNIT = 1e-6
+# Each power of two is split into 2 ** (DEFAULT_HISTOGRAM_PRECISION - 1)
+# linear buckets
+DEFAULT_HISTOGRAM_PRECISION = 7
+DEFAULT_PERCENTILES = (50, 90, 99, 99.9)
+
+
+class Histogram(object):
+    """A log-linear histogram of values such as latencies
+
+    :param unit: (optional) The smallest value told apart. Defaults to a
+        microsecond
+    :param precision: (optional) Bits of precision kept for each value. The
+        relative error is ``2 ** (1 - precision)``. Defaults to 7
+    """
+    def __init__(self, unit=DEFAULT_HISTOGRAM_UNIT,
+            precision=DEFAULT_HISTOGRAM_PRECISION):
+        self._unit = unit
+        self._precision = precision
+        self._sub_bucket_count = 1 << precision
+        self._half_count = 1 << (precision - 1)
+        self._counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _index(self, units):
+        if units < self._sub_bucket_count:
+            return units
+        shift = units.bit_length() - self._precision
+        return (self._sub_bucket_count + (shift - 1) * self._half_count +
+                (units >> shift) - self._half_count)
+
+    def _highest_equivalent(self, index):
+        """The largest value in units that is counted in a bucket"""
+        if index < self._sub_bucket_count:
+            return index
+        offset = index - self._sub_bucket_count
+        shift = offset // self._half_count + 1
+        sub_bucket = offset % self._half_count + self._half_count
+        return ((sub_bucket + 1) << shift) - 1
+
+    def record(self, value):
+        """Record a value
+
+        :param value: A value such as a latency in seconds. Negative values
+            are recorded as 0
+        """
+        units = int(value / self._unit)
+        if units < 0:
+            units = 0
+            value = 0.0
+        index = self._index(units)
+        counts = self._counts
+        counts[index] = counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        """The mean of the recorded values. None if there are none"""
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def percentile(self, percentile):
+        """The value below which a percentage of the recorded values fall.
+        None if there are no values.
+
+        :param percentile: A percentage between 0 and 100
+        """
+        count = self.count
+        if not count:
+            return None
+        target = max(1, int(round(count * percentile / 100.0)))
+        seen = 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if seen >= target:
+                value = self._highest_equivalent(index) * self._unit
+                return min(value, self.max)
+        return self.max
+
+    def reset(self):
+        """Forget all of the recorded values"""
+        self._counts.clear()
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def snapshot(self, percentiles=DEFAULT_PERCENTILES):
+        """A dictionary of the count, min, max, mean and percentiles
+
+        :param percentiles: (optional) The percentiles to include. Each is
+            keyed as ``p<percentile>`` such as ``p99.9``
+        """
+        snapshot = dict(count=self.count, min=self.min, max=self.max,
+                mean=self.mean)
+        for percentile in percentiles:
+            snapshot['p%s' % percentile] = self.percentile(percentile)
+        return snapshot
+
+
+class SocketMetrics(object):
+    """Counters and latencies for a single socket
+
+    Bytes are the total size of envelope bodies, not including routing, id
+    or mimetype frames.
+
+    For handlers that run in a thread or process pool, ``handled``,
+    ``errors`` and ``handler_latency`` only measure handing the data to the
+    pool. Errors raised by the handler in a worker are logged but never
+    counted.
+    """
+    def __init__(self):
+        self.received = 0
+        self.received_bytes = 0
+        self.sent = 0
+        self.sent_bytes = 0
+        self.handled = 0
+        self.errors = 0
+        self.handler_latency = Histogram()
+
+    def record_received(self, envelope):
+        self.received += 1
+        self.received_bytes += len(envelope.body)
+
+    def record_sent(self, envelope):
+        self.sent += 1
+        self.sent_bytes += len(envelope.body)
+
+    def record_handled(self, latency, count=1):
+        """Record a call to a socket's handler
+
+        :param latency: Seconds the handler took
+        :param count: (optional) The number of received data it handled
+        """
+        self.handled += count
+        self.handler_latency.record(latency)
+
+    def snapshot(self):
+        """A dictionary of the socket's counters and handler latencies"""
+        return dict(received=self.received,
+                received_bytes=self.received_bytes, sent=self.sent,
+                sent_bytes=self.sent_bytes, handled=self.handled,
+                errors=self.errors,
+                handler_latency=self.handler_latency.snapshot())
+
+
+class Metrics(object):
+    """The :class:`SocketMetrics` of a group of sockets, by socket name"""
+    def __init__(self):
+        self._sockets = {}
+
+    def socket(self, name):
+        """The :class:`SocketMetrics` of a socket. Created on first use"""
+        socket_metrics = self._sockets.get(name)
+        if socket_metrics is None:
+            socket_metrics = self._sockets[name] = SocketMetrics()
+        return socket_metrics
+
+    def __getitem__(self, name):
+        return self._sockets[name]
+
+    def __contains__(self, name):
+        return name in self._sockets
+
+    def names(self):
+        return self._sockets.keys()
+
+    def snapshot(self):
+        """A dictionary of each socket's metrics snapshot"""
+        return dict((name, socket_metrics.snapshot())
+                for name, socket_metrics in self._sockets.iteritems())
@@ -7,18 +7,149 @@ dploylib.transport.poll
 This module defines the PollLoop
 """
 
+import collections
+import heapq
+import itertools
 import logging
+import time
 import zmq
 from .wrapper import Socket
 
 logger = logging.getLogger('dploylib.transport.poll')
 
 
+def raw_socket_for(socket):
+    """Get the object that is actually registered to the zeromq poller"""
+    if isinstance(socket, Socket):
+        return socket.zmq_socket
+    return socket
+
+
+class Timer(object):
+    """A handle to a callback scheduled on a :class:`PollLoop`
+
+    :param deadline: The time the callback is due
+    :param interval: The number of seconds between calls of a repeating timer
+        or None if it only runs once
+    :param callback: The callable to call
+    :param args: Arguments for the callback
+    :param on_cancel: (optional) Called with the timer the first time it is
+        cancelled
+    """
+    def __init__(self, deadline, interval, callback, args, on_cancel=None):
+        self.deadline = deadline
+        self.interval = interval
+        self._callback = callback
+        self._args = args
+        self._on_cancel = on_cancel
+        self._cancelled = False
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        """Stop the timer from running again"""
+        if self._cancelled:
+            return
+        self._cancelled = True
+        # Release the callback's references as the timer may stay scheduled
+        # until its deadline
+        self._callback = None
+        self._args = None
+        if self._on_cancel:
+            self._on_cancel(self)
+
+    def __call__(self):
+        self._callback(*self._args)
+
+
+OVERFLOW_RAISE = 'raise'
+OVERFLOW_DROP_NEW = 'drop_new'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_POLICIES = (OVERFLOW_RAISE, OVERFLOW_DROP_NEW, OVERFLOW_DROP_OLDEST)
+
+
+class OutputQueueFull(Exception):
+    pass
+
+
+class OutputQueue(object):
+    """Envelopes waiting for a socket to become writable along with counters
+    describing the socket's output
+
+    :param max_depth: (optional) The most envelopes that can wait. Defaults
+        to None which doesn't limit the queue
+    :param overflow: (optional) What happens to an envelope added to a full
+        queue. ``'raise'`` raises :class:`OutputQueueFull`, ``'drop_new'``
+        drops the new envelope and ``'drop_oldest'`` drops the envelope that
+        has waited the longest. Defaults to ``'raise'``
+    """
+    def __init__(self, max_depth=None, overflow=OVERFLOW_RAISE):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy "%s"' % overflow)
+        self.max_depth = max_depth
+        self.overflow = overflow
+        self.envelopes = collections.deque()
+        # Envelopes sent without waiting
+        self.sent_immediately = 0
+        # Envelopes sent after waiting in the queue
+        self.sent_queued = 0
+        self.dropped = 0
+        # The deepest the queue has been
+        self.peak_depth = 0
+
+    def __len__(self):
+        return len(self.envelopes)
+
+    def append(self, envelope):
+        """Queue an envelope, applying the overflow policy if full"""
+        envelopes = self.envelopes
+        max_depth = self.max_depth
+        if max_depth is not None and len(envelopes) >= max_depth:
+            overflow = self.overflow
+            if overflow == OVERFLOW_RAISE:
+                raise OutputQueueFull('%d envelopes are already waiting' %
+                        len(envelopes))
+            self.dropped += 1
+            if overflow == OVERFLOW_DROP_NEW:
+                return
+            envelopes.popleft()
+        envelopes.append(envelope)
+        depth = len(envelopes)
+        if depth > self.peak_depth:
+            self.peak_depth = depth
+
+    def stats(self):
+        """A dictionary of the queue's counters"""
+        return dict(depth=len(self.envelopes), peak_depth=self.peak_depth,
+                sent_immediately=self.sent_immediately,
+                sent_queued=self.sent_queued, dropped=self.dropped)
+
+
 class PollLoop(object):
     """A custom poller that automatically routes the handling of poll events
 
-    The handlers of poll events are simply callables. This only handles POLLIN
-    events at this time.
+    The handlers of poll events are simply callables. Input handlers are
+    called on POLLIN events and error handlers on POLLERR events. Only the
+    sockets reported by the poller are looked at, so the cost of dispatching
+    does not grow with the number of registered sockets.
+
+    Callbacks can also be scheduled with :meth:`call_later` and
+    :meth:`call_every`. The next timer that is due limits how long a poll
+    waits, so timers run on the poll loop's thread without any extra wakeups.
+
+    Envelopes sent with :meth:`send_envelope` never block the loop. If a
+    socket is at its high water mark the envelopes wait in an
+    :class:`OutputQueue` for the socket and are sent when the poller reports
+    it as writable (POLLOUT). One slow peer then only delays its own socket.
+    Queue limits are set with :meth:`configure_output`.
+
+    :param poller: A zeromq poller
+    :param clock: (optional) A callable that returns the current time in
+        seconds. Defaults to ``time.time``
+    :param max_depth: (optional) The default limit for each socket's output
+        queue. Defaults to None which doesn't limit the queues
     """
     logger = logger
 
@@ -27,37 +158,281 @@ class PollLoop(object):
         poller = zmq.Poller()
         return cls(poller)
 
-    def __init__(self, poller):
+    def __init__(self, poller, clock=None, max_depth=None):
         self._poller = poller
         self._handler_map = {}
+        self._clock = clock or time.time
+        self._timers = []
+        # Breaks ties between timers with the same deadline
+        self._timer_counter = itertools.count()
+        # Number of cancelled timers that may still be scheduled
+        self._cancelled_timers = 0
+        self._max_depth = max_depth
+        # Output queues by raw socket
+        self._output_queues = {}
+        # Sockets that are only polled to send their pending envelopes
+        self._output_only = set()
 
-    def register(self, socket, handler):
+    def register(self, socket, handler, error_handler=None):
         """Registers a socket or FD and it's handler to the poll loop
 
         :param socket: A :class:`~dploylib.transport.Socket`, a zeromq socket,
             or a file descriptor
         :param handler: A callable that handles input events on the socket
+        :param error_handler: (optional) A callable that handles error events
+            on the socket
         """
         # FIXME? it let's anything through at the moment that isn't a dploy
         # socket it even has a test that asserts this at this time, maybe we
         # can do something better later
         self.logger.debug('Registering handler: %r for socket: %r' %
                 (handler, socket))
-        raw_socket = socket
-        if isinstance(socket, Socket):
-            raw_socket = socket.zmq_socket
-        self._handler_map[raw_socket] = [socket, handler]
-        self._poller.register(raw_socket, zmq.POLLIN)
+        raw_socket = raw_socket_for(socket)
+        self._output_only.discard(raw_socket)
+        self._handler_map[raw_socket] = [socket, handler, error_handler]
+        self._poller.register(raw_socket,
+                self._event_flags(raw_socket, error_handler))
+
+    def modify(self, socket, handler, error_handler=None):
+        """Replace the handlers of a registered socket
+
+        :param socket: A registered socket
+        :param handler: A callable that handles input events on the socket
+        :param error_handler: (optional) A callable that handles error events
+            on the socket
+        """
+        raw_socket = raw_socket_for(socket)
+        if raw_socket not in self._handler_map:
+            raise KeyError('%r is not registered' % socket)
+        self._handler_map[raw_socket] = [socket, handler, error_handler]
+        self._poller.modify(raw_socket,
+                self._event_flags(raw_socket, error_handler))
+
+    def unregister(self, socket):
+        """Stop polling a registered socket. Any envelopes still waiting to be
+        sent on the socket are discarded.
+
+        :param socket: A registered socket
+        """
+        raw_socket = raw_socket_for(socket)
+        del self._handler_map[raw_socket]
+        self._output_queues.pop(raw_socket, None)
+        self._output_only.discard(raw_socket)
+        self._poller.unregister(raw_socket)
+
+    def _event_flags(self, raw_socket, error_handler):
+        flags = 0
+        if raw_socket not in self._output_only:
+            flags |= zmq.POLLIN
+        if error_handler:
+            flags |= zmq.POLLERR
+        if self._output_queues.get(raw_socket):
+            flags |= zmq.POLLOUT
+        return flags
+
+    def configure_output(self, socket, max_depth=None,
+            overflow=OVERFLOW_RAISE):
+        """Set the limit of a socket's output queue
+
+        :param socket: A :class:`~dploylib.transport.Socket`
+        :param max_depth: (optional) The most envelopes that can wait. Defaults
+            to None which doesn't limit the queue
+        :param overflow: (optional) The :class:`OutputQueue` overflow policy.
+            Defaults to ``'raise'``
+        """
+        queue = self._output_queue(raw_socket_for(socket))
+        if max_depth is not None and len(queue) > max_depth:
+            raise ValueError('More than %d envelopes are already waiting' %
+                    max_depth)
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy "%s"' % overflow)
+        queue.max_depth = max_depth
+        queue.overflow = overflow
+
+    def _output_queue(self, raw_socket):
+        queue = self._output_queues.get(raw_socket)
+        if queue is None:
+            queue = OutputQueue(max_depth=self._max_depth)
+            self._output_queues[raw_socket] = queue
+        return queue
+
+    def output_stats(self, socket):
+        """A dictionary of counters for a socket's output. See
+        :meth:`OutputQueue.stats`
+        """
+        queue = self._output_queues.get(raw_socket_for(socket))
+        if queue is None:
+            queue = OutputQueue()
+        return queue.stats()
+
+    def send_envelope(self, socket, envelope):
+        """Send an envelope without blocking the poll loop. If the socket
+        can't take the envelope now it is queued and sent once the socket is
+        writable. Envelopes on a socket are always sent in order.
+
+        Returns True if the envelope was sent immediately.
+
+        :param socket: A :class:`~dploylib.transport.Socket`
+        :param envelope: The :class:`~dploylib.transport.Envelope` to send
+        :raises: :class:`OutputQueueFull` if the socket's queue is full and
+            its overflow policy is ``'raise'``
+        """
+        raw_socket = raw_socket_for(socket)
+        queue = self._output_queue(raw_socket)
+        if queue:
+            queue.append(envelope)
+            return False
+        if socket.try_send_envelope(envelope):
+            queue.sent_immediately += 1
+            return True
+        queue.append(envelope)
+        self._watch_output(socket, raw_socket)
+        return False
+
+    def pending_count(self, socket):
+        """The number of envelopes waiting to be sent on a socket"""
+        queue = self._output_queues.get(raw_socket_for(socket))
+        if queue is None:
+            return 0
+        return len(queue)
+
+    def _watch_output(self, socket, raw_socket):
+        handler_info = self._handler_map.get(raw_socket)
+        if handler_info is None:
+            self._output_only.add(raw_socket)
+            self._handler_map[raw_socket] = [socket, None, None]
+            self._poller.register(raw_socket, zmq.POLLOUT)
+            return
+        self._poller.modify(raw_socket,
+                self._event_flags(raw_socket, handler_info[2]))
+
+    def flush(self, socket):
+        """Send as many of a socket's pending envelopes as it will take
+        without blocking. Returns True once nothing is left to send.
+
+        :param socket: A :class:`~dploylib.transport.Socket`
+        """
+        raw_socket = raw_socket_for(socket)
+        queue = self._output_queues.get(raw_socket)
+        if not queue:
+            return True
+        envelopes = queue.envelopes
+        while envelopes:
+            if not socket.try_send_envelope(envelopes[0]):
+                return False
+            envelopes.popleft()
+            queue.sent_queued += 1
+        if raw_socket in self._output_only:
+            self._output_only.remove(raw_socket)
+            del self._handler_map[raw_socket]
+            self._poller.unregister(raw_socket)
+        else:
+            error_handler = self._handler_map[raw_socket][2]
+            self._poller.modify(raw_socket,
+                    self._event_flags(raw_socket, error_handler))
+        return True
+
+    def call_later(self, delay, callback, *args):
+        """Schedule a callback to run once
+
+        :param delay: Seconds to wait before calling the callback
+        :param callback: The callable to call
+        :returns: A :class:`Timer` that can be cancelled
+        """
+        return self._schedule(delay, None, callback, args)
+
+    def call_every(self, interval, callback, *args):
+        """Schedule a callback to run repeatedly
+
+        :param interval: Seconds between each call of the callback
+        :param callback: The callable to call
+        :returns: A :class:`Timer` that can be cancelled
+        """
+        return self._schedule(interval, interval, callback, args)
+
+    def _schedule(self, delay, interval, callback, args):
+        timer = Timer(self._clock() + delay, interval, callback, args,
+                on_cancel=self._timer_cancelled)
+        self._push_timer(timer)
+        return timer
+
+    def _push_timer(self, timer):
+        heapq.heappush(self._timers,
+                (timer.deadline, next(self._timer_counter), timer))
+
+    def _timer_cancelled(self, timer):
+        """Drop cancelled timers once they make up most of the schedule so
+        that short lived timers with long delays don't pile up"""
+        self._cancelled_timers += 1
+        timers = self._timers
+        if self._cancelled_timers * 2 <= len(timers):
+            return
+        # Compact in place as run_timers may hold a reference to the list
+        timers[:] = [entry for entry in timers if not entry[2].cancelled]
+        heapq.heapify(timers)
+        self._cancelled_timers = 0
+
+    def _next_timer(self):
+        """Get the next timer that has not been cancelled"""
+        timers = self._timers
+        while timers:
+            timer = timers[0][2]
+            if not timer.cancelled:
+                return timer
+            heapq.heappop(timers)
+            self._cancelled_timers = max(self._cancelled_timers - 1, 0)
+        return None
+
+    def _poll_timeout(self, timeout):
+        """The poll timeout in milliseconds given the next timer"""
+        timer = self._next_timer()
+        if not timer:
+            return timeout
+        delay = max(0, (timer.deadline - self._clock()) * 1000)
+        if timeout is None:
+            return delay
+        return min(timeout, delay)
+
+    def run_timers(self):
+        """Run all the timers that are due"""
+        timers = self._timers
+        now = self._clock()
+        while True:
+            timer = self._next_timer()
+            if not timer or timer.deadline > now:
+                break
+            heapq.heappop(timers)
+            if timer.interval is not None:
+                deadline = timer.deadline + timer.interval
+                if deadline <= now:
+                    # Skip any intervals that were missed instead of running
+                    # the timer several times in a row
+                    deadline = now + timer.interval
+                timer.deadline = deadline
+                self._push_timer(timer)
+            timer()
 
     def poll(self, timeout=None):
-        """Poll the sockets for any input and route to any relevant handlers
+        """Poll the sockets for any input and route to any relevant handlers.
+        Any timers that are due are run afterwards.
 
-        :param timeout: The timeout in seconds
+        :param timeout: The timeout in milliseconds. The poll returns sooner
+            if a timer is due
         :type timeout: float
         """
-        sockets = dict(self._poller.poll(timeout=timeout))
-        for raw_socket, handler_info in self._handler_map.iteritems():
-            socket, handler = handler_info
-            if raw_socket in sockets and sockets[raw_socket] == zmq.POLLIN:
-                socket, handler = handler_info
+        events = self._poller.poll(timeout=self._poll_timeout(timeout))
+        handler_map = self._handler_map
+        for raw_socket, event in events:
+            # A handler that ran before this one may have unregistered it
+            handler_info = handler_map.get(raw_socket)
+            if not handler_info:
+                continue
+            socket, handler, error_handler = handler_info
+            if event & zmq.POLLERR and error_handler:
+                error_handler(socket)
+            if event & zmq.POLLIN and handler:
                 handler(socket)
+            if event & zmq.POLLOUT:
+                self.flush(socket)
+        if self._timers:
+            self.run_timers()
@@ -8,7 +8,8 @@ Defines a wrapper for received data on a socket. This can be used in
 conjunction with socket.receive_envelope.
 """
 
-import json
+from .codec import codecs, JSON_MIMETYPE
+from .compression import decompress
 
 
 class DataNotDeserializable(Exception):
@@ -24,35 +25,108 @@ class ReceivedData(object):
         :class:`~dploylib.transport.envelope.Envelope`
     :param deserializer: (optional) A class that implements a classmethod
         ``deserialize`` which is used to deserialize any data in the envelope
+    :param compression: (optional) The
+        :class:`~dploylib.transport.compression.Compression` of the socket the
+        envelope was received on. Its ``max_size`` limits the decompressed
+        data
     """
-    def __init__(self, envelope, deserializer=None):
+    def __init__(self, envelope, deserializer=None, compression=None):
         self.envelope = envelope
         self._deserializer = deserializer
-        self._json = None
+        self._compression = compression
+        self._mimetype = None
+        self._data = None
+        self._decoded = None
         self._obj = None
 
+    def _decompress(self):
+        envelope = self.envelope
+        compression = self._compression
+        if compression:
+            self._mimetype, self._data = compression.decompress(
+                    envelope.mimetype, envelope.data)
+        else:
+            self._mimetype, self._data = decompress(envelope.mimetype,
+                    envelope.data)
+
+    @property
+    def mimetype(self):
+        """The mimetype of the data. Compressed data has the mimetype it had
+        before it was compressed.
+        """
+        if self._mimetype is None:
+            self._decompress()
+        return self._mimetype
+
+    @property
+    def data(self):
+        """The received data as a str. Compressed data is decompressed,
+        unlike ``envelope.data`` which is always the data as it was sent
+        """
+        if self._data is None:
+            self._decompress()
+        return self._data
+
+    @property
+    def decoded(self):
+        """The data decoded by the codec registered for the envelope's
+        mimetype. None if there isn't a codec for the mimetype.
+        """
+        decoded = self._decoded
+        if decoded is None:
+            mimetype = self.mimetype
+            if mimetype in codecs:
+                decoded = codecs.decode(mimetype, self.data)
+                self._decoded = decoded
+        return decoded
+
+    @property
+    def header(self):
+        """The envelope's :class:`~dploylib.transport.envelope.Header`. None
+        if the sender didn't send one.
+        """
+        return self.envelope.header
+
+    def age(self, now=None):
+        """Seconds since the data was sent. None if the sender didn't say
+        when it was sent.
+
+        :param now: (optional) The current unix time
+        """
+        header = self.envelope.header
+        if header is None:
+            return None
+        return header.age(now=now)
+
+    def expired(self, now=None):
+        """Checks if the sender's deadline for the data has passed. False if
+        the sender didn't set a deadline.
+
+        :param now: (optional) The current unix time
+        """
+        header = self.envelope.header
+        if header is None:
+            return False
+        return header.expired(now=now)
+
     @property
     def json(self):
         """If the mimetype for the data is application/json return json"""
-        json_data = self._json
-        if not json_data:
-            envelope = self.envelope
-            if envelope.mimetype == 'application/json':
-                json_data = json.loads(envelope.data)
-                self._json = json_data
-        return json_data
+        if self.mimetype != JSON_MIMETYPE:
+            return None
+        return self.decoded
 
     @property
     def obj(self):
-        """Grab the object represented by the json data"""
+        """Grab the object represented by the decoded data"""
         deserializer = self._deserializer
         if not deserializer:
             return None
         obj = self._obj
         if not obj:
-            json_data = self.json
-            if json_data is None:
+            decoded = self.decoded
+            if decoded is None:
                 raise DataNotDeserializable()
-            obj = deserializer.deserialize(json_data)
+            obj = deserializer.deserialize(decoded)
             self._obj = obj
         return obj
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+"""
+dploylib.transport.stream
+~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Streams send a large body as a series of chunk envelopes so that neither side
+holds the whole body in memory::
+
+    # Sender
+    with open(archive_path, 'rb') as archive:
+        socket.send_stream(archive, window=8)
+
+    # Receiver
+    for chunk in socket.receive_stream(window=8):
+        output.write(chunk)
+
+Every envelope of a stream has the same id. Chunks have the mimetype
+:data:`STREAM_CHUNK_MIMETYPE` and the stream ends with an envelope with the
+mimetype :data:`STREAM_END_MIMETYPE`.
+
+On sockets that can reply to the sender a ``window`` enables flow control
+with credits. That is pair sockets, or router sockets whose peers send the
+empty delimiter frame before the envelope like req sockets do. The sender
+starts with ``window`` credits and each chunk uses one. The receiver sends
+back ``window`` credits each time it has consumed ``window`` chunks, so at
+most ``window`` chunks are ever queued between the two. Both sides must use
+the same window. On other sockets the sender is slowed down by the socket's
+high water mark instead.
+
+A socket should only carry the stream while it is being sent or received.
+Envelopes with another id than the stream's first envelope raise a
+:class:`StreamError`. Pass a ``timeout`` to both sides so a peer that stops
+sending chunks or granting credits raises a :class:`StreamTimeout` instead of
+blocking forever.
+"""
+
+from .envelope import Envelope
+
+STREAM_CHUNK_MIMETYPE = 'application/x-dploy-stream'
+STREAM_END_MIMETYPE = 'application/x-dploy-stream-end'
+STREAM_CREDIT_MIMETYPE = 'application/x-dploy-stream-credit'
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class StreamError(Exception):
+    pass
+
+
+class StreamTimeout(StreamError):
+    pass
+
+
+def iter_chunks(source, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Iterates over the chunks of a file-like object or an iterable of strs
+
+    :param source: A file-like object or an iterable of strs
+    :param chunk_size: (optional) Bytes read from a file-like object at a time
+    """
+    if hasattr(source, 'read'):
+        return iter(lambda: source.read(chunk_size), '')
+    return iter(source)
+
+
+def receive_stream_envelope(socket, timeout=None):
+    """Receives the next envelope of a stream
+
+    :param socket: A :class:`~dploylib.transport.Socket`
+    :param timeout: (optional) Seconds to wait for the envelope. Defaults to
+        None which waits forever
+    :raises: :class:`StreamTimeout` if nothing arrives in time
+    """
+    if timeout is not None and not socket.poll(timeout * 1000):
+        raise StreamTimeout('Nothing received on the stream for %ss' %
+                timeout)
+    return socket.receive_envelope()
+
+
+def wait_for_credit(socket, id='', timeout=None):
+    """Waits for a credit envelope and returns the number of credits
+
+    :param socket: A :class:`~dploylib.transport.Socket`
+    :param id: (optional) The id of the stream. Defaults to ''
+    :param timeout: (optional) Seconds to wait for the credits. Defaults to
+        None which waits forever
+    """
+    envelope = receive_stream_envelope(socket, timeout=timeout)
+    if envelope.mimetype != STREAM_CREDIT_MIMETYPE:
+        raise StreamError('Expected stream credits instead received "%s"' %
+                envelope.mimetype)
+    if envelope.id != id:
+        raise StreamError('Expected credits for stream "%s" instead received '
+                'credits for "%s"' % (id, envelope.id))
+    return int(envelope.data)
+
+
+def send_stream(socket, source, id='', chunk_size=DEFAULT_CHUNK_SIZE,
+        window=None, request_frames=None, timeout=None):
+    """Sends a stream of chunks on a socket. Returns the number of chunks sent.
+
+    With a window this returns once the receiver has granted credits for every
+    full window, so no credit envelopes are left on the socket.
+
+    :param socket: A :class:`~dploylib.transport.Socket`
+    :param source: A file-like object or an iterable of strs
+    :param id: (optional) The id of the stream's envelopes. Defaults to ''
+    :param chunk_size: (optional) Bytes read from a file-like object at a time
+    :param window: (optional) Chunks that can be sent before the receiver
+        grants more credits. Defaults to None which doesn't use credits
+    :param request_frames: (optional) Routing frames for the stream's
+        envelopes. Needed to stream from a router socket
+    :param timeout: (optional) Seconds to wait for each credit envelope.
+        Defaults to None which waits forever
+    :raises: :class:`StreamTimeout` if the receiver stops granting credits
+    """
+    credits = window
+    credit_envelopes = 0
+    count = 0
+    for chunk in iter_chunks(source, chunk_size=chunk_size):
+        if window:
+            if not credits:
+                credits = wait_for_credit(socket, id=id, timeout=timeout)
+                credit_envelopes += 1
+            credits -= 1
+        socket.send_envelope(Envelope.new(STREAM_CHUNK_MIMETYPE, chunk,
+                id=id, request_frames=request_frames))
+        count += 1
+    socket.send_envelope(Envelope.new(STREAM_END_MIMETYPE, str(count),
+            id=id, request_frames=request_frames))
+    if window:
+        # The receiver grants credits after every full window it consumes
+        for i in xrange(count // window - credit_envelopes):
+            wait_for_credit(socket, id=id, timeout=timeout)
+    return count
+
+
+def receive_stream(socket, window=None, timeout=None):
+    """Iterates over the chunks of a stream received on a socket
+
+    :param socket: A :class:`~dploylib.transport.Socket`
+    :param window: (optional) The window used by the sender. Defaults to None
+        which doesn't use credits
+    :param timeout: (optional) Seconds to wait for each envelope of the
+        stream. Defaults to None which waits forever
+    :raises: :class:`StreamTimeout` if the sender stops sending
+    """
+    count = 0
+    stream_id = None
+    while True:
+        envelope = receive_stream_envelope(socket, timeout=timeout)
+        if stream_id is None:
+            stream_id = envelope.id
+        elif envelope.id != stream_id:
+            raise StreamError('Expected an envelope of stream "%s" instead '
+                    'received one of "%s"' % (stream_id, envelope.id))
+        mimetype = envelope.mimetype
+        if mimetype == STREAM_END_MIMETYPE:
+            expected = int(envelope.data)
+            if expected != count:
+                raise StreamError('Stream ended after %d of %d chunks' %
+                        (count, expected))
+            return
+        if mimetype != STREAM_CHUNK_MIMETYPE:
+            raise StreamError('Expected a stream chunk instead received "%s"'
+                    % mimetype)
+        yield envelope.data
+        count += 1
+        if window and not count % window:
+            socket.send_envelope(envelope.response_envelope(
+                    STREAM_CREDIT_MIMETYPE, str(window)))
@@ -8,9 +8,11 @@ This module defines a thin wrapper around zmq. This will allow dploy's stack to
 change certain behaviour by simply changing this library.
 """
 
-import json
 import zmq
 from .envelope import Envelope
+from .codec import codecs, JSON_MIMETYPE
+from .compression import decompress
+from . import stream
 
 TEXT_MIMETYPE = 'text/plain'
 
@@ -27,6 +29,24 @@ def get_zmq_constant(name):
     return getattr(zmq, name.upper())
 
 
+def hwm_options(value):
+    """The zeromq options that set a socket's high water mark. zeromq 3 and
+    later have separate send and receive high water marks instead of one.
+    """
+    if hasattr(zmq, 'HWM'):
+        return [(zmq.HWM, value)]
+    return [(zmq.SNDHWM, value), (zmq.RCVHWM, value)]
+
+
+def trackable_part(part):
+    """Received frames can't be tracked by zeromq, so send their buffer
+    instead. The buffer is still not copied.
+    """
+    if isinstance(part, zmq.Frame):
+        return part.buffer
+    return part
+
+
 class Context(object):
     """A wrapper around a zeromq Context
 
@@ -44,10 +64,21 @@ class Context(object):
     def __init__(self, zmq_context):
         self._zmq_context = zmq_context
 
-    def socket(self, socket_type):
+    @property
+    def zmq_context(self):
+        return self._zmq_context
+
+    def socket(self, socket_type, copy=True):
+        """Create a new :class:`Socket`
+
+        :param socket_type: Name of the socket type
+        :type socket_type: str
+        :param copy: (optional) Set to False to receive envelopes without
+            copying their frames. Defaults to True
+        """
         zmq_socket_type = get_zmq_constant(socket_type)
         zmq_socket = self._zmq_context.socket(zmq_socket_type)
-        return Socket(zmq_socket, self)
+        return Socket(zmq_socket, self, copy=copy)
 
 
 class Socket(object):
@@ -55,22 +86,42 @@ class Socket(object):
 
     :param zmq_socket: The underlying zeromq socket
     :param zmq_context: The zeromq context related to the zeromq socket
+    :param copy: (optional) Whether or not frames are copied. When False,
+        received envelopes hold onto ``zmq.Frame`` objects and only convert
+        their body to a str when it is read, and sent envelopes hand their
+        frames to zeromq without copying them. Defaults to True
+
+    Set :attr:`compression` to a
+    :class:`~dploylib.transport.compression.Compression` to compress the
+    bodies sent by :meth:`send_obj` and :meth:`send_text` by default. Its
+    ``max_size`` also limits bodies decompressed by :meth:`receive_obj` and
+    :meth:`receive_text`.
+
+    Set :attr:`metrics` to a
+    :class:`~dploylib.transport.metrics.SocketMetrics` to count the envelopes
+    sent on the socket.
     """
+    compression = None
+    metrics = None
+
     @classmethod
-    def new(cls, socket_type, context=None):
+    def new(cls, socket_type, context=None, copy=True):
         """Creates a new socket
 
         :param socket_type: Name of the socket type
         :type socket_type: str
         :param context: (optional) A :class:`Context`. Defaults to creating a
             new :class:`Context`
+        :param copy: (optional) Whether or not received frames are copied.
+            Defaults to True
         """
         context = context or Context.new()
-        socket = context.socket(socket_type)
+        socket = context.socket(socket_type, copy=copy)
         return socket
 
     @classmethod
-    def connect_new(cls, socket_type, uri, options=None, context=None):
+    def connect_new(cls, socket_type, uri, options=None, context=None,
+            copy=True):
         """Create and connect a new socket
 
         :param socket_type: Name of the socket type
@@ -78,8 +129,10 @@ class Socket(object):
         :param uri: URI of the socket to connect to
         :param context: (optional) A :class:`Context`. Defaults to creating a
             new :class:`Context`
+        :param copy: (optional) Whether or not received frames are copied.
+            Defaults to True
         """
-        socket = cls.new(socket_type, context=context)
+        socket = cls.new(socket_type, context=context, copy=copy)
         options = options or []
         for option, value in options:
             socket.set_option(option, value)
@@ -87,7 +140,8 @@ class Socket(object):
         return socket
 
     @classmethod
-    def bind_new(cls, socket_type, uri, options=None, context=None):
+    def bind_new(cls, socket_type, uri, options=None, context=None,
+            copy=True):
         """Create and bind a new socket
 
         :param socket_type: Name of the socket type
@@ -95,17 +149,20 @@ class Socket(object):
         :param uri: URI of the socket to bind to
         :param context: (optional) A :class:`Context`. Defaults to creating a
             new :class:`Context`
+        :param copy: (optional) Whether or not received frames are copied.
+            Defaults to True
         """
-        socket = cls.new(socket_type, context=context)
+        socket = cls.new(socket_type, context=context, copy=copy)
         options = options or []
         for option, value in options:
-            socket.setup_option(option, value)
+            socket.set_option(option, value)
         socket.bind(uri)
         return socket
 
-    def __init__(self, zmq_socket, zmq_context):
+    def __init__(self, zmq_socket, zmq_context, copy=True):
         self._zmq_socket = zmq_socket
         self._zmq_context = zmq_context
+        self._copy = copy
 
     @property
     def zmq_context(self):
@@ -115,16 +172,28 @@ class Socket(object):
     def zmq_socket(self):
         return self._zmq_socket
 
+    @property
+    def copy(self):
+        return self._copy
+
     def set_option(self, option, value):
         """Set a socket option
 
+        The ``hwm`` option sets both the send and receive high water marks on
+        versions of zeromq that have separate ones. Set high water marks
+        before binding or connecting so they apply to every connection.
+
         :param option: Name of the option
         :type option: str
         :param value: Value of the option
         :type value: str or int. Depends on the option.
         """
-        socket_option = get_zmq_constant(option)
         cleaned_option = clean_option_value(value)
+        if option.lower() == 'hwm':
+            for socket_option, hwm in hwm_options(cleaned_option):
+                self.zmq_socket.setsockopt(socket_option, hwm)
+            return
+        socket_option = get_zmq_constant(option)
         self.zmq_socket.setsockopt(socket_option, cleaned_option)
 
     def bind(self, uri):
@@ -148,59 +217,197 @@ class Socket(object):
         """Connect the socket to a URI"""
         self.zmq_socket.connect(uri)
 
-    def send_obj(self, obj, id=''):
+    def close(self, linger=None):
+        """Close the socket
+
+        :param linger: (optional) Milliseconds to wait for unsent messages.
+            Defaults to the socket's linger option
+        """
+        self.zmq_socket.close(linger=linger)
+
+    def send_obj(self, obj, id='', mimetype=JSON_MIMETYPE, header=None,
+            compression=None):
         """Sends encoded an object as encoded data.
 
-        The encoding can be anything. Default is JSON. This could change later
-        and should not affect communications.
+        The encoding can be any codec registered in
+        :data:`dploylib.transport.codec.codecs`. Default is JSON. The
+        envelope's mimetype tells the receiver how to decode the data.
 
         The object must implement the method __serialize__
 
         :param obj: An object that implements a serialize method that returns
             any data that can be serialized (ie. lists, dict, strings, ints)
         :param id: The id for the envelope. Defaults to ''
+        :param mimetype: (optional) The mimetype of the codec used to encode
+            the data. Defaults to ``application/json``
+        :param header: (optional) A
+            :class:`~dploylib.transport.envelope.Header` to send with the data
+        :param compression: (optional) A
+            :class:`~dploylib.transport.compression.Compression` for the
+            data. Defaults to the socket's :attr:`compression`
         """
+        self.send_envelope(self.obj_envelope(obj, id=id, mimetype=mimetype,
+            header=header, compression=compression))
 
-        mimetype = 'application/json'
-        json_str = json.dumps(obj.serialize())
-        envelope = Envelope.new(mimetype, json_str, id=id)
-        self.send_envelope(envelope)
+    def obj_envelope(self, obj, id='', mimetype=JSON_MIMETYPE, header=None,
+            compression=None):
+        """Creates the envelope :meth:`send_obj` sends for an object without
+        sending it. Takes the same arguments as :meth:`send_obj`.
+        """
+        encoded = codecs.encode(mimetype, obj.serialize())
+        compression = compression or self.compression
+        if compression:
+            mimetype, encoded = compression.compress(mimetype, encoded)
+        return Envelope.new(mimetype, encoded, id=id, header=header)
 
-    def send_text(self, text, id=''):
+    def send_text(self, text, id='', header=None, compression=None):
         """Sends a simple text message
 
         :param text: Text to send
         :param id: The id for the envelope. Defaults to ''
+        :param header: (optional) A
+            :class:`~dploylib.transport.envelope.Header` to send with the text
+        :param compression: (optional) A
+            :class:`~dploylib.transport.compression.Compression` for the
+            text. Defaults to the socket's :attr:`compression`
         """
-        mimetype = 'text/plain'
-        envelope = Envelope.new(mimetype, text, id=id)
+        mimetype = TEXT_MIMETYPE
+        compression = compression or self.compression
+        if compression:
+            mimetype, text = compression.compress(mimetype, text)
+        envelope = Envelope.new(mimetype, text, id=id, header=header)
         self.send_envelope(envelope)
 
-    def send_envelope(self, envelope):
-        """Send an :class:`~dploylib.transport.envelope.Envelope`"""
+    def send_stream(self, source, id='', chunk_size=stream.DEFAULT_CHUNK_SIZE,
+            window=None, request_frames=None, timeout=None):
+        """Sends a large body as a stream of chunks. See
+        :mod:`dploylib.transport.stream`. Returns the number of chunks sent.
+
+        :param source: A file-like object or an iterable of strs
+        :param id: (optional) The id of the stream's envelopes. Defaults to ''
+        :param chunk_size: (optional) Bytes read from a file-like object at a
+            time. Defaults to 64KiB
+        :param window: (optional) Chunks that can be sent before the receiver
+            grants more credits. Defaults to None which doesn't use credits
+        :param request_frames: (optional) Routing frames for the stream's
+            envelopes
+        :param timeout: (optional) Seconds to wait for each credit envelope.
+            Defaults to None which waits forever
+        """
+        return stream.send_stream(self, source, id=id, chunk_size=chunk_size,
+                window=window, request_frames=request_frames, timeout=timeout)
+
+    def send_envelope(self, envelope, copy=None, track=False):
+        """Send an :class:`~dploylib.transport.envelope.Envelope`
+
+        Received envelopes are sent using the frames they were received with,
+        so forwarding an envelope from a socket created with ``copy=False``
+        never copies its data.
+
+        :param envelope: The envelope to send
+        :param copy: (optional) Whether or not to copy the frames. Defaults to
+            the socket's ``copy`` setting
+        :param track: (optional) Set to True to return a
+            ``zmq.MessageTracker`` that reports when zeromq is done with the
+            sent buffers so they can be safely reused. Only meaningful when
+            not copying. Defaults to False
+        """
+        if copy is None:
+            copy = self._copy
         multipart_object = envelope.transfer_object()
-        self.zmq_socket.send_multipart(multipart_object)
+        if track:
+            multipart_object = map(trackable_part, multipart_object)
+        tracker = self.zmq_socket.send_multipart(multipart_object, copy=copy,
+                track=track)
+        metrics = self.metrics
+        if metrics:
+            metrics.record_sent(envelope)
+        return tracker
+
+    def try_send_envelope(self, envelope, copy=None):
+        """Send an :class:`~dploylib.transport.envelope.Envelope` without
+        blocking. Returns False if the socket is at its high water mark and
+        the envelope wasn't sent.
+
+        A pub socket drops envelopes at its high water mark instead, unless
+        its ``xpub_nodrop`` option is set.
+
+        :param envelope: The envelope to send
+        :param copy: (optional) Whether or not to copy the frames. Defaults to
+            the socket's ``copy`` setting
+        """
+        if copy is None:
+            copy = self._copy
+        try:
+            self.zmq_socket.send_multipart(envelope.transfer_object(),
+                    zmq.NOBLOCK, copy=copy)
+        except zmq.Again:
+            return False
+        metrics = self.metrics
+        if metrics:
+            metrics.record_sent(envelope)
+        return True
 
     def receive_obj(self, handler):
         """Receives an :class:`~dploylib.transport.envelope.Envelope` and calls
         an object to handle the envelope data.
 
+        The data is decompressed if needed and decoded with the codec
+        registered for the envelope's mimetype.
+
         :param handler: A callable that transforms the data into an object
         """
-        envelope = self.receive_envelope()
-        obj_data = json.loads(envelope.data)
+        mimetype, data = self._decompress(self.receive_envelope())
+        obj_data = codecs.decode(mimetype, data)
         return handler(obj_data)
 
+    def _decompress(self, envelope):
+        compression = self.compression
+        if compression:
+            return compression.decompress(envelope.mimetype, envelope.data)
+        return decompress(envelope.mimetype, envelope.data)
+
     def receive_text(self):
         """Convenience method to receive plain text"""
-        envelope = self.receive_envelope()
-        mimetype = envelope.mimetype
+        mimetype, data = self._decompress(self.receive_envelope())
         if mimetype != TEXT_MIMETYPE:
             raise ValueError('Expected envelope with mimetype "%s" instead '
                     'received "%s"' % (TEXT_MIMETYPE, mimetype))
-        return envelope.data
+        return data
+
+    def receive_stream(self, window=None, timeout=None):
+        """Iterates over the chunks of a stream sent with :meth:`send_stream`
+
+        :param window: (optional) The window used by the sender. Defaults to
+            None which doesn't use credits
+        :param timeout: (optional) Seconds to wait for each envelope of the
+            stream. Defaults to None which waits forever
+        """
+        return stream.receive_stream(self, window=window, timeout=timeout)
+
+    def poll(self, timeout=None):
+        """Wait until an envelope can be received. Returns True if one can.
 
-    def receive_envelope(self):
-        """Receive an :class:`~dploylib.transport.envelope.Envelope`"""
-        raw_envelope = self.zmq_socket.recv_multipart()
+        :param timeout: (optional) The timeout in milliseconds. Defaults to
+            None which waits forever
+        """
+        return bool(self.zmq_socket.poll(timeout, zmq.POLLIN))
+
+    def receive_envelope(self, block=True):
+        """Receive an :class:`~dploylib.transport.envelope.Envelope`
+
+        If the socket was created with ``copy=False`` the envelope's body is
+        left as a ``zmq.Frame`` until its data is read.
+
+        :param block: (optional) Set to False to return None instead of
+            waiting when no envelope is available. Defaults to True
+        """
+        flags = 0
+        if not block:
+            flags = zmq.NOBLOCK
+        try:
+            raw_envelope = self.zmq_socket.recv_multipart(flags,
+                    copy=self._copy)
+        except zmq.Again:
+            return None
         return Envelope.from_raw(raw_envelope)
@@ -14,7 +14,8 @@ setup(name='dploy-lib',
     url="https://github.com/ravenac95/dploy-lib",
     license='MIT',
     platforms='*nix',
-    packages=find_packages(exclude=['ez_setup', 'examples', 'prototyping', 'tests']),
+    packages=find_packages(exclude=['ez_setup', 'examples', 'prototyping', 'tests',
+        'benchmarks']),
     include_package_data=True,
     zip_safe=False,
     install_requires=[
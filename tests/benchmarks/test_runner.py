@@ -0,0 +1,70 @@
+from nose.tools import eq_
+from mock import Mock
+from benchmarks.runner import *
+
+
+def test_case_key():
+    eq_(case_key('socket', dict(size=64, pattern='pair')),
+            'socket[pattern=pair,size=64]')
+    eq_(case_key('socket', {}), 'socket')
+
+
+def test_cases_cover_the_matrix():
+    bench = Benchmark('bench', Mock(), dict(size=[1, 2], kind=['a', 'b']))
+
+    keys = [key for key, params in bench.cases()]
+
+    eq_(keys, ['bench[kind=a,size=1]', 'bench[kind=a,size=2]',
+        'bench[kind=b,size=1]', 'bench[kind=b,size=2]'])
+
+
+class FakeClock(object):
+    """Every run of a case takes 0.01 seconds per iteration"""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def run(self, iterations):
+        self.now += 0.01 * iterations
+
+
+def test_measure():
+    clock = FakeClock()
+
+    result = measure(clock.run, min_time=1, repeat=3, clock=clock)
+
+    assert result['iterations'] >= 100
+    eq_(round(result['median'], 6), 0.01)
+    eq_(round(result['ops_per_sec']), 100)
+
+
+def test_run_benchmarks_filters_and_closes():
+    run = Mock()
+    factory = Mock(return_value=run)
+    bench = Benchmark('bench', factory, dict(size=[1, 2]))
+    patterns = ['bench[size=2]']
+
+    results = run_benchmarks([bench], patterns=patterns, min_time=0,
+            repeat=1)
+
+    eq_(results.keys(), ['bench[size=2]'])
+    factory.assert_called_once_with(size=2)
+    run.close.assert_called_once_with()
+
+
+def test_compare():
+    results = dict(a=dict(ops_per_sec=80.0), b=dict(ops_per_sec=95.0),
+            c=dict(ops_per_sec=10.0))
+    baseline = dict(a=dict(ops_per_sec=100.0), b=dict(ops_per_sec=100.0))
+
+    comparison = compare(results, baseline, tolerance=0.1)
+
+    eq_(comparison, [('a', 0.8, True), ('b', 0.95, False)])
+
+
+def test_matches():
+    eq_(matches('socket[size=64]', 'socket[size=64]'), True)
+    eq_(matches('socket[size=64]', 'socket*'), True)
+    eq_(matches('socket[size=64]', 'poll*'), False)
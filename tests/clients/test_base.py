@@ -1,6 +1,9 @@
-from nose.tools import eq_
+import threading
+from nose.tools import eq_, raises
+from nose.plugins.attrib import attr
 from testkit import *
 from mock import Mock, patch
+from dploylib.transport import Context
 from dploylib.clients.base import *
 
 
@@ -35,6 +38,133 @@ class TestRequestClient(object):
 
         eq_(response, mock_received.return_value)
 
+    def test_request_timeout_resets_socket(self):
+        mock_socket = self.client._request_socket = Mock()
+        mock_socket.poll.return_value = False
+
+        try:
+            self.client.request('someobj', timeout=0.5)
+        except RequestTimeout:
+            pass
+        else:
+            raise AssertionError('Expected a RequestTimeout')
+
+        mock_socket.poll.assert_called_with(500)
+        mock_socket.close.assert_called_with(linger=0)
+        eq_(self.client._request_socket,
+                self.mock_context.socket.return_value)
+
+    @patch('dploylib.clients.base.time')
+    @patch('dploylib.clients.base.ReceivedData')
+    def test_request_retries(self, mock_received, mock_time):
+        self.client.retry_delay = Mock(return_value=0.25)
+        timed_out_socket = self.client._request_socket = Mock()
+        timed_out_socket.poll.return_value = False
+        new_socket = self.mock_context.socket.return_value
+        new_socket.poll.return_value = True
+
+        response = self.client.request('someobj', timeout=1, retries=2)
+
+        timed_out_socket.send_obj.assert_called_with('someobj')
+        new_socket.send_obj.assert_called_with('someobj')
+        self.client.retry_delay.assert_called_once_with(0)
+        mock_time.sleep.assert_called_once_with(0.25)
+        mock_received.assert_called_with(
+                new_socket.receive_envelope.return_value, 'fakeobj')
+        eq_(response, mock_received.return_value)
+
+    @patch('dploylib.clients.base.time')
+    @raises(RequestTimeout)
+    def test_request_retries_are_bounded(self, mock_time):
+        self.client._request_socket = Mock()
+        self.client._request_socket.poll.return_value = False
+        self.mock_context.socket.return_value.poll.return_value = False
+
+        try:
+            self.client.request('someobj', timeout=1, retries=2)
+        finally:
+            eq_(mock_time.sleep.call_count, 2)
+
+    @patch('dploylib.clients.base.random')
+    def test_retry_delay(self, mock_random):
+        self.client.retry_backoff = 0.1
+        self.client.max_retry_backoff = 0.3
+        mock_random.random.return_value = 1.0
+
+        eq_(self.client.retry_delay(0), 0.1)
+        eq_(self.client.retry_delay(1), 0.2)
+        eq_(self.client.retry_delay(5), 0.3)
+        mock_random.random.return_value = 0.0
+        eq_(self.client.retry_delay(1), 0.1)
+
+
+class Request(object):
+    def __init__(self, data):
+        self.data = data
+
+    def serialize(self):
+        return self.data
+
+
+@attr('large')
+class TestHedgedRequests(object):
+    def setup(self):
+        self.context = Context.new()
+        self.slow = self.context.socket('router')
+        self.slow.bind('inproc://slow')
+        self.fast = self.context.socket('router')
+        self.fast.bind('inproc://fast')
+        self.client = BaseRequestClient('inproc://slow', self.context,
+                hedge_uri='inproc://fast')
+        self.client.hedge_after = 0.01
+        self.client.connect()
+
+    def teardown(self):
+        self.slow.close(linger=0)
+        self.fast.close(linger=0)
+
+    def echo(self, server):
+        def echo():
+            server.send_envelope(server.receive_envelope())
+        thread = threading.Thread(target=echo)
+        thread.start()
+        return thread
+
+    def test_hedge_reply_is_used(self):
+        thread = self.echo(self.fast)
+
+        received = self.client.request(Request('hedged'), timeout=5)
+        thread.join()
+
+        eq_(received.json, 'hedged')
+        # The slow server got the request too
+        eq_(self.slow.receive_envelope().body, '"hedged"')
+
+    def test_no_hedge_for_fast_replies(self):
+        thread = self.echo(self.slow)
+
+        received = self.client.request(Request('fast'), timeout=5)
+        thread.join()
+
+        eq_(received.json, 'fast')
+        eq_(self.fast.poll(10), False)
+
+    @raises(RequestTimeout)
+    def test_hedged_request_times_out(self):
+        self.client.request(Request('lost'), timeout=0.05)
+
+    def test_sockets_are_reset_after_hedging(self):
+        thread = self.echo(self.fast)
+        self.client.request(Request('first'), timeout=5)
+        thread.join()
+        self.slow.receive_envelope()
+
+        thread = self.echo(self.slow)
+        received = self.client.request(Request('second'), timeout=5)
+        thread.join()
+
+        eq_(received.json, 'second')
+
 
 class TestListeningClient(object):
     def setup(self):
@@ -0,0 +1,73 @@
+"""
+tests.clients.test_green
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+Tests for the gevent pipelined client. These only run if gevent is installed.
+"""
+from nose.tools import eq_, raises
+from nose.plugins.skip import SkipTest
+from mock import Mock
+
+try:
+    import gevent
+except ImportError:
+    raise SkipTest('gevent is not installed')
+
+from dploylib.transport.green import GreenContext
+from dploylib.clients.base import RequestTimeout
+from dploylib.clients.pipeline import ClientClosed
+from dploylib.clients.green import GreenPipelinedRequestClient
+
+
+class Request(object):
+    def __init__(self, data):
+        self.data = data
+
+    def serialize(self):
+        return self.data
+
+
+class TestGreenPipelinedRequestClient(object):
+    def setup(self):
+        self.context = GreenContext.new()
+        self.uri = 'inproc://green-pipelined-client'
+        self.server = self.context.socket('router')
+        self.server.bind(self.uri)
+        self.client = GreenPipelinedRequestClient(self.uri, self.context)
+        self.client.connect()
+
+    def teardown(self):
+        self.client.close()
+        self.server.close(linger=0)
+
+    def test_replies_resolve_by_id(self):
+        results = [self.client.request(Request(index), timeout=5)
+                for index in xrange(10)]
+        envelopes = [self.server.receive_envelope() for i in xrange(10)]
+        for envelope in reversed(envelopes):
+            self.server.send_envelope(envelope)
+
+        eq_([result.get(timeout=5).json for result in results], range(10))
+        eq_(self.client.pending_count, 0)
+
+    def test_reply_cancels_timeout(self):
+        self.client._expire = Mock()
+        result = self.client.request(Request('found'), timeout=0.05)
+        self.server.send_envelope(self.server.receive_envelope())
+
+        eq_(result.get(timeout=5).json, 'found')
+        gevent.sleep(0.1)
+        eq_(self.client._expire.called, False)
+
+    @raises(RequestTimeout)
+    def test_timeout(self):
+        result = self.client.request(Request('lost'), timeout=0.01)
+
+        result.get(timeout=5)
+
+    @raises(ClientClosed)
+    def test_close_fails_pending_requests(self):
+        result = self.client.request(Request('lost'))
+
+        self.client.close()
+        result.get(timeout=5)
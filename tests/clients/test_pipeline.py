@@ -0,0 +1,223 @@
+import threading
+from nose.tools import eq_, raises
+from nose.plugins.attrib import attr
+from mock import Mock
+from dploylib.transport import Context, Envelope
+from dploylib.clients.base import RequestTimeout
+from dploylib.clients.pipeline import *
+
+
+class TestFuture(object):
+    def setup(self):
+        self.future = Future()
+
+    def test_result(self):
+        self.future.set_result('result')
+
+        assert self.future.done()
+        eq_(self.future.result(), 'result')
+        eq_(self.future.exception(), None)
+
+    @raises(ValueError)
+    def test_exception(self):
+        self.future.set_exception(ValueError())
+
+        self.future.result()
+
+    def test_resolves_once(self):
+        self.future.set_result('first')
+        self.future.set_exception(ValueError())
+
+        eq_(self.future.result(), 'first')
+
+    @raises(RequestTimeout)
+    def test_result_times_out(self):
+        self.future.result(timeout=0.01)
+
+    def test_done_callbacks(self):
+        callback = Mock()
+        self.future.add_done_callback(callback)
+        self.future.set_result('result')
+        late_callback = Mock()
+        self.future.add_done_callback(late_callback)
+
+        callback.assert_called_once_with(self.future)
+        late_callback.assert_called_once_with(self.future)
+
+
+class TestPendingRequests(object):
+    def setup(self):
+        self.pending = PendingRequests()
+
+    def test_ids_are_unique(self):
+        ids = set(self.pending.add(Mock()) for i in xrange(100))
+
+        eq_(len(ids), 100)
+        eq_(len(self.pending), 100)
+
+    def test_pop(self):
+        future = Mock()
+        request_id = self.pending.add(future, timeout=2)
+
+        eq_(self.pending.timeout(request_id), 2)
+        eq_(self.pending.pop(request_id), future)
+        eq_(self.pending.pop(request_id), None)
+        eq_(self.pending.timeout(request_id), None)
+
+    def test_pop_cancels_timer(self):
+        cancel = Mock()
+        request_id = self.pending.add(Mock(), timeout=2)
+        self.pending.set_timer(request_id, cancel)
+
+        self.pending.pop(request_id)
+
+        cancel.assert_called_once_with()
+
+    def test_pop_without_cancel(self):
+        cancel = Mock()
+        request_id = self.pending.add(Mock(), timeout=2)
+        self.pending.set_timer(request_id, cancel)
+
+        self.pending.pop(request_id, cancel=False)
+
+        eq_(cancel.called, False)
+
+    def test_set_timer_after_pop(self):
+        cancel = Mock()
+        request_id = self.pending.add(Mock(), timeout=2)
+        self.pending.pop(request_id)
+
+        self.pending.set_timer(request_id, cancel)
+
+        cancel.assert_called_once_with()
+
+    def test_fail_all(self):
+        futures = [Mock(), Mock()]
+        cancel = Mock()
+        for future in futures:
+            request_id = self.pending.add(future)
+        self.pending.set_timer(request_id, cancel)
+        exception = ClientClosed()
+
+        self.pending.fail_all(exception)
+
+        for future in futures:
+            future.set_exception.assert_called_with(exception)
+        cancel.assert_called_once_with()
+        eq_(len(self.pending), 0)
+
+
+def test_delimited():
+    envelope = Envelope.new('text/plain', 'hello', id='a')
+
+    eq_(delimited(envelope).transfer_object(),
+            [''] + envelope.transfer_object())
+
+
+class Request(object):
+    def __init__(self, data):
+        self.data = data
+
+    def serialize(self):
+        return self.data
+
+
+@raises(ClientClosed)
+def test_request_before_connect():
+    client = PipelinedRequestClient('inproc://unused', Mock())
+
+    client.request(Request('early'))
+
+
+@attr('large')
+class TestPipelinedRequestClient(object):
+    def setup(self):
+        self.context = Context.new()
+        self.uri = 'inproc://pipelined-client'
+        self.server = self.context.socket('router')
+        self.server.bind(self.uri)
+        self.client = PipelinedRequestClient(self.uri, self.context)
+        self.client.connect()
+
+    def teardown(self):
+        self.client.close()
+        self.server.close(linger=0)
+
+    def receive_all(self, count):
+        return [self.server.receive_envelope() for i in xrange(count)]
+
+    def test_replies_resolve_by_id(self):
+        futures = [self.client.request(Request(index), timeout=5)
+                for index in xrange(10)]
+        envelopes = self.receive_all(10)
+        # Reply out of order
+        for envelope in reversed(envelopes):
+            self.server.send_envelope(envelope)
+
+        eq_([future.result(timeout=5).json for future in futures], range(10))
+        eq_(self.client.pending_count, 0)
+
+    def test_request_from_threads(self):
+        results = []
+
+        def request(index):
+            futures = [self.client.request(Request(index), timeout=5)
+                    for i in xrange(5)]
+            results.extend(future.result(timeout=5).json
+                    for future in futures)
+        threads = [threading.Thread(target=request, args=(index,))
+                for index in xrange(4)]
+        for request_thread in threads:
+            request_thread.start()
+        for envelope in self.receive_all(20):
+            self.server.send_envelope(envelope)
+        for request_thread in threads:
+            request_thread.join()
+
+        eq_(sorted(results), sorted(range(4) * 5))
+
+    def test_timeout(self):
+        lost = self.client.request(Request('lost'), timeout=0.01)
+        found = self.client.request(Request('found'), timeout=5)
+        lost_envelope, found_envelope = self.receive_all(2)
+
+        try:
+            lost.result(timeout=5)
+        except RequestTimeout:
+            pass
+        else:
+            raise AssertionError('Expected a RequestTimeout')
+        # A late reply is ignored
+        self.server.send_envelope(lost_envelope)
+        self.server.send_envelope(found_envelope)
+
+        eq_(found.result(timeout=5).json, 'found')
+
+    def test_close_fails_pending_requests(self):
+        future = self.client.request(Request('lost'))
+
+        self.client.close()
+
+        assert isinstance(future.exception(timeout=5), ClientClosed)
+
+    def test_close_from_done_callback(self):
+        closed = threading.Event()
+
+        def close(future):
+            self.client.close()
+            closed.set()
+        first = self.client.request(Request('first'), timeout=5)
+        second = self.client.request(Request('second'), timeout=5)
+        first.add_done_callback(close)
+        envelope = self.receive_all(2)[0]
+        self.server.send_envelope(envelope)
+
+        assert closed.wait(5)
+        eq_(first.result(timeout=5).json, 'first')
+        assert isinstance(second.exception(timeout=5), ClientClosed)
+
+    @raises(ClientClosed)
+    def test_request_after_close(self):
+        self.client.close()
+
+        self.client.request(Request('late'))
@@ -0,0 +1,163 @@
+import threading
+from nose.tools import eq_, raises
+from nose.plugins.attrib import attr
+from mock import Mock
+from dploylib.transport import Context
+from dploylib.clients.base import RequestTimeout
+from dploylib.clients.pool import *
+
+
+class TestSocketPool(object):
+    def setup(self):
+        self.mock_context = Mock()
+        self.mock_context.socket.side_effect = lambda socket_type: Mock()
+        self.pool = SocketPool(self.mock_context, 'uri', max_size=2,
+                options=[('linger', 0)])
+
+    def test_checkout_creates_connected_sockets(self):
+        socket = self.pool.checkout()
+
+        self.mock_context.socket.assert_called_with('req')
+        socket.set_option.assert_called_with('linger', 0)
+        socket.connect.assert_called_with('uri')
+        eq_(self.pool.size, 1)
+
+    def test_checkin_reuses_sockets(self):
+        socket = self.pool.checkout()
+        self.pool.checkin(socket)
+
+        eq_(self.pool.checkout(), socket)
+        eq_(self.pool.size, 1)
+
+    @raises(PoolExhausted)
+    def test_checkout_is_bounded(self):
+        self.pool.checkout()
+        self.pool.checkout()
+        self.pool.checkout(timeout=0.01)
+
+    def test_discard_frees_a_place(self):
+        socket = self.pool.checkout()
+        self.pool.checkout()
+
+        self.pool.discard(socket)
+
+        socket.close.assert_called_with(linger=0)
+        new_socket = self.pool.checkout(timeout=0.01)
+        assert new_socket is not socket
+
+    def test_checkout_waits_for_checkin(self):
+        socket = self.pool.checkout()
+        self.pool.checkout()
+        timer = threading.Timer(0.05, self.pool.checkin, [socket])
+        timer.start()
+
+        eq_(self.pool.checkout(timeout=5), socket)
+
+    def test_warm(self):
+        pool = SocketPool(self.mock_context, 'uri', max_size=2, warm=5)
+
+        eq_(pool.size, 2)
+        eq_(pool.idle_count, 2)
+
+    def test_close(self):
+        socket = self.pool.checkout()
+        idle_socket = self.pool.checkout()
+        self.pool.checkin(idle_socket)
+
+        self.pool.close()
+        idle_socket.close.assert_called_with(linger=0)
+        self.pool.checkin(socket)
+        socket.close.assert_called_with(linger=0)
+        eq_(self.pool.size, 0)
+
+
+def test_pools_are_shared_by_uri():
+    pools = RequestSocketPools(Mock())
+
+    eq_(pools.pool('a'), pools.pool('a'))
+    assert pools.pool('a') is not pools.pool('b')
+
+
+class Request(object):
+    def __init__(self, data):
+        self.data = data
+
+    def serialize(self):
+        return self.data
+
+
+class HedgedPooledRequestClient(PooledRequestClient):
+    hedge_uri = 'inproc://hedge'
+    hedge_after = 0.5
+
+
+@raises(ValueError)
+def test_pooled_client_rejects_hedging():
+    HedgedPooledRequestClient('inproc://unused', Mock())
+
+
+@raises(ValueError)
+def test_pooled_client_rejects_hedging_set_later():
+    client = PooledRequestClient('inproc://unused', Mock())
+    client.hedge_uri = 'inproc://hedge'
+
+    client.request(Request('hedged'))
+
+
+@attr('large')
+class TestPooledRequestClient(object):
+    def setup(self):
+        self.context = Context.new()
+        self.uri = 'inproc://pooled-client'
+        self.server = self.context.socket('router')
+        self.server.bind(self.uri)
+        self.client = PooledRequestClient(self.uri, self.context)
+
+    def teardown(self):
+        self.server.close(linger=0)
+
+    def serve(self, count):
+        def echo():
+            for i in xrange(count):
+                envelope = self.server.receive_envelope()
+                self.server.send_envelope(envelope)
+        thread = threading.Thread(target=echo)
+        thread.start()
+        return thread
+
+    def test_concurrent_requests(self):
+        thread = self.serve(20)
+        results = []
+
+        def request(index):
+            for i in xrange(5):
+                received = self.client.request(Request(index), timeout=5)
+                results.append(received.json)
+        threads = [threading.Thread(target=request, args=(index,))
+                for index in xrange(4)]
+        for request_thread in threads:
+            request_thread.start()
+        for request_thread in threads:
+            request_thread.join()
+        thread.join()
+
+        eq_(sorted(results), sorted(range(4) * 5))
+        assert self.client._pool.size <= 4
+
+    def test_timed_out_socket_is_replaced(self):
+        try:
+            self.client.request(Request('lost'), timeout=0.01)
+        except RequestTimeout:
+            pass
+        else:
+            raise AssertionError('Expected a RequestTimeout')
+        eq_(self.client._pool.size, 0)
+        # The lost request is still queued on the server
+        self.server.receive_envelope()
+
+        thread = self.serve(1)
+        received = self.client.request(Request('found'), timeout=5)
+        thread.join()
+
+        eq_(received.json, 'found')
+        eq_(self.client._pool.size, 1)
@@ -0,0 +1,273 @@
+"""
+tests.servers.test_execution
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+"""
+import os
+import time
+import threading
+from nose.tools import eq_, raises
+from mock import Mock, patch
+from dploylib import servers
+from dploylib.servers.server import SocketDescription
+from dploylib.servers.execution import *
+from dploylib.transport import Context, Envelope
+
+
+def test_reply_socket_collects_envelopes():
+    socket = ReplySocket()
+    socket.send_text('hello', id='abc')
+    envelope = socket.envelopes[0]
+    eq_(envelope.data, 'hello')
+    eq_(envelope.id, 'abc')
+
+
+def test_run_handler():
+    def handler(server, socket, received):
+        socket.send_envelope(received.envelope.response_envelope('text/plain',
+            'reply'))
+    received = Mock()
+    received.envelope = Envelope('id', 'text/plain', 'data',
+            request_frames=['a'])
+
+    replies = run_handler(handler, 'server', received)
+
+    eq_(replies, [('', ['a', '', 'id', 'text/plain', 'reply'])])
+
+
+def test_run_handler_sends_on_server_sockets():
+    def handler(server, socket, received):
+        server.sockets.out.send_text('out')
+        socket.send_text('reply')
+        server.send_log('log')
+
+    class FakeServer(object):
+        def send_log(self, text):
+            self.sockets.log.send_text(text)
+
+    replies = run_handler(handler, FakeServer(), Mock())
+
+    eq_(replies, [
+        ('out', ['', 'text/plain', 'out']),
+        ('', ['', 'text/plain', 'reply']),
+        ('log', ['', 'text/plain', 'log']),
+    ])
+
+
+def test_pooled_server_reads_server_attributes():
+    server = Mock()
+    server.count = 2
+    pooled_server = PooledServer(server, [])
+
+    eq_(pooled_server.count, 2)
+    assert pooled_server.sockets is not server.sockets
+
+
+@raises(AttributeError)
+def test_pooled_server_is_read_only():
+    PooledServer(Mock(), []).count = 2
+
+
+def test_run_handler_fails():
+    def handler(server, socket, received):
+        socket.send_text('sent before failing')
+        raise Exception('failure')
+
+    # Like an inline handler, anything sent before the failure is still sent
+    eq_(run_handler(handler, 'server', Mock()),
+            [('', ['', 'text/plain', 'sent before failing'])])
+
+
+def test_pooled_rep_socket_not_allowed():
+    for socket_type in ['rep', 'req']:
+        yield do_pooled_socket_not_allowed, socket_type
+
+
+@raises(ValueError)
+def do_pooled_socket_not_allowed(socket_type):
+    SocketDescription('name', socket_type, 'bind', input_handler=Mock(),
+            execution=ThreadPool(2))
+
+
+def test_description_uses_executor():
+    mock_execution = Mock()
+    mock_handler = Mock()
+    mock_server = Mock()
+    description = SocketDescription('name', 'router', 'bind',
+            input_handler=mock_handler, execution=mock_execution)
+
+    with patch('dploylib.servers.server.SocketHandlerWrapper') as wrapper_cls:
+        description.handler(mock_server)
+
+    mock_execution.executor.assert_called_with(mock_server, 'name',
+            mock_handler, None)
+    wrapper_cls.assert_called_with(mock_server, mock_handler, None,
+            batch_size=1, batch=False,
+            spawn=mock_execution.executor.return_value, shedder=None,
+            metrics=None)
+
+
+def test_close_closes_reply_sender():
+    mock_server = Mock()
+    executor = ThreadPoolExecutor(2, mock_server, 'name')
+    executor.queue_replies([('', ['reply'])])
+    mock_reply_sender = mock_server.context.socket.return_value
+
+    executor.close()
+
+    mock_reply_sender.close.assert_called_with(linger=0)
+
+
+def test_process_pool_starts_before_polling():
+    mock_server = Mock()
+    executor = ProcessPoolExecutor(2, mock_server, 'name', Mock(), None)
+    mock_server.add_startup.assert_called_with(executor.start_pool)
+
+    received = Mock()
+    received.envelope = Envelope.new('text/plain', 'data')
+
+    with patch('multiprocessing.Pool') as mock_pool_cls:
+        executor.start_pool()
+        executor(Mock(), mock_server, Mock(), received)
+
+    mock_pool_cls.assert_called_once_with(2)
+    executor.close()
+
+
+def test_process_pool_needs_main_thread():
+    errors = []
+
+    def create_executor():
+        try:
+            ProcessPoolExecutor(2, Mock(), 'name', Mock(), None)
+        except ForkError:
+            errors.append(True)
+    create_thread = threading.Thread(target=create_executor)
+    create_thread.start()
+    create_thread.join()
+
+    eq_(errors, [True])
+
+
+class ThreadPoolServer(servers.Server):
+    @servers.bind_in('request', 'router', execution=servers.ThreadPool(4))
+    def slow_echo(self, socket, received):
+        time.sleep(0.1)
+        envelope = received.envelope
+        socket.send_envelope(envelope.response_envelope(envelope.mimetype,
+            envelope.data))
+
+
+class ForwardingPoolServer(servers.Server):
+    out = servers.bind('out', 'push')
+
+    @servers.bind_in('request', 'router', execution=servers.ThreadPool(2))
+    def forward(self, socket, received):
+        envelope = received.envelope
+        self.sockets.out.send_text(envelope.data)
+        socket.send_envelope(envelope.response_envelope('text/plain', 'ok'))
+
+
+class ProcessPoolServer(servers.Server):
+    @servers.bind_in('request', 'router', execution=servers.ProcessPool(2))
+    def pid_echo(self, socket, received):
+        envelope = received.envelope
+        socket.send_envelope(envelope.response_envelope('text/plain',
+            '%s:%d' % (envelope.data, os.getpid())))
+
+
+class GenericPoolServerTest(object):
+    server_cls = None
+    uri = None
+
+    def setup(self):
+        self.context = Context.new()
+        self.control = self.context.socket('pub')
+        self.control.bind('inproc://%s-control' % self.uri)
+        mock_settings = Mock()
+        mock_settings.stats_info.return_value = None
+        mock_settings.socket_info.side_effect = lambda name: dict(
+                uri='inproc://%s-%s' % (self.uri, name))
+        self.server = self.server_cls.new('server', mock_settings,
+                'inproc://%s-control' % self.uri, context=self.context)
+        for startup_func in self.server._startups:
+            startup_func()
+        self.client = self.context.socket('dealer')
+        self.client.connect('inproc://%s-request' % self.uri)
+
+    def teardown(self):
+        for teardown_func in self.server._teardowns:
+            teardown_func()
+        self.server.close(linger=0)
+        self.client.close(linger=0)
+        self.control.close(linger=0)
+
+    def send_requests(self, count):
+        for i in range(count):
+            self.client.send_envelope(Envelope.new('text/plain', str(i),
+                request_frames=['client%d' % i]))
+
+    def receive_replies(self, count, timeout=5.0):
+        replies = []
+        deadline = time.time() + timeout
+        while len(replies) < count:
+            assert time.time() < deadline, 'Timed out waiting for replies'
+            self.server._poll_loop.poll(timeout=10)
+            envelope = self.client.receive_envelope(block=False)
+            if envelope:
+                replies.append(envelope)
+        return replies
+
+
+class TestThreadPoolServer(GenericPoolServerTest):
+    server_cls = ThreadPoolServer
+    uri = 'thread-pool'
+
+    def test_handlers_run_in_parallel(self):
+        start = time.time()
+        self.send_requests(4)
+
+        replies = self.receive_replies(4)
+
+        # Four handlers sleeping 0.1s in parallel
+        assert time.time() - start < 0.35
+        eq_(sorted(envelope.data for envelope in replies),
+                ['0', '1', '2', '3'])
+        eq_(sorted(envelope.request_frames[0] for envelope in replies),
+                ['client0', 'client1', 'client2', 'client3'])
+
+
+class TestForwardingPoolServer(GenericPoolServerTest):
+    server_cls = ForwardingPoolServer
+    uri = 'forwarding-pool'
+
+    def test_handlers_send_on_other_server_sockets(self):
+        out = self.context.socket('pull')
+        out.connect('inproc://forwarding-pool-out')
+        try:
+            self.send_requests(2)
+
+            replies = self.receive_replies(2)
+
+            eq_([envelope.data for envelope in replies], ['ok', 'ok'])
+            eq_(sorted(out.receive_text() for i in range(2)), ['0', '1'])
+        finally:
+            out.close(linger=0)
+
+
+class TestProcessPoolServer(GenericPoolServerTest):
+    server_cls = ProcessPoolServer
+    uri = 'process-pool'
+
+    def test_handlers_run_in_other_processes(self):
+        self.send_requests(4)
+
+        replies = self.receive_replies(4)
+
+        pids = set()
+        for envelope in replies:
+            data, pid = envelope.data.split(':')
+            pids.add(int(pid))
+        assert os.getpid() not in pids
+        eq_(sorted(envelope.request_frames[0] for envelope in replies),
+                ['client0', 'client1', 'client2', 'client3'])
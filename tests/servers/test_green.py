@@ -0,0 +1,118 @@
+"""
+tests.servers.test_green
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+Tests for the gevent based server. These only run if gevent is installed.
+"""
+from nose.tools import eq_
+from nose.plugins.skip import SkipTest
+from mock import Mock
+
+try:
+    import gevent
+except ImportError:
+    raise SkipTest('gevent is not installed')
+
+from dploylib import servers
+from dploylib.servers.green import GreenServer
+from dploylib.transport import Context
+from dploylib.transport.green import GreenContext, GreenPollLoop
+
+
+class SlowServer(GreenServer):
+    @servers.bind_in('in', 'pull')
+    def slow_in(self, socket, received):
+        gevent.sleep(0.05)
+        self.sockets.out.send_envelope(received.envelope)
+
+    out = servers.bind('out', 'push')
+
+
+class TestGreenServer(object):
+    def setup(self):
+        self.context = Context.new()
+        self.mock_settings = Mock()
+        self.mock_settings.stats_info.return_value = None
+        self.mock_settings.socket_info.side_effect = lambda name: {
+            'in': dict(uri='inproc://green-in'),
+            'out': dict(uri='inproc://green-out'),
+        }[name]
+        self.control = self.context.socket('pub')
+        self.control.bind('inproc://green-control')
+
+        self.sockets = []
+        self.server = SlowServer.new('slow', self.mock_settings,
+                'inproc://green-control', context=self.context)
+
+    def teardown(self):
+        for socket in self.sockets:
+            socket.close(linger=0)
+        self.server.close(linger=0)
+        self.control.close(linger=0)
+
+    def test_uses_green_transport(self):
+        assert isinstance(self.server._context, GreenContext)
+        assert isinstance(self.server._poll_loop, GreenPollLoop)
+
+    def test_handlers_run_concurrently(self):
+        context = GreenContext.from_context(self.context)
+        push = context.socket('push')
+        push.connect('inproc://green-in')
+        pull = context.socket('pull')
+        pull.connect('inproc://green-out')
+        self.sockets = [push, pull]
+
+        for i in range(10):
+            push.send_text(str(i))
+        # Ten handlers sleeping 0.05s each finish well within 0.3s only if
+        # they sleep at the same time
+        with gevent.Timeout(0.3):
+            while len(self.server._handler_pool) < 10:
+                self.server._poll_loop.poll(timeout=10)
+            self.server._handler_pool.join()
+        received = sorted(pull.receive_text() for i in range(10))
+        eq_(received, sorted(str(i) for i in range(10)))
+
+
+class SlowEchoServer(GreenServer):
+    @servers.bind_in('request', 'rep')
+    def slow_echo(self, socket, received):
+        gevent.sleep(0.01)
+        socket.send_envelope(received.envelope)
+
+
+class TestGreenRepServer(object):
+    def setup(self):
+        self.context = Context.new()
+        self.mock_settings = Mock()
+        self.mock_settings.stats_info.return_value = None
+        self.mock_settings.socket_info.return_value = dict(
+                uri='inproc://green-rep', batch_size=2)
+        self.control = self.context.socket('pub')
+        self.control.bind('inproc://green-rep-control')
+        self.server = SlowEchoServer.new('slow-echo', self.mock_settings,
+                'inproc://green-rep-control', context=self.context)
+        self.sockets = []
+
+    def teardown(self):
+        for socket in self.sockets:
+            socket.close(linger=0)
+        self.server.close(linger=0)
+        self.control.close(linger=0)
+
+    def test_queued_requests_are_handled_one_at_a_time(self):
+        context = GreenContext.from_context(self.context)
+        for i in range(2):
+            socket = context.socket('req')
+            socket.connect('inproc://green-rep')
+            socket.send_text(str(i))
+            self.sockets.append(socket)
+
+        replies = []
+        with gevent.Timeout(1):
+            while len(replies) < 2:
+                self.server._poll_loop.poll(timeout=10)
+                for socket in self.sockets:
+                    if socket.poll(0):
+                        replies.append(socket.receive_text())
+        eq_(sorted(replies), ['0', '1'])
@@ -3,9 +3,12 @@ tests.servers.test_server
 ~~~~~~~~~~~~~~~~~~~~~~~~~
 
 """
-from nose.tools import eq_
+from nose.tools import eq_, raises
 from mock import Mock, patch, ANY, call
 from dploylib.servers.server import *
+from dploylib.servers.shedding import Shedder, SHED_EXPIRED, SHED_STALE
+from dploylib.transport import Envelope, Header
+from dploylib.transport.metrics import SocketMetrics
 
 
 class GenericServerTest(object):
@@ -74,19 +77,91 @@ class TestSocketDescription(object):
         ]
         self.description.create_socket(mock_context, uri, options)
 
-        mock_context.socket.assert_called_with(self.socket_type)
+        mock_context.socket.assert_called_with(self.socket_type, copy=True)
         mock_socket = mock_context.socket.return_value
         mock_socket.bind.assert_called_with(uri)
 
+    def test_create_socket_sets_options_before_setup(self):
+        mock_context = Mock()
+        mock_socket = mock_context.socket.return_value
+
+        self.description.create_socket(mock_context, 'uri', [('hwm', 10)])
+
+        eq_(mock_socket.method_calls, [
+            call.set_option('hwm', 10),
+            call.bind('uri'),
+        ])
+
+    def test_create_socket_without_copy(self):
+        mock_context = Mock()
+        description = SocketDescription(self.name, self.socket_type,
+                self.setup_type, copy=False)
+
+        description.create_socket(mock_context, 'uri', [])
+
+        mock_context.socket.assert_called_with(self.socket_type, copy=False)
+
     def test_handler(self):
         mock_server = Mock()
         handler = self.description.handler(mock_server)
         self.mock_socket_handler_wrapper_cls.assert_called_with(mock_server,
-                self.mock_handler, self.mock_deserializer)
+                self.mock_handler, self.mock_deserializer, batch_size=1,
+                batch=False, spawn=None, shedder=None, metrics=None)
         mock_wrapped_handler = (self.mock_socket_handler_wrapper_cls
                 .return_value)
         eq_(handler, mock_wrapped_handler)
 
+    def test_handler_with_max_age(self):
+        mock_server = Mock()
+        self.description.handler(mock_server, max_age=2.0)
+        shedder = (self.mock_socket_handler_wrapper_cls.call_args[1]
+                ['shedder'])
+        eq_(shedder._max_age, 2.0)
+
+    @raises(ValueError)
+    def test_failing_shed_requests_needs_reply_socket(self):
+        SocketDescription('name', 'pull', 'bind',
+                shedding=Shedding(fail=True))
+
+    def test_handler_batch_size_override(self):
+        mock_server = Mock()
+        self.description.handler(mock_server, batch_size=10)
+        self.mock_socket_handler_wrapper_cls.assert_called_with(mock_server,
+                self.mock_handler, self.mock_deserializer, batch_size=10,
+                batch=False, spawn=None, shedder=None, metrics=None)
+
+    def test_compression(self):
+        eq_(self.description.compression, None)
+        mock_compression = Mock()
+        description = bind('out', 'push', compression=mock_compression)
+        eq_(description.compression, mock_compression)
+
+    @raises(ValueError)
+    def test_batch_needs_non_lockstep_socket(self):
+        SocketDescription('name', 'rep', 'bind', batch=True)
+
+    def test_spawned_lockstep_handlers_take_one_at_a_time(self):
+        mock_server = Mock()
+        mock_spawn = Mock()
+        description = SocketDescription('name', 'rep', 'bind',
+                input_handler=self.mock_handler, batch_size=10)
+
+        description.handler(mock_server, batch_size=20, spawn=mock_spawn)
+
+        self.mock_socket_handler_wrapper_cls.assert_called_with(mock_server,
+                self.mock_handler, None, batch_size=1, batch=False,
+                spawn=mock_spawn, shedder=None, metrics=None)
+
+    def test_inline_lockstep_handlers_drain_batches(self):
+        mock_server = Mock()
+        description = SocketDescription('name', 'rep', 'bind',
+                input_handler=self.mock_handler, batch_size=10)
+
+        description.handler(mock_server)
+
+        eq_(self.mock_socket_handler_wrapper_cls.call_args[1]['batch_size'],
+                10)
+
 
 class TestSocketHandlerWrapper(object):
     def setup(self):
@@ -109,12 +184,186 @@ class TestSocketHandlerWrapper(object):
         mock_envelope = mock_socket.receive_envelope.return_value
 
         mock_received_cls.assert_called_with(mock_envelope,
-                self.mock_deserializer)
+                self.mock_deserializer, compression=mock_socket.compression)
 
         self.mock_handler.assert_called_with(self.mock_server,
                 mock_socket, mock_received_cls.return_value)
 
 
+class TestSpawningSocketHandlerWrapper(object):
+    def setup(self):
+        self.mock_server = Mock()
+        self.mock_handler = Mock()
+        self.mock_spawn = Mock()
+
+        self.wrapper = SocketHandlerWrapper(self.mock_server,
+                self.mock_handler, spawn=self.mock_spawn)
+
+    @patch('dploylib.servers.server.ReceivedData')
+    def test_call(self, mock_received_cls):
+        mock_socket = Mock()
+
+        self.wrapper(mock_socket)
+
+        self.mock_spawn.assert_called_with(self.mock_handler,
+                self.mock_server, mock_socket, mock_received_cls.return_value)
+        eq_(self.mock_handler.called, False)
+
+
+class TestBatchedSocketHandlerWrapper(object):
+    def setup(self):
+        self.mock_server = Mock()
+        self.mock_handler = Mock()
+        self.mock_socket = Mock()
+        self.mock_socket.receive_envelope.side_effect = self.fake_receive
+        self.queued = []
+
+    def fake_receive(self, block=True):
+        if not self.queued:
+            return None
+        return self.queued.pop(0)
+
+    def wrapper(self, batch_size, batch=False):
+        return SocketHandlerWrapper(self.mock_server, self.mock_handler,
+                batch_size=batch_size, batch=batch)
+
+    @patch('dploylib.servers.server.ReceivedData')
+    def test_drains_up_to_batch_size(self, mock_received_cls):
+        self.queued = ['e1', 'e2', 'e3', 'e4']
+
+        self.wrapper(3)(self.mock_socket)
+
+        compression = self.mock_socket.compression
+        mock_received_cls.assert_has_calls([
+            call('e1', None, compression=compression),
+            call('e2', None, compression=compression),
+            call('e3', None, compression=compression),
+        ])
+        eq_(self.mock_handler.call_count, 3)
+        self.mock_socket.receive_envelope.assert_has_calls([
+            call(),
+            call(block=False),
+            call(block=False),
+        ])
+        eq_(self.queued, ['e4'])
+
+    @patch('dploylib.servers.server.ReceivedData')
+    def test_stops_when_socket_is_empty(self, mock_received_cls):
+        self.queued = ['e1', 'e2']
+
+        self.wrapper(10)(self.mock_socket)
+
+        eq_(self.mock_handler.call_count, 2)
+
+    @patch('dploylib.servers.server.ReceivedData')
+    def test_batch_handler(self, mock_received_cls):
+        self.queued = ['e1', 'e2']
+
+        self.wrapper(10, batch=True)(self.mock_socket)
+
+        mock_received = mock_received_cls.return_value
+        self.mock_handler.assert_called_once_with(self.mock_server,
+                self.mock_socket, [mock_received, mock_received])
+
+
+class TestSheddingSocketHandlerWrapper(object):
+    def setup(self):
+        self.mock_server = Mock()
+        self.mock_handler = Mock()
+        self.mock_socket = Mock()
+        self.mock_socket.receive_envelope.side_effect = self.fake_receive
+        self.queued = []
+        self.shedder = Shedder(max_age=1.0, clock=lambda: 10.0)
+
+    def fake_receive(self, block=True):
+        if not self.queued:
+            return None
+        return self.queued.pop(0)
+
+    def queue(self, data, header=None):
+        envelope = Envelope.new('text/plain', data, header=header)
+        self.queued.append(Envelope.from_raw(envelope.transfer_object()))
+
+    def wrapper(self, batch=False):
+        return SocketHandlerWrapper(self.mock_server, self.mock_handler,
+                batch_size=10, batch=batch, shedder=self.shedder)
+
+    def handled(self):
+        return [args[2].envelope.data
+                for args, kwargs in self.mock_handler.call_args_list]
+
+    def test_sheds_expired_and_stale(self):
+        self.queue('expired', Header(sent_at=9.5, deadline=9.9))
+        self.queue('fresh', Header(sent_at=9.5, deadline=10.5))
+        self.queue('stale', Header(sent_at=5.0))
+        self.queue('no-header')
+
+        self.wrapper()(self.mock_socket)
+
+        eq_(self.handled(), ['fresh', 'no-header'])
+        eq_(self.shedder.counts(), {SHED_EXPIRED: 1, SHED_STALE: 1})
+
+    def test_batch_handler_not_called_when_everything_is_shed(self):
+        self.queue('expired', Header(deadline=9.0))
+
+        self.wrapper(batch=True)(self.mock_socket)
+
+        eq_(self.mock_handler.called, False)
+
+
+class TestMeasuredSocketHandlerWrapper(object):
+    def setup(self):
+        self.mock_server = Mock()
+        self.mock_handler = Mock()
+        self.mock_socket = Mock()
+        self.mock_socket.receive_envelope.side_effect = self.fake_receive
+        self.queued = []
+        self.metrics = SocketMetrics()
+        self.times = iter([1.0, 1.25, 2.0, 2.5])
+
+    def fake_receive(self, block=True):
+        if not self.queued:
+            return None
+        return self.queued.pop(0)
+
+    def wrapper(self, batch=False):
+        return SocketHandlerWrapper(self.mock_server, self.mock_handler,
+                batch_size=10, batch=batch, metrics=self.metrics,
+                clock=lambda: next(self.times))
+
+    def test_records_received_and_handled(self):
+        self.queued = [Envelope.new('text/plain', 'ab'),
+                Envelope.new('text/plain', 'cde')]
+
+        self.wrapper()(self.mock_socket)
+
+        metrics = self.metrics
+        eq_(metrics.received, 2)
+        eq_(metrics.received_bytes, 5)
+        eq_(metrics.handled, 2)
+        eq_(metrics.handler_latency.min, 0.25)
+        eq_(metrics.handler_latency.max, 0.5)
+
+    def test_batch_counts_each_received(self):
+        self.queued = [Envelope.new('text/plain', 'ab'),
+                Envelope.new('text/plain', 'cde')]
+
+        self.wrapper(batch=True)(self.mock_socket)
+
+        eq_(self.metrics.handled, 2)
+        eq_(self.metrics.handler_latency.count, 1)
+
+    @raises(ValueError)
+    def test_records_errors(self):
+        self.queued = [Envelope.new('text/plain', 'ab')]
+        self.mock_handler.side_effect = ValueError
+        try:
+            self.wrapper()(self.mock_socket)
+        finally:
+            eq_(self.metrics.errors, 1)
+            eq_(self.metrics.handled, 0)
+
+
 class TestSocketHandlerWrapperWithHandler(object):
     def setup(self):
         self.mock_server = Mock()
@@ -179,6 +428,177 @@ class TestDployServer(object):
 
         self.mock_poll_loop.poll.assert_called_with()
 
+    @raises(ValueError)
+    def test_start_closes_sockets_when_a_handler_raises(self):
+        mock_socket = Mock()
+        mock_teardown_func = Mock()
+        self.mock_socket_storage.__iter__ = Mock(
+                return_value=iter([mock_socket]))
+        self.server.add_teardown(mock_teardown_func)
+        self.mock_poll_loop.poll.side_effect = ValueError
+
+        try:
+            self.server.start()
+        finally:
+            mock_teardown_func.assert_called_with()
+            mock_socket.close.assert_called_with(linger=0)
+
+    def test_call_later(self):
+        mock_callback = Mock()
+
+        timer = self.server.call_later(1.5, mock_callback, 'a')
+
+        self.mock_poll_loop.call_later.assert_called_with(1.5, mock_callback,
+                'a')
+        eq_(timer, self.mock_poll_loop.call_later.return_value)
+
+    def test_call_every(self):
+        mock_callback = Mock()
+
+        timer = self.server.call_every(1.5, mock_callback)
+
+        self.mock_poll_loop.call_every.assert_called_with(1.5, mock_callback)
+        eq_(timer, self.mock_poll_loop.call_every.return_value)
+
+    def test_close(self):
+        mock_socket = Mock()
+        self.mock_socket_storage.__iter__ = Mock(
+                return_value=iter([mock_socket]))
+
+        self.server.close(linger=0)
+
+        mock_socket.close.assert_called_with(linger=0)
+
+    def test_send_envelope(self):
+        mock_socket = Mock()
+        mock_envelope = Mock()
+
+        sent = self.server.send_envelope(mock_socket, mock_envelope)
+
+        self.mock_poll_loop.send_envelope.assert_called_with(mock_socket,
+                mock_envelope)
+        eq_(sent, self.mock_poll_loop.send_envelope.return_value)
+
+    def test_add_socket_from_description_with_hwm(self):
+        mock_description = Mock()
+        self.mock_settings.socket_info.return_value = dict(uri='uri',
+                hwm=100, options=[('identity', 'a')])
+
+        self.server.add_socket_from_description(mock_description)
+
+        mock_description.create_socket.assert_called_with(self.mock_context,
+                'uri', [('hwm', 100), ('identity', 'a')], setup_type=None)
+
+    def test_add_socket_from_description_with_queue_limit(self):
+        mock_description = Mock()
+        self.mock_settings.socket_info.return_value = dict(uri='uri',
+                max_queue=10, queue_overflow='drop_oldest')
+
+        self.server.add_socket_from_description(mock_description)
+
+        self.mock_poll_loop.configure_output.assert_called_with(
+                mock_description.create_socket.return_value, max_depth=10,
+                overflow='drop_oldest')
+
+    def test_add_socket_from_description_with_compression(self):
+        mock_description = Mock()
+        self.mock_settings.socket_info.return_value = dict(uri='uri')
+
+        self.server.add_socket_from_description(mock_description)
+
+        mock_socket = mock_description.create_socket.return_value
+        eq_(mock_socket.compression, mock_description.compression)
+
+    @patch('dploylib.servers.server.Compression')
+    def test_add_socket_from_description_with_compression_settings(self,
+            mock_compression_cls):
+        mock_description = Mock()
+        self.mock_settings.socket_info.return_value = dict(uri='uri',
+                compression='zlib')
+
+        self.server.add_socket_from_description(mock_description)
+
+        mock_compression_cls.from_settings.assert_called_with('zlib')
+        mock_socket = mock_description.create_socket.return_value
+        eq_(mock_socket.compression,
+                mock_compression_cls.from_settings.return_value)
+
+    def test_add_socket_from_description_compression_disabled_by_settings(
+            self):
+        mock_description = Mock()
+        mock_socket = mock_description.create_socket.return_value
+        mock_socket.compression = None
+        self.mock_settings.socket_info.return_value = dict(uri='uri',
+                compression=False)
+
+        self.server.add_socket_from_description(mock_description)
+
+        eq_(mock_socket.compression, None)
+
+    def test_output_stats(self):
+        mock_socket = Mock()
+        self.mock_socket_storage.iteritems.return_value = iter([
+            ('out', mock_socket)])
+
+        stats = self.server.output_stats()
+
+        self.mock_poll_loop.output_stats.assert_called_with(mock_socket)
+        eq_(stats, {'out': self.mock_poll_loop.output_stats.return_value})
+
+    def test_add_socket_from_description_collects_metrics(self):
+        mock_description = Mock()
+        mock_description.name = 'in'
+        self.mock_settings.socket_info.return_value = dict(uri='uri')
+
+        self.server.add_socket_from_description(mock_description)
+
+        socket_metrics = self.server.metrics.socket('in')
+        mock_socket = mock_description.create_socket.return_value
+        eq_(mock_socket.metrics, socket_metrics)
+        eq_(mock_description.handler.call_args[1]['metrics'], socket_metrics)
+
+    def test_stats(self):
+        self.mock_socket_storage.iteritems.return_value = iter([])
+        self.server.metrics.socket('in').received = 4
+
+        stats = self.server.stats()
+
+        eq_(stats['name'], self.server_name)
+        eq_(stats['metrics']['in']['received'], 4)
+        eq_(stats['output'], {})
+        eq_(stats['shed'], {})
+
+    def test_setup_stats(self):
+        timer = self.server.setup_stats(dict(uri='stats-uri', interval=2))
+
+        mock_socket = self.mock_context.socket.return_value
+        self.mock_context.socket.assert_called_with('pub')
+        mock_socket.bind.assert_called_with('stats-uri')
+        self.mock_socket_storage.register.assert_called_with('_stats',
+                mock_socket)
+        self.mock_poll_loop.call_every.assert_called_with(2,
+                self.server.publish_stats)
+        eq_(timer, self.mock_poll_loop.call_every.return_value)
+
+    def test_publish_stats(self):
+        self.mock_socket_storage.iteritems.return_value = iter([])
+
+        self.server.publish_stats()
+
+        mock_stats_socket = self.mock_socket_storage._stats
+        args, kwargs = mock_stats_socket.send_obj.call_args
+        eq_(args[0].serialize()['name'], self.server_name)
+        eq_(kwargs, dict(id=self.server_name))
+
+    def test_startups_run_before_polling(self):
+        mock_startup_func = Mock()
+        self.server.add_startup(mock_startup_func)
+        self.mock_poll_loop.poll.side_effect = ServerStopped
+
+        self.server.start()
+
+        mock_startup_func.assert_called_with()
+
     def test_add_setup(self):
         mock_setup_func = Mock()
         self.server.add_setup(mock_setup_func)
@@ -190,3 +610,4 @@ def test_storage():
     storage = SocketStorage()
     storage.register('somename', 'socket')
     eq_(storage.somename, 'socket')
+    eq_(list(storage), ['socket'])
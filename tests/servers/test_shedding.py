@@ -0,0 +1,77 @@
+"""
+tests.servers.test_shedding
+~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+"""
+from nose.tools import eq_
+from mock import Mock
+from dploylib.servers.shedding import *
+from dploylib.transport import Envelope, Header, ReceivedData
+
+
+def received_with(header):
+    envelope = Envelope.new('text/plain', 'data', id='id',
+            request_frames=['client'], header=header)
+    return ReceivedData(Envelope.from_raw(envelope.transfer_object()))
+
+
+def test_shedding_reasons():
+    tests = [
+        [None, None],
+        [Header(sent_at=9.0), None],
+        [Header(sent_at=5.0), SHED_STALE],
+        [Header(sent_at=9.5, deadline=9.9), SHED_EXPIRED],
+        [Header(sent_at=9.5, deadline=10.1), None],
+        [Header(sent_at=5.0, deadline=9.9), SHED_EXPIRED],
+    ]
+    shedder = Shedder(max_age=2.0)
+    for header, expected in tests:
+        yield do_shedding_reason, shedder, header, expected
+
+
+def do_shedding_reason(shedder, header, expected):
+    eq_(shedder.reason(received_with(header), 10.0), expected)
+
+
+def test_shedder_without_max_age_keeps_old_requests():
+    shedder = Shedder()
+    eq_(shedder.reason(received_with(Header(sent_at=0.0)), 10.0), None)
+
+
+def test_shed_drops_and_counts():
+    mock_socket = Mock()
+    shedder = Shedder()
+
+    shedder.shed(mock_socket, received_with(None), SHED_EXPIRED)
+    shedder.shed(mock_socket, received_with(None), SHED_STALE)
+    shedder.shed(mock_socket, received_with(None), SHED_STALE)
+
+    eq_(mock_socket.send_envelope.called, False)
+    eq_(shedder.counts(), {SHED_EXPIRED: 1, SHED_STALE: 2})
+
+
+def test_shed_fails_request():
+    mock_socket = Mock()
+    shedder = Shedder(fail=True)
+
+    shedder.shed(mock_socket, received_with(None), SHED_EXPIRED)
+
+    envelope = mock_socket.send_envelope.call_args[0][0]
+    eq_(envelope.transfer_object(),
+            ['client', '', 'id', SHED_MIMETYPE, SHED_EXPIRED])
+
+
+def test_shedding_policy():
+    shedder = Shedding(max_age=1.0).shedder('router')
+    eq_(shedder._max_age, 1.0)
+    eq_(shedder._fail, False)
+
+
+def test_shedding_policy_max_age_override():
+    shedder = Shedding(max_age=1.0).shedder('router', max_age=3.0)
+    eq_(shedder._max_age, 3.0)
+
+
+def test_shedding_policy_always_fails_rep_requests():
+    shedder = Shedding().shedder('rep')
+    eq_(shedder._fail, True)
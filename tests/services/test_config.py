@@ -26,7 +26,10 @@ FAKE_SETTINGS_DATA = {
             'in': dict(uri='broadcast')
         },
         'queue': {
-            'request': dict(uri='broadcast')
+            'request': dict(uri='broadcast'),
+            'replicas': 3,
+            'supervision': dict(max_restarts=2),
+            'stats': dict(uri='inproc://queue-stats'),
         },
     },
     'general': {
@@ -70,6 +73,21 @@ class TestSettings(object):
         socket_info = self.settings.socket_info('broadcast', 'in')
         eq_(socket_info, expected_socket_info)
 
+    def test_server_replicas(self):
+        eq_(self.settings.server_replicas('queue'), 3)
+        eq_(self.settings.server_replicas('broadcast'), None)
+
+    def test_server_stats(self):
+        eq_(self.settings.server_stats('queue'),
+                dict(uri='inproc://queue-stats'))
+        eq_(self.settings.server_stats('broadcast'), None)
+        eq_(self.settings.server_settings('queue').stats_info(),
+                dict(uri='inproc://queue-stats'))
+
+    def test_server_supervision(self):
+        eq_(self.settings.server_supervision('queue'), dict(max_restarts=2))
+        eq_(self.settings.server_supervision('broadcast'), None)
+
     def test_server_settings(self):
         expected_socket_info = FAKE_SETTINGS_DATA['servers']['broadcast']['in']
 
@@ -77,3 +95,18 @@ class TestSettings(object):
 
         socket_info = server_settings.socket_info('in')
         eq_(socket_info, expected_socket_info)
+
+
+class TestReplicaServerSettings(object):
+    def setup(self):
+        self.override = dict(uri='inproc://internal', setup_type='connect')
+        self.server_settings = ReplicaServerSettings('queue',
+                Settings(FAKE_SETTINGS_DATA), dict(request=self.override))
+
+    def test_socket_info_overridden(self):
+        eq_(self.server_settings.socket_info('request'), self.override)
+
+    def test_socket_info_not_overridden(self):
+        settings = ReplicaServerSettings('broadcast',
+                Settings(FAKE_SETTINGS_DATA), dict(request=self.override))
+        eq_(settings.socket_info('in'), dict(uri='broadcast'))
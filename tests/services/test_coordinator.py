@@ -1,5 +1,14 @@
-from mock import Mock, call
+import time
+import threading
+import warnings
+import zmq
+from nose.tools import eq_, raises
+from nose.plugins.attrib import attr
+from mock import Mock, call, patch
 from dploylib.services.coordinator import *
+from dploylib.services.utils import ServerConfigError
+from dploylib import constants
+from dploylib.transport import Context
 
 
 class GenericServerCoordinatorTest(object):
@@ -17,6 +26,8 @@ class GenericServerCoordinatorTest(object):
             ['server2', mock_server2],
         ]
         self.mock_settings = Mock()
+        self.mock_settings.server_replicas.return_value = None
+        self.mock_settings.server_supervision.return_value = None
         self.coordinator = self.server_coordinator_cls(
                 control_uri=self.fake_control_uri,
                 context=self.mock_context)
@@ -57,3 +68,351 @@ class TestFakeServerCoordinator(GenericServerCoordinatorTest):
             call().start()
         ])
         coordinator.start_control_socket.assert_called_with()
+
+
+class TestServerCoordinatorWithReplicas(GenericServerCoordinatorTest):
+    server_coordinator_cls = ThreadedServerCoordinator
+
+    def setup(self):
+        self.replicas_patch = patch(
+                'dploylib.services.coordinator.replica_spawn_settings')
+        self.mock_replica_spawn_settings = self.replicas_patch.start()
+        self.mock_replica_spawn_settings.return_value = [
+            ('server1-broker', 'broker', 'broker-settings'),
+            ('server1-0', 'server', 'replica-settings'),
+            ('server1-1', 'server', 'replica-settings'),
+        ]
+        super(TestServerCoordinatorWithReplicas, self).setup()
+
+    def teardown(self):
+        self.replicas_patch.stop()
+
+    def test_setup_servers(self):
+        self.mock_settings.server_replicas.side_effect = \
+                lambda name: dict(server1=2).get(name)
+        self.coordinator.setup_servers(self.mock_server_config,
+                self.mock_settings)
+
+        self.mock_replica_spawn_settings.assert_called_with('server1',
+                self.mock_server1, self.mock_settings, 2,
+                self.coordinator.internal_uri)
+        names = [name for name, server, settings
+                in self.coordinator._spawn_settings]
+        eq_(names, ['server1-broker', 'server1-0', 'server1-1', 'server2'])
+
+    def test_setup_servers_supervises_replicas(self):
+        self.mock_settings.server_replicas.side_effect = \
+                lambda name: dict(server1=2).get(name)
+        self.mock_settings.server_supervision.side_effect = \
+                lambda name: dict(server1=dict(max_restarts=2)).get(name)
+        self.coordinator.setup_servers(self.mock_server_config,
+                self.mock_settings)
+
+        supervisors = self.coordinator._supervisors
+        eq_(sorted(supervisors.keys()),
+                ['server1-0', 'server1-1', 'server1-broker'])
+        eq_(supervisors['server1-0'].supervision.max_restarts, 2)
+
+    def test_supervision_from_server_config(self):
+        mock_server_config = Mock()
+
+        supervision = self.coordinator.supervision('server1',
+                mock_server_config, self.mock_settings)
+
+        eq_(supervision, mock_server_config.supervision.return_value)
+
+    def test_supervision_defaults_to_none(self):
+        supervision = self.coordinator.supervision('server1',
+                self.mock_server_config, self.mock_settings)
+
+        eq_(supervision, None)
+
+    def test_replica_count_from_server_config(self):
+        mock_server_config = Mock()
+        mock_server_config.replicas.return_value = 3
+
+        count = self.coordinator.replica_count('server1', mock_server_config,
+                self.mock_settings)
+
+        eq_(count, 3)
+
+    def test_replica_count_defaults_to_one(self):
+        count = self.coordinator.replica_count('server1',
+                self.mock_server_config, self.mock_settings)
+
+        eq_(count, 1)
+
+    def test_internal_uri(self):
+        eq_(self.coordinator.internal_uri('abc'), 'inproc://abc')
+
+
+class TestProcessServerCoordinator(GenericServerCoordinatorTest):
+    @property
+    def server_coordinator_cls(self):
+        class FakeProcessServerCoordinator(ProcessServerCoordinator):
+            spawner = Mock()
+            start_server = Mock()
+
+            start_control_socket = Mock(name='start_control_socket')
+        return FakeProcessServerCoordinator
+
+    def test_start_without_shared_context(self):
+        coordinator = self.coordinator
+
+        coordinator.start()
+
+        mock_server_settings = self.mock_settings.server_settings.return_value
+        coordinator.spawner.assert_has_calls([
+            call(target=coordinator.start_server,
+                args=(self.mock_server1, 'server1', mock_server_settings,
+                    self.fake_control_uri),
+                kwargs=dict(context=None),
+            ),
+            call().start(),
+        ])
+
+    def test_inproc_control_uri_switched_to_ipc(self):
+        coordinator = ProcessServerCoordinator()
+        assert coordinator._control_uri.startswith('ipc://')
+
+    def test_internal_uri(self):
+        assert self.coordinator.internal_uri('abc').startswith('ipc://')
+
+    @raises(ServerConfigError)
+    def test_supervision_is_rejected(self):
+        self.mock_settings.server_supervision.side_effect = \
+                lambda name: dict(server1=dict(max_restarts=2)).get(name)
+
+        self.coordinator.setup_servers(self.mock_server_config,
+                self.mock_settings)
+
+
+def test_ipc_uri():
+    tests = [
+        ['inproc://control', True],
+        ['tcp://127.0.0.1:5555', False],
+        ['ipc:///tmp/control', False],
+    ]
+    for uri, converted in tests:
+        yield do_ipc_uri, uri, converted
+
+
+def do_ipc_uri(uri, converted):
+    new_uri = ipc_uri(uri)
+    if converted:
+        assert new_uri.startswith('ipc://')
+        assert new_uri.endswith('-control')
+    else:
+        eq_(new_uri, uri)
+
+
+class ServerExit(BaseException):
+    pass
+
+
+class StatusServer(object):
+    """A server that stops once it receives anything on the control socket.
+    Servers named "failing" raise instead of starting. Servers named
+    "exiting" raise an exception that isn't an Exception when they start and
+    servers named "stuck" ignore the control socket until released.
+    """
+    starts = 0
+    release = threading.Event()
+
+    @classmethod
+    def new(cls, name, settings, control_uri, context=None):
+        if name == 'failing':
+            StatusServer.starts += 1
+            raise ValueError('failing server')
+        if name == 'slow':
+            time.sleep(0.3)
+        return cls(name, context.socket('sub'), control_uri)
+
+    def __init__(self, name, control_socket, control_uri):
+        control_socket.set_option('subscribe', '')
+        control_socket.set_option('subscribe',
+                constants.SERVER_CONTROL_TOPIC + name)
+        control_socket.connect(control_uri)
+        self._name = name
+        self._control_socket = control_socket
+
+    def start(self):
+        if self._name == 'exiting':
+            raise ServerExit()
+        if self._name == 'stuck':
+            StatusServer.release.wait(5)
+            return
+        self._control_socket.receive_text()
+        self._control_socket.close()
+
+
+@attr('large')
+class TestThreadedServerCoordinator(object):
+    def setup(self):
+        self.context = Context.new()
+        self.settings = Mock()
+        self.settings.server_replicas.return_value = None
+        self.settings.server_supervision.return_value = None
+
+    def coordinator(self, names, **kwargs):
+        coordinator = ThreadedServerCoordinator(
+                control_uri='inproc://control-test', context=self.context,
+                shutdown_resend_interval=0.1, **kwargs)
+        coordinator.logger = Mock()
+        coordinator.setup_servers([[name, StatusServer] for name in names],
+                self.settings)
+        return coordinator
+
+    def test_stop_waits_for_every_server(self):
+        coordinator = self.coordinator(['server1', 'server2'])
+        coordinator.start()
+
+        coordinator.stop()
+
+        for name, thread in coordinator._spawns:
+            assert not thread.is_alive()
+
+    @raises(ServerCoordinatorFailing)
+    def test_wait_raises_when_a_server_fails(self):
+        coordinator = self.coordinator(['server1', 'failing'])
+        coordinator.start()
+        try:
+            coordinator.wait()
+        finally:
+            coordinator.stop()
+
+    def test_wait_raises_when_a_server_exits(self):
+        coordinator = self.coordinator(['server1', 'exiting'])
+        coordinator.start()
+        try:
+            coordinator.wait()
+        except ServerCoordinatorFailing:
+            pass
+        else:
+            raise AssertionError('Expected ServerCoordinatorFailing')
+        finally:
+            coordinator.stop()
+
+        assert 'exiting' in coordinator._stopped
+
+    def test_stop_gives_up_after_timeout(self):
+        StatusServer.release.clear()
+        coordinator = self.coordinator(['server1', 'stuck'],
+                stop_timeout=0.3)
+        coordinator.start()
+        try:
+            start = time.time()
+            coordinator.stop()
+            assert time.time() - start < 2
+        finally:
+            StatusServer.release.set()
+
+    def test_wait_restarts_supervised_servers(self):
+        StatusServer.starts = 0
+        self.settings.server_supervision.side_effect = lambda name: dict(
+                failing=dict(max_restarts=2, backoff=0.01)).get(name)
+        coordinator = self.coordinator(['server1', 'failing'])
+        coordinator.start()
+        try:
+            coordinator.wait()
+        except ServerCoordinatorFailing:
+            pass
+        finally:
+            coordinator.stop()
+
+        # The first start and two restarts
+        eq_(StatusServer.starts, 3)
+        eq_(coordinator._supervisors['failing'].restart_count, 2)
+
+    def test_wait_until_ready(self):
+        coordinator = self.coordinator(['server1', 'server2'])
+        coordinator.start()
+
+        coordinator.wait_until_ready(timeout=5)
+
+        eq_(coordinator._ready, set(['server1', 'server2']))
+        eq_(coordinator._subscribed, set(['server1', 'server2']))
+        coordinator.stop()
+
+    @raises(ServersNotReady)
+    def test_wait_until_ready_times_out(self):
+        coordinator = self.coordinator(['server1', 'slow'])
+        coordinator.start()
+        try:
+            coordinator.wait_until_ready(timeout=0.05)
+        finally:
+            coordinator.stop()
+
+    @raises(ServerCoordinatorFailing)
+    def test_wait_until_ready_fails_when_a_server_fails(self):
+        coordinator = self.coordinator(['server1', 'failing'])
+        coordinator.start()
+        try:
+            coordinator.wait_until_ready(timeout=5)
+        finally:
+            coordinator.stop()
+
+    def test_receive_status_times_out(self):
+        coordinator = self.coordinator([])
+        coordinator.start()
+
+        eq_(coordinator.receive_status(timeout=0.01), None)
+
+        coordinator.stop()
+
+
+def test_thread_poll_duration_is_deprecated():
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        ThreadedServerCoordinator(thread_poll_duration=0.5)
+
+    eq_([warning.category for warning in caught], [DeprecationWarning])
+
+
+class FakeControlSocket(object):
+    def __init__(self, frames):
+        self.frames = list(frames)
+        self.zmq_socket = self
+
+    def recv(self):
+        return self.frames.pop(0)
+
+    def poll(self, timeout=None):
+        return bool(self.frames)
+
+
+def test_subscriptions_are_tracked_by_server():
+    coordinator = ServerCoordinator()
+    topic = constants.SERVER_CONTROL_TOPIC
+    coordinator._control_socket = FakeControlSocket([
+        '\x01',
+        '\x01' + topic + 'server1',
+        '\x01' + topic + 'server2',
+        # A reconnect of the same server
+        '\x01' + topic + 'server1',
+        '\x00' + topic + 'server2',
+    ])
+
+    coordinator.drain_subscriptions()
+
+    eq_(coordinator._subscribed, set(['server1']))
+    eq_(coordinator._control_socket.frames, [])
+
+
+def test_report_status():
+    mock_socket = Mock()
+
+    report_status(mock_socket, 'server', 'status')
+
+    mock_socket.send_text.assert_called_once_with('status', id='server')
+
+
+def test_report_status_when_coordinator_is_gone():
+    mock_socket = Mock()
+    mock_socket.send_text.side_effect = zmq.Again()
+
+    report_status(mock_socket, 'server', 'status')
+
+
+def test_report_status_without_socket():
+    report_status(None, 'server', 'status')
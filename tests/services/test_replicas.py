@@ -0,0 +1,189 @@
+from nose.tools import eq_, raises
+from nose.plugins.attrib import attr
+from mock import Mock, call
+from dploylib import servers
+from dploylib.services import Service
+from dploylib.services.config import Settings
+from dploylib.transport import Context
+from dploylib.services.utils import ServerConfigError
+from dploylib.services.replicas import *
+
+FAKE_SETTINGS_DATA = {
+    'servers': {
+        'worker': {
+            'request': dict(uri='tcp://127.0.0.1:5555', options=[['a', 1]]),
+            'jobs': dict(uri='tcp://127.0.0.1:5556'),
+            'results': dict(uri='tcp://127.0.0.1:5557'),
+        },
+        'publisher': {
+            'out': dict(uri='tcp://127.0.0.1:5558'),
+        },
+        'stats-worker': {
+            'request': dict(uri='tcp://127.0.0.1:5559'),
+            'jobs': dict(uri='tcp://127.0.0.1:5560'),
+            'results': dict(uri='tcp://127.0.0.1:5561'),
+            'stats': dict(uri='tcp://127.0.0.1:5562', interval=1),
+        },
+        'connected-stats-worker': {
+            'request': dict(uri='tcp://127.0.0.1:5559'),
+            'jobs': dict(uri='tcp://127.0.0.1:5560'),
+            'results': dict(uri='tcp://127.0.0.1:5561'),
+            'stats': dict(uri='tcp://127.0.0.1:5562', setup_type='connect'),
+        },
+    },
+    'general': {},
+}
+
+
+class WorkerServer(servers.Server):
+    results = servers.connect('results', 'push')
+
+    @servers.bind_in('request', 'rep')
+    def request(self, socket, received):
+        pass
+
+    @servers.bind_in('jobs', 'pull')
+    def jobs(self, socket, received):
+        pass
+
+
+class PublisherServer(servers.Server):
+    out = servers.bind('out', 'pub')
+
+
+def internal_uri(name):
+    return 'inproc://%s' % name
+
+
+class TestReplicaSpawnSettings(object):
+    def setup(self):
+        self.settings = Settings(FAKE_SETTINGS_DATA)
+        self.spawn_settings = replica_spawn_settings('worker', WorkerServer,
+                self.settings, 2, internal_uri)
+
+    def test_names(self):
+        names = [name for name, server, settings in self.spawn_settings]
+        eq_(names, ['worker-broker', 'worker-0', 'worker-1'])
+
+    def test_broker_routes(self):
+        name, broker, broker_settings = self.spawn_settings[0]
+        eq_(broker, ReplicaBroker)
+        routes = dict((route.name, route) for route in broker_settings.routes)
+        eq_(sorted(routes.keys()), ['jobs', 'request'])
+
+        request_route = routes['request']
+        eq_(request_route.frontend_type, 'router')
+        eq_(request_route.backend_type, 'dealer')
+        eq_(request_route.frontend_info['uri'], 'tcp://127.0.0.1:5555')
+        eq_(request_route.backend_uri, 'inproc://worker-request-replicas')
+
+        eq_(routes['jobs'].frontend_type, 'pull')
+        eq_(routes['jobs'].backend_type, 'push')
+
+    def test_replica_settings(self):
+        name, server, replica_settings = self.spawn_settings[1]
+        eq_(server, WorkerServer)
+        eq_(replica_settings.socket_info('request'),
+                dict(uri='inproc://worker-request-replicas',
+                    options=[['a', 1]], setup_type='connect'))
+        eq_(replica_settings.socket_info('results'),
+                dict(uri='tcp://127.0.0.1:5557'))
+
+    @raises(ServerConfigError)
+    def test_bound_pub_cannot_be_replicated(self):
+        replica_spawn_settings('publisher', PublisherServer, self.settings, 2,
+                internal_uri)
+
+    def test_replicas_publish_stats_through_the_broker(self):
+        spawn_settings = replica_spawn_settings('stats-worker', WorkerServer,
+                self.settings, 2, internal_uri)
+
+        name, broker, broker_settings = spawn_settings[0]
+        routes = dict((route.name, route) for route in broker_settings.routes)
+        stats_route = routes[STATS_ROUTE_NAME]
+        eq_(stats_route.frontend_type, 'pub')
+        eq_(stats_route.backend_type, 'sub')
+        assert stats_route.fan_in
+        eq_(stats_route.frontend_info['uri'], 'tcp://127.0.0.1:5562')
+        for name, server, replica_settings in spawn_settings[1:]:
+            eq_(replica_settings.stats_info(),
+                    dict(uri='inproc://stats-worker-stats-replicas',
+                        interval=1, setup_type='connect'))
+
+    def test_connected_stats_are_left_alone(self):
+        spawn_settings = replica_spawn_settings('connected-stats-worker',
+                WorkerServer, self.settings, 2, internal_uri)
+
+        name, broker, broker_settings = spawn_settings[0]
+        eq_([route.name for route in broker_settings.routes
+            if route.name == STATS_ROUTE_NAME], [])
+        name, server, replica_settings = spawn_settings[1]
+        eq_(replica_settings.stats_info(),
+                dict(uri='tcp://127.0.0.1:5562', setup_type='connect'))
+
+
+class TestForwarder(object):
+    def setup(self):
+        self.mock_target = Mock()
+        self.mock_socket = Mock()
+        self.queued = ['e1', 'e2', 'e3']
+        self.mock_socket.receive_envelope.side_effect = self.fake_receive
+
+    def fake_receive(self, block=True):
+        if not self.queued:
+            return None
+        return self.queued.pop(0)
+
+    def test_forwards_until_empty(self):
+        Forwarder(self.mock_target)(self.mock_socket)
+
+        self.mock_target.send_envelope.assert_has_calls([
+            call('e1'), call('e2'), call('e3'),
+        ])
+
+    def test_forwards_up_to_batch_size(self):
+        Forwarder(self.mock_target, batch_size=2)(self.mock_socket)
+
+        eq_(self.mock_target.send_envelope.call_count, 2)
+        eq_(self.queued, ['e3'])
+
+
+class EchoServer(servers.Server):
+    @servers.bind_in('request', 'rep')
+    def echo(self, socket, received):
+        socket.send_envelope(received.envelope)
+
+
+STATS_URI = 'tcp://127.0.0.1:15992'
+
+REPLICA_STATS_CONFIG = {
+    'servers': {
+        'echo': {
+            'request': dict(uri='tcp://127.0.0.1:15993'),
+            'stats': dict(uri=STATS_URI, interval=0.05),
+        },
+    },
+}
+
+
+@attr('large')
+class TestReplicaStats(object):
+    def setup(self):
+        self.context = Context.new()
+        self.service = Service()
+        self.service.add_server('echo', EchoServer, replicas=2)
+
+    def test_stats_of_every_replica(self):
+        socket = self.context.socket('sub')
+        socket.set_option('subscribe', '')
+        socket.connect(STATS_URI)
+        try:
+            self.service.start(config_dict=REPLICA_STATS_CONFIG,
+                    wait_ready=True, ready_timeout=5)
+            names = set()
+            while names != set(['echo-0', 'echo-1']):
+                assert socket.poll(5000), 'No stats published'
+                names.add(socket.receive_envelope().id)
+        finally:
+            socket.close(linger=0)
+            self.service.stop()
@@ -1,7 +1,10 @@
 from mock import Mock
 from nose.plugins.attrib import attr
+from dploylib import constants
 from dploylib.services.config import Settings
 from dploylib.services import Service
+from dploylib.services.coordinator import ProcessServerCoordinator
+from dploylib.transport import Context
 
 FAKE_SETTINGS_DATA = {
     'servers': {
@@ -42,6 +45,8 @@ class FakeServer(object):
         control_uri = self._control_uri
         control_socket = self._context.socket('sub')
         control_socket.set_option('subscribe', '')
+        control_socket.set_option('subscribe',
+                constants.SERVER_CONTROL_TOPIC + self._name)
         control_socket.connect(control_uri)
         self._control_socket = control_socket
 
@@ -64,3 +69,39 @@ class TestServiceRunWithThreads(object):
         self.service.add_server('queue', FakeServer)
         self.service.start('fake')
         self.service.stop()
+
+    def test_start_waits_until_ready(self):
+        self.service.add_server('broadcast', FakeServer)
+        self.service.add_server('queue', FakeServer)
+        self.service.start('fake', wait_ready=True, ready_timeout=5)
+        self.service.stop()
+
+
+class FakeProcessServer(FakeServer):
+    @classmethod
+    def new(cls, name, settings, control_uri, context=None):
+        context = context or Context.new()
+        return super(FakeProcessServer, cls).new(name, settings, control_uri,
+                context=context)
+
+
+@attr('large')
+class TestServiceRunWithProcesses(object):
+    def setup(self):
+        mock_config_mapper = Mock()
+        mock_config_mapper.process.return_value = Settings(FAKE_SETTINGS_DATA)
+
+        self.service = Service(config_mapper=mock_config_mapper,
+                coordinator=ProcessServerCoordinator())
+
+    def test_mulitple_servers(self):
+        self.service.add_server('broadcast', FakeProcessServer)
+        self.service.add_server('queue', FakeProcessServer)
+        self.service.start('fake')
+        self.service.stop()
+
+    def test_start_waits_until_ready(self):
+        self.service.add_server('broadcast', FakeProcessServer)
+        self.service.add_server('queue', FakeProcessServer)
+        self.service.start('fake', wait_ready=True, ready_timeout=5)
+        self.service.stop()
@@ -5,9 +5,12 @@ tests.services.test_service
 Tests services.
 """
 from mock import Mock, MagicMock, patch
-from nose.tools import raises
+from nose.tools import eq_, raises
 from nose.plugins.attrib import attr
-from dploylib.services.service import Service
+from dploylib.services.service import Service, ServiceNotReady, \
+        ServiceFailing
+from dploylib.services.coordinator import ServersNotReady, \
+        ServerCoordinatorFailing
 
 
 def test_initialize_service():
@@ -85,3 +88,25 @@ class TestBasicService(object):
         mock_processed_config = self.mock_settings_cls.return_value
         self.mock_coordinator.setup_servers.assert_called_with(
                 self.mock_server_config, mock_processed_config)
+
+    def test_start_without_waiting_until_ready(self):
+        self.service.start(config_dict=dict(a='a'))
+
+        eq_(self.mock_coordinator.wait_until_ready.called, False)
+
+    def test_start_waits_until_ready(self):
+        self.service.start(config_dict=dict(a='a'), wait_ready=True,
+                ready_timeout=2)
+
+        self.mock_coordinator.wait_until_ready.assert_called_with(timeout=2)
+
+    @raises(ServiceNotReady)
+    def test_start_not_ready(self):
+        self.mock_coordinator.wait_until_ready.side_effect = ServersNotReady
+        self.service.start(config_dict=dict(a='a'), wait_ready=True)
+
+    @raises(ServiceFailing)
+    def test_start_fails_before_ready(self):
+        self.mock_coordinator.wait_until_ready.side_effect = \
+                ServerCoordinatorFailing
+        self.service.start(config_dict=dict(a='a'), wait_ready=True)
@@ -0,0 +1,67 @@
+from nose.tools import eq_, raises
+from mock import Mock
+from dploylib.services.supervision import *
+
+
+class TestSupervision(object):
+    def test_restarts_on_failure(self):
+        supervision = Supervision()
+
+        eq_(supervision.restarts(True), True)
+        eq_(supervision.restarts(False), False)
+
+    def test_restarts_always(self):
+        supervision = Supervision(restart=RESTART_ALWAYS)
+
+        eq_(supervision.restarts(True), True)
+        eq_(supervision.restarts(False), True)
+
+    @raises(ValueError)
+    def test_unknown_restart_policy(self):
+        Supervision(restart='sometimes')
+
+    def test_from_settings(self):
+        supervision = Supervision.from_settings(dict(restart='always',
+            max_restarts=5, period=10, backoff=1, max_backoff=4))
+
+        eq_(supervision.restart, 'always')
+        eq_(supervision.max_restarts, 5)
+        eq_(supervision.period, 10)
+        eq_(supervision.backoff, 1)
+        eq_(supervision.max_backoff, 4)
+
+
+class TestSupervisor(object):
+    def setup(self):
+        self.now = 100.0
+        self.supervision = Supervision(max_restarts=4, period=10, backoff=1,
+                max_backoff=5)
+        self.supervisor = self.supervision.supervisor(clock=lambda: self.now)
+
+    def test_backoff_doubles(self):
+        supervisor = self.supervisor
+
+        delays = [supervisor.restart_delay(True) for i in range(4)]
+
+        eq_(delays, [1, 2, 4, 5])
+        eq_(supervisor.restart_count, 4)
+
+    def test_intensity_limit(self):
+        supervisor = self.supervisor
+        for i in range(4):
+            supervisor.restart_delay(True)
+
+        eq_(supervisor.restart_delay(True), None)
+        eq_(supervisor.restart_count, 4)
+
+    def test_restarts_outside_period_are_forgotten(self):
+        supervisor = self.supervisor
+        for i in range(4):
+            supervisor.restart_delay(True)
+        self.now += 11
+
+        eq_(supervisor.restart_delay(True), 1)
+
+    def test_no_restart_after_clean_stop(self):
+        eq_(self.supervisor.restart_delay(False), None)
+        eq_(self.supervisor.restart_count, 0)
@@ -80,6 +80,20 @@ class TestServerConfig(object):
 
         assert_equal_sets(server_names, ['test1', 'test2', 'test3'])
 
+    def test_replicas(self):
+        self.config['test1'] = Mock()
+        self.config.set_replicas('test1', 4)
+
+        eq_(self.config.replicas('test1'), 4)
+        eq_(self.config.replicas('test2'), None)
+
+    def test_supervision(self):
+        mock_supervision = Mock()
+        self.config.set_supervision('test1', mock_supervision)
+
+        eq_(self.config.supervision('test1'), mock_supervision)
+        eq_(self.config.supervision('test2'), None)
+
     def test_iterate_servers(self):
         self.config['test1'] = Mock()
         self.config['test2'] = Mock()
@@ -4,6 +4,7 @@ from testkit import MultiprocessTest, ProcessWrapper, random_string
 from dploylib import servers
 from dploylib.services import Service
 from dploylib.transport import *
+from dploylib.clients.base import BaseRequestClient
 
 # FIXME NEED TO RANDOMLY GENERATE THESE
 ECHO_URI = 'tcp://127.0.0.1:14445'
@@ -27,6 +28,28 @@ FAKE_CONFIG = {
 }
 
 
+REPLICA_ECHO_URI = 'tcp://127.0.0.1:14449'
+SUPERVISED_URI = 'tcp://127.0.0.1:14450'
+
+REPLICA_CONFIG = {
+    "servers": {
+        "echo": {
+            "request": dict(uri=REPLICA_ECHO_URI),
+            "replicas": 3,
+        },
+    },
+}
+
+SUPERVISED_CONFIG = {
+    "servers": {
+        "crashing": {
+            "request": dict(uri=SUPERVISED_URI),
+            "supervision": dict(backoff=0.1),
+        },
+    },
+}
+
+
 class ServerProcess(ProcessWrapper):
     servers = []
 
@@ -79,6 +102,18 @@ class EchoServerProcess(ServerProcess):
     ]
 
 
+class NamedEchoServer(servers.Server):
+    @servers.bind_in('request', 'rep')
+    def echo_request(self, socket, received):
+        socket.send_text('%s:%s' % (self._name, received.envelope.data))
+
+
+class NamedEchoServerProcess(ServerProcess):
+    servers = [
+        ('echo', NamedEchoServer),
+    ]
+
+
 class DoubleEchoServerProcess(ServerProcess):
     servers = [
         ('echo', DoubleEchoServer),
@@ -91,6 +126,28 @@ class EchoClassServerProcess(ServerProcess):
     ]
 
 
+class CrashingEchoServer(servers.Server):
+    @servers.bind_in('request', 'rep')
+    def echo_request(self, socket, received):
+        if received.envelope.data == 'crash':
+            raise ValueError('Crashing on request')
+        socket.send_envelope(received.envelope)
+
+
+class TextRequest(object):
+    def __init__(self, text):
+        self.text = text
+
+    def serialize(self):
+        return self.text
+
+
+class CrashingEchoServerProcess(ServerProcess):
+    servers = [
+        ('crashing', CrashingEchoServer),
+    ]
+
+
 class PubServer(servers.Server):
     out = servers.bind('out', 'pub')
 
@@ -217,3 +274,56 @@ class TestDoubleEchoServer(MultiprocessTest):
             random_message = random_string(20)
             self.socket.send_text(random_message)
             eq_(self.socket.receive_text(), random_message * 2)
+
+
+@attr('large')
+class TestReplicatedEchoServer(MultiprocessTest):
+    wrappers = [NamedEchoServerProcess]
+
+    timeout = 2.0
+
+    def shared_options(self):
+        self.context = Context.new()
+        self.sockets = []
+        for i in range(6):
+            socket = self.context.socket('req')
+            socket.connect(REPLICA_ECHO_URI)
+            self.sockets.append(socket)
+        return dict(service_config=REPLICA_CONFIG)
+
+    def test_echo_spread_across_replicas(self):
+        for socket in self.sockets:
+            socket.send_text('hello')
+        replica_names = set()
+        for socket in self.sockets:
+            name, text = socket.receive_text().split(':')
+            eq_(text, 'hello')
+            replica_names.add(name)
+        eq_(replica_names, set(['echo-0', 'echo-1', 'echo-2']))
+
+
+@attr('large')
+class TestSupervisedServerRestart(MultiprocessTest):
+    wrappers = [CrashingEchoServerProcess]
+
+    timeout = 5.0
+
+    def shared_options(self):
+        self.context = Context.new()
+        return dict(service_config=SUPERVISED_CONFIG)
+
+    def test_crashed_server_is_restarted(self):
+        socket = self.context.socket('req')
+        socket.set_option('linger', 0)
+        socket.connect(SUPERVISED_URI)
+        socket.send_text('crash')
+        # The crashed server never replies
+        eq_(socket.poll(200), False)
+        socket.close()
+
+        # Requests sent while the server restarts are lost, so retry
+        client = BaseRequestClient(SUPERVISED_URI, self.context)
+        client.connect()
+        received = client.request(TextRequest('hello'), timeout=0.5,
+                retries=5)
+        eq_(received.json, 'hello')
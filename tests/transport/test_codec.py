@@ -0,0 +1,77 @@
+from nose.tools import eq_, raises
+from nose.plugins.skip import SkipTest
+from mock import Mock
+from dploylib.transport.codec import *
+
+
+class FakeCodec(Codec):
+    mimetype = 'application/x-fake'
+
+    def encode(self, data):
+        return 'fake:%s' % data
+
+    def decode(self, raw):
+        return raw[len('fake:'):]
+
+
+class TestCodecRegistry(object):
+    def setup(self):
+        self.registry = CodecRegistry()
+        self.registry.register(FakeCodec())
+
+    def test_encode(self):
+        eq_(self.registry.encode('application/x-fake', 'abc'), 'fake:abc')
+
+    def test_decode(self):
+        eq_(self.registry.decode('application/x-fake', 'fake:abc'), 'abc')
+
+    def test_contains(self):
+        assert 'application/x-fake' in self.registry
+        assert not 'application/json' in self.registry
+
+    @raises(UnknownMimetype)
+    def test_unknown_mimetype(self):
+        self.registry.get('application/json')
+
+
+def test_default_codecs_round_trip():
+    data = {'a': [1, 2, 3], 'b': 'text'}
+    tests = [JSON_MIMETYPE]
+    if MSGPACK_MIMETYPE in codecs:
+        tests.append(MSGPACK_MIMETYPE)
+    for mimetype in tests:
+        yield do_round_trip, mimetype, data
+
+
+def do_round_trip(mimetype, data):
+    encoded = codecs.encode(mimetype, data)
+    assert isinstance(encoded, str)
+    eq_(codecs.decode(mimetype, encoded), data)
+
+
+def test_json_codec_uses_standard_library():
+    # Decodes unicode like the standard library does
+    eq_(type(codecs.decode(JSON_MIMETYPE, '"abc"')), unicode)
+
+
+def test_json_codec_with_other_module():
+    mock_json = Mock()
+    codec = JSONCodec(mock_json)
+
+    eq_(codec.encode('data'), mock_json.dumps.return_value)
+    eq_(codec.decode('raw'), mock_json.loads.return_value)
+    mock_json.dumps.assert_called_with('data')
+    mock_json.loads.assert_called_with('raw')
+
+
+def test_raw_codec():
+    eq_(codecs.encode(RAW_MIMETYPE, 'abc'), 'abc')
+    eq_(codecs.decode(RAW_MIMETYPE, 'abc'), 'abc')
+
+
+def test_msgpack_is_smaller_than_json():
+    if not MSGPACK_MIMETYPE in codecs:
+        raise SkipTest('msgpack is not installed')
+    data = {'status': 'building', 'progress': range(100)}
+    assert (len(codecs.encode(MSGPACK_MIMETYPE, data)) <
+            len(codecs.encode(JSON_MIMETYPE, data)))
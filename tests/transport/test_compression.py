@@ -0,0 +1,116 @@
+import os
+import zlib
+from nose.tools import eq_, raises
+from dploylib.transport.compression import *
+
+
+class FakeCompressor(Compressor):
+    name = 'fake'
+
+    def compress(self, data):
+        return data[:1]
+
+    def decompress(self, data):
+        return data * 3
+
+
+def test_split_mimetype():
+    tests = [
+        ['text/plain', ('text/plain', None)],
+        ['text/plain; compression=zlib', ('text/plain', 'zlib')],
+    ]
+    for mimetype, expected in tests:
+        yield do_split_mimetype, mimetype, expected
+
+
+def do_split_mimetype(mimetype, expected):
+    eq_(split_mimetype(mimetype), expected)
+
+
+def test_registered_compressors_round_trip():
+    data = 'build log line\n' * 200
+    for name in ('zlib', 'lz4', 'zstd'):
+        if name in compressors:
+            yield do_round_trip, name, data
+
+
+def do_round_trip(name, data):
+    mimetype, compressed = Compression(name).compress('text/plain', data)
+    eq_(mimetype, 'text/plain; compression=%s' % name)
+    assert len(compressed) < len(data)
+    eq_(decompress(mimetype, compressed), ('text/plain', data))
+
+
+def test_compression_threshold():
+    compression = Compression(threshold=10)
+    eq_(compression.compress('text/plain', 'a' * 9), ('text/plain', 'a' * 9))
+
+
+def test_incompressible_data_is_sent_uncompressed():
+    data = os.urandom(2000)
+    compression = Compression(threshold=0)
+    eq_(compression.compress('text/plain', data), ('text/plain', data))
+
+
+def test_compression_from_settings():
+    compression = Compression.from_settings(dict(name='zlib', threshold=10))
+    eq_(compression.compress('text/plain', 'a' * 9), ('text/plain', 'a' * 9))
+    mimetype, compressed = Compression.from_settings('zlib').compress(
+            'text/plain', 'a' * 2000)
+    eq_(decompress(mimetype, compressed), ('text/plain', 'a' * 2000))
+
+
+def test_decompress_limit():
+    mimetype, compressed = Compression(threshold=0).compress('text/plain',
+            'a' * 1000)
+    eq_(decompress(mimetype, compressed, max_size=1000),
+            ('text/plain', 'a' * 1000))
+    eq_(decompress(mimetype, compressed, max_size=None),
+            ('text/plain', 'a' * 1000))
+
+
+@raises(DecompressedTooLarge)
+def test_decompress_over_limit():
+    mimetype, compressed = Compression(threshold=0).compress('text/plain',
+            'a' * 1001)
+    decompress(mimetype, compressed, max_size=1000)
+
+
+@raises(DecompressedTooLarge)
+def test_decompression_bomb_is_rejected():
+    # 100MB of zeros compress to about 100KB
+    compressed = zlib.compress('\0' * (100 * 1024 * 1024), 9)
+    decompress('text/plain; compression=zlib', compressed)
+
+
+@raises(DecompressedTooLarge)
+def test_compression_decompress_uses_max_size():
+    compression = Compression(threshold=0, max_size=10)
+    mimetype, compressed = compression.compress('text/plain', 'a' * 100)
+    compression.decompress(mimetype, compressed)
+
+
+def test_empty_compression_settings():
+    eq_(Compression.from_settings(None), None)
+    eq_(Compression.from_settings(False), None)
+
+
+def test_decompress_uncompressed():
+    eq_(decompress('text/plain', 'data'), ('text/plain', 'data'))
+
+
+def test_registry():
+    registry = CompressorRegistry()
+    registry.register(FakeCompressor())
+    assert 'fake' in registry
+    eq_(registry.get('fake').decompress('a'), 'aaa')
+
+
+@raises(UnknownCompression)
+def test_unknown_compression():
+    decompress('text/plain; compression=unknown', 'data')
+
+
+@raises(UnknownCompression)
+def test_compression_with_unknown_compressor():
+    Compression('unknown')
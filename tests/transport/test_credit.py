@@ -0,0 +1,123 @@
+"""
+tests.transport.test_credit
+~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+"""
+from nose.tools import eq_
+from mock import Mock
+from dploylib.transport import Context, Envelope, PollLoop
+from dploylib.transport.credit import *
+
+
+class TestCreditedSender(object):
+    def setup(self):
+        self.mock_poll_loop = Mock()
+        self.mock_socket = Mock()
+        self.mock_credit_socket = Mock()
+        self.sender = CreditedSender(self.mock_poll_loop, self.mock_socket,
+                self.mock_credit_socket)
+
+    def sent(self):
+        return [args[1] for args, kwargs in
+                self.mock_poll_loop.send_envelope.call_args_list]
+
+    def test_registers_credit_socket(self):
+        self.mock_poll_loop.register.assert_called_with(
+                self.mock_credit_socket, self.sender.receive_credits)
+
+    def test_waits_for_credits(self):
+        eq_(self.sender.send_envelope('e1'), False)
+        eq_(self.sender.waiting_count, 1)
+        eq_(self.sent(), [])
+
+    def test_grant_sends_waiting_envelopes(self):
+        self.sender.send_envelope('e1')
+        self.sender.send_envelope('e2')
+        self.sender.send_envelope('e3')
+
+        self.sender.grant(2)
+
+        eq_(self.sent(), ['e1', 'e2'])
+        eq_(self.sender.waiting_count, 1)
+        eq_(self.sender.credits, 0)
+
+    def test_send_with_credits(self):
+        self.sender.grant(2)
+
+        eq_(self.sender.send_envelope('e1'), True)
+
+        eq_(self.sent(), ['e1'])
+        eq_(self.sender.credits, 1)
+
+    def test_receive_credits(self):
+        self.mock_credit_socket.receive_envelope.return_value = Envelope.new(
+                CREDIT_MIMETYPE, '5')
+
+        self.sender.receive_credits(self.mock_credit_socket)
+
+        eq_(self.sender.credits, 5)
+
+    def test_receive_credits_ignores_other_envelopes(self):
+        self.mock_credit_socket.receive_envelope.return_value = Envelope.new(
+                'text/plain', '5')
+
+        self.sender.receive_credits(self.mock_credit_socket)
+
+        eq_(self.sender.credits, 0)
+
+
+class TestCreditGranter(object):
+    def setup(self):
+        self.mock_socket = Mock()
+        self.granter = CreditGranter(self.mock_socket, 4)
+
+    def granted(self):
+        return [args[0].data for args, kwargs in
+                self.mock_socket.send_envelope.call_args_list]
+
+    def test_start(self):
+        self.granter.start()
+        eq_(self.granted(), ['4'])
+
+    def test_grants_in_batches(self):
+        for i in range(5):
+            self.granter.handled()
+        eq_(self.granted(), ['2', '2'])
+
+
+class TestCreditedPipeline(object):
+    def setup(self):
+        self.context = Context.new()
+        self.output = self.context.socket('push')
+        self.output.bind('inproc://credit-output')
+        self.credits_in = self.context.socket('pull')
+        self.credits_in.bind('inproc://credit-credits')
+        self.input = self.context.socket('pull')
+        self.input.connect('inproc://credit-output')
+        self.credits_out = self.context.socket('push')
+        self.credits_out.connect('inproc://credit-credits')
+
+    def teardown(self):
+        for socket in (self.output, self.credits_in, self.input,
+                self.credits_out):
+            socket.close(linger=0)
+
+    def test_only_window_is_in_flight(self):
+        poll_loop = PollLoop.new()
+        sender = CreditedSender(poll_loop, self.output, self.credits_in)
+        granter = CreditGranter(self.credits_out, 2)
+        granter.start()
+        for i in range(5):
+            sender.send_envelope(Envelope.new('text/plain', str(i)))
+
+        poll_loop.poll(timeout=100)
+
+        eq_(sender.waiting_count, 3)
+        received = [self.input.receive_text(), self.input.receive_text()]
+        eq_(self.input.receive_envelope(block=False), None)
+        granter.handled(2)
+        poll_loop.poll(timeout=100)
+        received.append(self.input.receive_text())
+        received.append(self.input.receive_text())
+        eq_(received, ['0', '1', '2', '3'])
+        eq_(sender.waiting_count, 1)
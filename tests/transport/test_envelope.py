@@ -1,4 +1,6 @@
-from nose.tools import eq_
+from nose.tools import eq_, raises
+from nose.plugins.attrib import attr
+from dploylib.transport import Context
 from dploylib.transport.envelope import *
 
 
@@ -26,6 +28,199 @@ def test_create_envelope_from_raw_request_envelope():
     eq_(envelope.request_frames, ['a', 'b', 'c'])
 
 
+class FakeFrame(object):
+    def __init__(self, bytes):
+        self.bytes = bytes
+
+
+def test_create_envelope_from_raw_frames():
+    raw = [FakeFrame('a'), FakeFrame(''), FakeFrame('id'),
+            FakeFrame('mimetype'), FakeFrame('data')]
+    envelope = Envelope.from_raw(raw)
+    eq_(envelope.mimetype, 'mimetype')
+    eq_(envelope.id, 'id')
+    eq_(envelope.body, raw[-1])
+    eq_(envelope.data, 'data')
+    eq_(envelope.request_frames, raw[:1])
+
+
+def test_received_envelope_transfer_object_is_raw():
+    raw = ['a', '', 'id', 'mimetype', 'data']
+    envelope = Envelope.from_raw(raw)
+    assert envelope.transfer_object() is raw
+
+
+def test_envelope_from_raw_is_lazy():
+    raw = ['a', '', 'id', 'mimetype', 'data']
+    envelope = Envelope.from_raw(raw)
+    raw[-1] = 'changed'
+    eq_(envelope.data, 'changed')
+
+
+def test_envelope_has_no_dict():
+    envelope = Envelope.from_raw(['id', 'mimetype', 'data'])
+    assert not hasattr(envelope, '__dict__')
+
+
+def test_response_envelope_from_raw():
+    raw = ['a', 'b', '', 'id', 'mimetype', 'data']
+    envelope = Envelope.from_raw(raw)
+    response = envelope.response_envelope('newmime', 'newdata')
+    eq_(response.request_frames, ['a', 'b'])
+    eq_(response.transfer_object(),
+            ['a', 'b', '', 'id', 'newmime', 'newdata'])
+    eq_(raw, ['a', 'b', '', 'id', 'mimetype', 'data'])
+
+
+def test_response_envelope_from_raw_tuple():
+    raw = ('a', 'b', '', 'id', 'mimetype', 'data')
+    envelope = Envelope.from_raw(raw)
+    response = envelope.response_envelope('newmime', 'newdata')
+    eq_(response.request_frames, ['a', 'b'])
+    eq_(response.transfer_object(),
+            ['a', 'b', '', 'id', 'newmime', 'newdata'])
+
+
+def test_new_envelope_with_request_frames_tuple():
+    envelope = Envelope.new('mimetype', 'data', id='id',
+            request_frames=('a', 'b'))
+    eq_(envelope.transfer_object(), ['a', 'b', '', 'id', 'mimetype', 'data'])
+
+
+def test_request_frames_are_copied():
+    frames = ['a', 'b']
+    envelope = Envelope.new('mimetype', 'data', id='id',
+            request_frames=frames)
+    response = envelope.response_envelope('newmime', 'newdata')
+
+    envelope.request_frames.append('c')
+
+    eq_(frames, ['a', 'b'])
+    eq_(response.transfer_object(), ['a', 'b', '', 'id', 'newmime', 'newdata'])
+
+
+def test_response_envelope_from_raw_without_request_frames():
+    envelope = Envelope.from_raw(['id', 'mimetype', 'data'])
+    response = envelope.response_envelope('newmime', 'newdata', id='newid')
+    eq_(response.request_frames, [])
+    eq_(response.transfer_object(), ['newid', 'newmime', 'newdata'])
+
+
+def test_header_round_trip():
+    tests = [
+        Header(),
+        Header(sent_at=1.5),
+        Header(deadline=2.5, trace_id='trace'),
+        Header(sent_at=1.5, deadline=2.5, trace_id=''),
+    ]
+    for header in tests:
+        yield do_header_round_trip, header
+
+
+def do_header_round_trip(header):
+    encoded = header.encode()
+    assert not ';' in encoded and not ' ' in encoded
+    eq_(Header.decode(encoded), header)
+
+
+def test_header_new():
+    header = Header.new(trace_id='trace', timeout=2, clock=lambda: 10.0)
+    eq_(header, Header(sent_at=10.0, deadline=12.0, trace_id='trace'))
+    eq_(header.age(now=11.0), 1.0)
+    eq_(header.expired(now=11.0), False)
+    eq_(header.expired(now=12.0), True)
+
+
+def test_header_without_times():
+    header = Header()
+    eq_(header.age(), None)
+    eq_(header.expired(), False)
+
+
+@raises(ValueError)
+def test_header_trace_id_too_long():
+    Header(trace_id='a' * 256).encode()
+
+
+def test_envelope_with_header_round_trip():
+    header = Header(sent_at=1.0, trace_id='trace')
+    envelope = Envelope.new('mimetype', 'data', id='id', header=header,
+            request_frames=['a'])
+    raw = envelope.transfer_object()
+    eq_(raw, ['a', '', 'id', 'mimetype; header=%s' % header.encode(),
+        'data'])
+
+    received = Envelope.from_raw(raw)
+    eq_(received.header, header)
+    eq_(received.request_frames, ['a'])
+    eq_(received.id, 'id')
+    eq_(received.mimetype, 'mimetype')
+    eq_(received.data, 'data')
+
+
+def test_envelope_with_header_without_request_frames():
+    header = Header(trace_id='trace')
+    raw = Envelope.new('mimetype', 'data', header=header).transfer_object()
+    eq_(len(raw), 3)
+    received = Envelope.from_raw(raw)
+    eq_(received.header, header)
+    eq_(received.request_frames, [])
+    eq_(received.mimetype, 'mimetype')
+
+
+def test_header_follows_mimetype_parameters():
+    header = Header(trace_id='trace')
+    raw = Envelope.new('text/plain; compression=zlib', 'data',
+            header=header).transfer_object()
+    received = Envelope.from_raw(raw)
+    eq_(received.mimetype, 'text/plain; compression=zlib')
+    eq_(received.header, header)
+
+
+def test_envelope_without_header():
+    eq_(Envelope.from_raw(['a', '', 'id', 'mimetype', 'data']).header, None)
+
+
+@attr('large')
+def test_header_keeps_pub_sub_filtering():
+    context = Context.new()
+    pub = context.socket('pub')
+    pub.bind('inproc://header-pub-sub')
+    sub = context.socket('sub')
+    sub.set_option('subscribe', 'topic')
+    sub.connect('inproc://header-pub-sub')
+    try:
+        for attempt in xrange(100):
+            pub.send_text('other', id='other', header=Header(trace_id='t'))
+            pub.send_text('with-header', id='topic',
+                    header=Header(trace_id='t'))
+            if sub.poll(10):
+                break
+        envelope = sub.receive_envelope(block=False)
+    finally:
+        sub.close(linger=0)
+        pub.close(linger=0)
+
+    assert envelope, 'The subscriber received nothing'
+    eq_(envelope.id, 'topic')
+    eq_(envelope.data, 'with-header')
+    eq_(envelope.header, Header(trace_id='t'))
+
+
+def test_frame_bytes():
+    tests = [
+        ['data', 'data'],
+        [FakeFrame('data'), 'data'],
+        [memoryview('data'), 'data'],
+    ]
+    for frame, expected in tests:
+        yield do_frame_bytes, frame, expected
+
+
+def do_frame_bytes(frame, expected):
+    eq_(frame_bytes(frame), expected)
+
+
 class TestEnvelope(object):
     def setup(self):
         self.envelope = Envelope('id', 'mimetype', 'data')
@@ -0,0 +1,120 @@
+from nose.tools import eq_
+from mock import Mock
+from dploylib.transport import Context, Envelope
+from dploylib.transport.metrics import *
+
+
+class TestHistogram(object):
+    def setup(self):
+        self.histogram = Histogram()
+
+    def test_empty(self):
+        histogram = self.histogram
+
+        eq_(histogram.count, 0)
+        eq_(histogram.mean, None)
+        eq_(histogram.percentile(50), None)
+
+    def test_small_values_are_exact(self):
+        histogram = self.histogram
+        for micros in range(1, 101):
+            histogram.record(micros * 1e-6)
+
+        eq_(round(histogram.percentile(50) * 1e6), 50)
+        eq_(round(histogram.percentile(99) * 1e6), 99)
+        eq_(histogram.count, 100)
+
+    def test_large_values_within_precision(self):
+        histogram = self.histogram
+        values = [0.001 * i for i in range(1, 1001)]
+        for value in values:
+            histogram.record(value)
+
+        for percentile in (50, 90, 99, 99.9):
+            expected = values[int(len(values) * percentile / 100.0) - 1]
+            actual = histogram.percentile(percentile)
+            assert abs(actual - expected) / expected < 0.02, (percentile,
+                    actual, expected)
+
+    def test_min_max_mean(self):
+        histogram = self.histogram
+        histogram.record(0.5)
+        histogram.record(1.5)
+
+        eq_(histogram.min, 0.5)
+        eq_(histogram.max, 1.5)
+        eq_(histogram.mean, 1.0)
+        eq_(histogram.percentile(100), 1.5)
+
+    def test_negative_values_recorded_as_zero(self):
+        self.histogram.record(-1)
+
+        eq_(self.histogram.min, 0.0)
+
+    def test_reset(self):
+        self.histogram.record(1)
+        self.histogram.reset()
+
+        eq_(self.histogram.count, 0)
+        eq_(self.histogram.max, None)
+
+    def test_snapshot(self):
+        self.histogram.record(0.001)
+
+        snapshot = self.histogram.snapshot(percentiles=(50,))
+
+        eq_(sorted(snapshot.keys()), ['count', 'max', 'mean', 'min', 'p50'])
+        eq_(snapshot['count'], 1)
+
+
+class TestSocketMetrics(object):
+    def test_records_bodies(self):
+        metrics = SocketMetrics()
+        envelope = Envelope.new('text/plain', 'hello')
+
+        metrics.record_received(envelope)
+        metrics.record_sent(envelope)
+        metrics.record_handled(0.001, count=2)
+
+        snapshot = metrics.snapshot()
+        eq_(snapshot['received'], 1)
+        eq_(snapshot['received_bytes'], 5)
+        eq_(snapshot['sent'], 1)
+        eq_(snapshot['sent_bytes'], 5)
+        eq_(snapshot['handled'], 2)
+        eq_(snapshot['handler_latency']['count'], 1)
+
+
+class TestMetrics(object):
+    def test_socket_is_created_once(self):
+        metrics = Metrics()
+
+        socket_metrics = metrics.socket('in')
+
+        eq_(metrics.socket('in'), socket_metrics)
+        eq_(metrics['in'], socket_metrics)
+        assert 'in' in metrics
+        eq_(metrics.names(), ['in'])
+
+    def test_snapshot(self):
+        metrics = Metrics()
+        metrics.socket('in').sent = 3
+
+        eq_(metrics.snapshot()['in']['sent'], 3)
+
+
+def test_socket_records_sent_envelopes():
+    context = Context.new()
+    pull = context.socket('pull')
+    pull.bind('inproc://metrics-test')
+    push = context.socket('push')
+    push.connect('inproc://metrics-test')
+    push.metrics = SocketMetrics()
+
+    push.send_text('hello')
+    push.try_send_envelope(Envelope.new('text/plain', 'abc'))
+
+    eq_(push.metrics.sent, 2)
+    eq_(push.metrics.sent_bytes, 8)
+    push.close(linger=0)
+    pull.close(linger=0)
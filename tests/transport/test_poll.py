@@ -1,6 +1,7 @@
 from mock import Mock
+from nose.tools import raises, eq_
 import zmq
-from dploylib.transport import Socket
+from dploylib.transport import Context, Envelope, Socket
 from dploylib.transport.poll import *
 
 
@@ -32,6 +33,27 @@ class TestPollLoop(object):
         self.mock_zmq_poller.register.assert_called_with(
                 mock_socket, zmq.POLLIN)
 
+    def test_register_with_error_handler(self):
+        mock_socket = Mock()
+
+        self.poll_loop.register(mock_socket, Mock(), error_handler=Mock())
+
+        self.mock_zmq_poller.register.assert_called_with(
+                mock_socket, zmq.POLLIN | zmq.POLLERR)
+
+    def test_unregister(self):
+        mock_socket = Mock(spec=Socket)
+        self.poll_loop.register(mock_socket, Mock())
+
+        self.poll_loop.unregister(mock_socket)
+
+        self.mock_zmq_poller.unregister.assert_called_with(
+                mock_socket.zmq_socket)
+
+    @raises(KeyError)
+    def test_modify_unregistered(self):
+        self.poll_loop.modify(Mock(), Mock())
+
     def test_poll(self):
         timeout = 30
         self.mock_zmq_poller.poll.return_value = []
@@ -39,6 +61,162 @@ class TestPollLoop(object):
         self.mock_zmq_poller.poll.assert_called_with(timeout=timeout)
 
 
+class TestPollLoopOutput(object):
+    def setup(self):
+        self.mock_zmq_poller = Mock()
+        self.poll_loop = PollLoop(self.mock_zmq_poller)
+        self.mock_socket = Mock(spec=Socket)
+        self.mock_raw_socket = self.mock_socket.zmq_socket
+        self.writable = True
+        self.sent = []
+        self.mock_socket.try_send_envelope.side_effect = self.fake_send
+
+    def fake_send(self, envelope):
+        if self.writable:
+            self.sent.append(envelope)
+        return self.writable
+
+    def poll_writable(self):
+        self.writable = True
+        self.mock_zmq_poller.poll.return_value = [
+                (self.mock_raw_socket, zmq.POLLOUT)]
+        self.poll_loop.poll()
+
+    def test_send_envelope(self):
+        eq_(self.poll_loop.send_envelope(self.mock_socket, 'e1'), True)
+        eq_(self.sent, ['e1'])
+        eq_(self.mock_zmq_poller.register.called, False)
+
+    def test_send_envelope_queues_until_writable(self):
+        self.writable = False
+
+        eq_(self.poll_loop.send_envelope(self.mock_socket, 'e1'), False)
+        eq_(self.poll_loop.send_envelope(self.mock_socket, 'e2'), False)
+
+        self.mock_zmq_poller.register.assert_called_once_with(
+                self.mock_raw_socket, zmq.POLLOUT)
+        eq_(self.poll_loop.pending_count(self.mock_socket), 2)
+
+        self.poll_writable()
+
+        eq_(self.sent, ['e1', 'e2'])
+        eq_(self.poll_loop.pending_count(self.mock_socket), 0)
+        self.mock_zmq_poller.unregister.assert_called_with(
+                self.mock_raw_socket)
+
+    def test_pending_envelopes_keep_order(self):
+        self.writable = False
+        self.poll_loop.send_envelope(self.mock_socket, 'e1')
+        self.writable = True
+
+        self.poll_loop.send_envelope(self.mock_socket, 'e2')
+
+        eq_(self.sent, [])
+        self.poll_writable()
+        eq_(self.sent, ['e1', 'e2'])
+
+    def test_send_envelope_on_registered_socket(self):
+        mock_handler = Mock()
+        self.poll_loop.register(self.mock_socket, mock_handler)
+        self.writable = False
+
+        self.poll_loop.send_envelope(self.mock_socket, 'e1')
+
+        self.mock_zmq_poller.modify.assert_called_with(self.mock_raw_socket,
+                zmq.POLLIN | zmq.POLLOUT)
+
+        self.poll_writable()
+
+        self.mock_zmq_poller.modify.assert_called_with(self.mock_raw_socket,
+                zmq.POLLIN)
+        eq_(self.sent, ['e1'])
+        eq_(self.mock_zmq_poller.unregister.called, False)
+        eq_(mock_handler.called, False)
+
+    def test_flush_stops_when_socket_is_full(self):
+        self.writable = False
+        self.poll_loop.send_envelope(self.mock_socket, 'e1')
+        self.poll_loop.send_envelope(self.mock_socket, 'e2')
+
+        eq_(self.poll_loop.flush(self.mock_socket), False)
+        eq_(self.poll_loop.pending_count(self.mock_socket), 2)
+
+    def test_queue_depth_limit(self):
+        self.poll_loop.configure_output(self.mock_socket, max_depth=1)
+        self.writable = False
+        self.poll_loop.send_envelope(self.mock_socket, 'e1')
+
+        try:
+            self.poll_loop.send_envelope(self.mock_socket, 'e2')
+        except OutputQueueFull:
+            pass
+        else:
+            assert False, 'OutputQueueFull was not raised'
+        eq_(self.poll_loop.pending_count(self.mock_socket), 1)
+
+    def test_default_queue_depth_limit(self):
+        poll_loop = PollLoop(self.mock_zmq_poller, max_depth=1)
+        self.writable = False
+        poll_loop.send_envelope(self.mock_socket, 'e1')
+
+        try:
+            poll_loop.send_envelope(self.mock_socket, 'e2')
+        except OutputQueueFull:
+            pass
+        else:
+            assert False, 'OutputQueueFull was not raised'
+
+    def test_queue_drop_oldest(self):
+        self.poll_loop.configure_output(self.mock_socket, max_depth=2,
+                overflow='drop_oldest')
+        self.writable = False
+        for envelope in ['e1', 'e2', 'e3']:
+            self.poll_loop.send_envelope(self.mock_socket, envelope)
+
+        self.poll_writable()
+
+        eq_(self.sent, ['e2', 'e3'])
+
+    def test_queue_drop_new(self):
+        self.poll_loop.configure_output(self.mock_socket, max_depth=2,
+                overflow='drop_new')
+        self.writable = False
+        for envelope in ['e1', 'e2', 'e3']:
+            self.poll_loop.send_envelope(self.mock_socket, envelope)
+
+        self.poll_writable()
+
+        eq_(self.sent, ['e1', 'e2'])
+
+    @raises(ValueError)
+    def test_configure_unknown_overflow(self):
+        self.poll_loop.configure_output(self.mock_socket, overflow='unknown')
+
+    def test_output_stats(self):
+        self.poll_loop.send_envelope(self.mock_socket, 'e1')
+        self.writable = False
+        self.poll_loop.send_envelope(self.mock_socket, 'e2')
+        self.poll_loop.send_envelope(self.mock_socket, 'e3')
+        eq_(self.poll_loop.output_stats(self.mock_socket)['depth'], 2)
+
+        self.poll_writable()
+
+        eq_(self.poll_loop.output_stats(self.mock_socket), dict(depth=0,
+                peak_depth=2, sent_immediately=1, sent_queued=2, dropped=0))
+
+    def test_output_stats_for_unused_socket(self):
+        eq_(self.poll_loop.output_stats(self.mock_socket)['depth'], 0)
+
+    def test_unregister_discards_pending(self):
+        self.poll_loop.register(self.mock_socket, Mock())
+        self.writable = False
+        self.poll_loop.send_envelope(self.mock_socket, 'e1')
+
+        self.poll_loop.unregister(self.mock_socket)
+
+        eq_(self.poll_loop.pending_count(self.mock_socket), 0)
+
+
 class TestPollLoopWithRegistrations(object):
     """Test PollLoop with registered handlers"""
     def setup(self):
@@ -57,11 +235,11 @@ class TestPollLoopWithRegistrations(object):
         self.poll_loop.register(self.mock_socket1, self.mock_handler1)
         self.poll_loop.register(self.mock_socket2, self.mock_handler2)
 
-    def set_poll_return(self, socket_numbers):
-        return_value = {}
+    def set_poll_return(self, socket_numbers, event=zmq.POLLIN):
+        return_value = []
         for num in socket_numbers:
             raw_socket = getattr(self, 'mock_raw_socket%d' % num)
-            return_value[raw_socket] = zmq.POLLIN
+            return_value.append((raw_socket, event))
         self.mock_zmq_poller.poll.return_value = return_value
 
     def test_poll1(self):
@@ -85,3 +263,162 @@ class TestPollLoopWithRegistrations(object):
 
         self.mock_handler1.assert_called_with(self.mock_socket1)
         self.mock_handler2.assert_called_with(self.mock_socket2)
+
+    def test_poll_combined_events(self):
+        self.set_poll_return([1], event=zmq.POLLIN | zmq.POLLERR)
+
+        self.poll_loop.poll()
+
+        self.mock_handler1.assert_called_with(self.mock_socket1)
+
+    def test_poll_error_handler(self):
+        mock_error_handler = Mock()
+        self.poll_loop.modify(self.mock_socket1, self.mock_handler1,
+                error_handler=mock_error_handler)
+        self.mock_zmq_poller.modify.assert_called_with(self.mock_raw_socket1,
+                zmq.POLLIN | zmq.POLLERR)
+        self.set_poll_return([1], event=zmq.POLLERR)
+
+        self.poll_loop.poll()
+
+        mock_error_handler.assert_called_with(self.mock_socket1)
+        eq_(self.mock_handler1.called, False)
+
+    def test_poll_skips_socket_unregistered_during_dispatch(self):
+        def unregister_other(socket):
+            self.poll_loop.unregister(self.mock_socket2)
+        self.mock_handler1.side_effect = unregister_other
+        self.set_poll_return([1, 2])
+
+        self.poll_loop.poll()
+
+        eq_(self.mock_handler2.called, False)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestPollLoopTimers(object):
+    def setup(self):
+        self.mock_zmq_poller = Mock()
+        self.mock_zmq_poller.poll.return_value = []
+        self.clock = FakeClock()
+        self.poll_loop = PollLoop(self.mock_zmq_poller, clock=self.clock)
+
+    def test_timer_limits_poll_timeout(self):
+        self.poll_loop.call_later(2, Mock())
+
+        self.poll_loop.poll()
+
+        self.mock_zmq_poller.poll.assert_called_with(timeout=2000)
+
+    def test_poll_timeout_shorter_than_timer(self):
+        self.poll_loop.call_later(2, Mock())
+
+        self.poll_loop.poll(timeout=500)
+
+        self.mock_zmq_poller.poll.assert_called_with(timeout=500)
+
+    def test_call_later(self):
+        mock_callback = Mock()
+        self.poll_loop.call_later(2, mock_callback, 'a', 'b')
+
+        self.poll_loop.poll()
+        eq_(mock_callback.called, False)
+
+        self.clock.now += 2
+        self.poll_loop.poll()
+        mock_callback.assert_called_once_with('a', 'b')
+
+        self.clock.now += 2
+        self.poll_loop.poll()
+        eq_(mock_callback.call_count, 1)
+        self.mock_zmq_poller.poll.assert_called_with(timeout=None)
+
+    def test_call_every(self):
+        mock_callback = Mock()
+        self.poll_loop.call_every(1, mock_callback)
+
+        for i in range(3):
+            self.clock.now += 1
+            self.poll_loop.poll()
+
+        eq_(mock_callback.call_count, 3)
+
+    def test_call_every_skips_missed_intervals(self):
+        mock_callback = Mock()
+        self.poll_loop.call_every(1, mock_callback)
+
+        self.clock.now += 10
+        self.poll_loop.poll()
+
+        eq_(mock_callback.call_count, 1)
+        self.poll_loop.poll()
+        self.mock_zmq_poller.poll.assert_called_with(timeout=1000)
+
+    def test_cancel(self):
+        mock_callback = Mock()
+        timer = self.poll_loop.call_every(1, mock_callback)
+        timer.cancel()
+
+        self.clock.now += 1
+        self.poll_loop.poll()
+
+        eq_(mock_callback.called, False)
+        self.mock_zmq_poller.poll.assert_called_with(timeout=None)
+
+    def test_cancelled_timers_are_dropped(self):
+        mock_callback = Mock()
+        self.poll_loop.call_later(1000, mock_callback)
+        timers = [self.poll_loop.call_later(1000, Mock()) for i in range(10)]
+
+        for timer in timers:
+            timer.cancel()
+
+        assert len(self.poll_loop._timers) <= 2
+        self.clock.now += 1000
+        self.poll_loop.poll()
+        mock_callback.assert_called_once_with()
+
+    def test_timers_run_in_deadline_order(self):
+        calls = []
+        self.poll_loop.call_later(2, calls.append, 'second')
+        self.poll_loop.call_later(1, calls.append, 'first')
+
+        self.clock.now += 2
+        self.poll_loop.poll()
+
+        eq_(calls, ['first', 'second'])
+
+
+class TestPollLoopOutputWithSockets(object):
+    def setup(self):
+        self.context = Context.new()
+        self.push = self.context.socket('push')
+        self.push.bind('inproc://poll-output')
+        self.pull = None
+
+    def teardown(self):
+        self.push.close(linger=0)
+        if self.pull:
+            self.pull.close(linger=0)
+
+    def test_envelopes_wait_for_a_peer(self):
+        poll_loop = PollLoop.new()
+
+        # A push socket without peers can't send anything
+        poll_loop.send_envelope(self.push, Envelope.new('text/plain', 'a'))
+        poll_loop.send_envelope(self.push, Envelope.new('text/plain', 'b'))
+        eq_(poll_loop.pending_count(self.push), 2)
+
+        self.pull = self.context.socket('pull')
+        self.pull.connect('inproc://poll-output')
+        poll_loop.poll(timeout=100)
+
+        eq_(poll_loop.pending_count(self.push), 0)
+        eq_([self.pull.receive_text(), self.pull.receive_text()], ['a', 'b'])
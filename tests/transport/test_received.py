@@ -1,16 +1,19 @@
+import zlib
 from nose.tools import raises, eq_
 from mock import Mock, patch
 from dploylib.transport.received import *
+from dploylib.transport.compression import Compression, DecompressedTooLarge
 
 
 class TestReceivedData(object):
     def setup(self):
         self.mock_envelope = Mock()
+        self.mock_envelope.mimetype = 'application/x-unknown'
         self.mock_deserializer = Mock()
         self.received = ReceivedData(self.mock_envelope,
                 self.mock_deserializer)
 
-    @patch('json.loads')
+    @patch('dploylib.transport.codec.json.loads')
     def test_get_json_data(self, mock_loads):
         self.mock_envelope.mimetype = 'application/json'
         json_data = self.received.json
@@ -18,18 +21,80 @@ class TestReceivedData(object):
         mock_loads.assert_called_with(self.mock_envelope.data)
         eq_(json_data, mock_loads.return_value)
 
-    @patch('json.loads')
+    @patch('dploylib.transport.codec.json.loads')
     def test_get_json_data_wrong_mimetype(self, mock_loads):
         json_data = self.received.json
         eq_(json_data, None)
 
-    @patch('json.loads')
+    @patch('dploylib.transport.codec.json.loads')
     def test_get_obj(self, mock_loads):
         self.mock_envelope.mimetype = 'application/json'
         obj = self.received.obj
         eq_(obj, self.mock_deserializer.deserialize.return_value)
 
+    @patch('dploylib.transport.received.codecs')
+    def test_get_obj_other_codec(self, mock_codecs):
+        mock_codecs.__contains__ = Mock(return_value=True)
+        self.mock_envelope.mimetype = 'application/x-msgpack'
+
+        obj = self.received.obj
+
+        mock_codecs.decode.assert_called_with('application/x-msgpack',
+                self.mock_envelope.data)
+        self.mock_deserializer.deserialize.assert_called_with(
+                mock_codecs.decode.return_value)
+        eq_(obj, self.mock_deserializer.deserialize.return_value)
+        eq_(self.received.json, None)
+
+    def test_compressed_data(self):
+        self.mock_envelope.mimetype = 'application/json; compression=zlib'
+        self.mock_envelope.data = zlib.compress('{"a": 1}')
+
+        eq_(self.received.mimetype, 'application/json')
+        eq_(self.received.data, '{"a": 1}')
+        eq_(self.received.json, {'a': 1})
+
+    def test_compressed_data_uses_compression_limit(self):
+        self.mock_envelope.mimetype = 'text/plain; compression=zlib'
+        self.mock_envelope.data = zlib.compress('data')
+        received = ReceivedData(self.mock_envelope,
+                compression=Compression(max_size=3))
+
+        try:
+            received.data
+        except DecompressedTooLarge:
+            pass
+        else:
+            raise AssertionError('Expected DecompressedTooLarge')
+        eq_(received.envelope.data, self.mock_envelope.data)
+
+    def test_uncompressed_data(self):
+        self.mock_envelope.mimetype = 'text/plain'
+
+        eq_(self.received.mimetype, 'text/plain')
+        eq_(self.received.data, self.mock_envelope.data)
+
+    def test_header(self):
+        eq_(self.received.header, self.mock_envelope.header)
+
+    def test_age(self):
+        self.received.age(now=10.0)
+        self.mock_envelope.header.age.assert_called_with(now=10.0)
+
+    def test_age_without_header(self):
+        self.mock_envelope.header = None
+        eq_(self.received.age(), None)
+
+    def test_expired(self):
+        expired = self.received.expired(now=10.0)
+        self.mock_envelope.header.expired.assert_called_with(now=10.0)
+        eq_(expired, self.mock_envelope.header.expired.return_value)
+
+    def test_expired_without_header(self):
+        self.mock_envelope.header = None
+        eq_(self.received.expired(), False)
+
     @raises(DataNotDeserializable)
-    @patch('json.loads')
+    @patch('dploylib.transport.codec.json.loads')
     def test_get_obj_raises_error(self, mock_loads):
         self.received.obj
@@ -0,0 +1,179 @@
+"""
+tests.transport.test_stream
+~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+"""
+import threading
+from StringIO import StringIO
+from nose.tools import eq_, raises
+from mock import Mock
+from dploylib.transport import Context, Envelope
+from dploylib.transport.stream import *
+
+
+def test_iter_chunks_from_file():
+    source = StringIO('abcdefg')
+    eq_(list(iter_chunks(source, chunk_size=3)), ['abc', 'def', 'g'])
+
+
+def test_iter_chunks_from_iterable():
+    eq_(list(iter_chunks(['ab', 'cd'])), ['ab', 'cd'])
+
+
+class FakeSocket(object):
+    def __init__(self, incoming=None):
+        self.incoming = list(incoming or [])
+        self.sent = []
+
+    def receive_envelope(self):
+        return self.incoming.pop(0)
+
+    def send_envelope(self, envelope):
+        self.sent.append(envelope)
+
+    def poll(self, timeout=None):
+        return bool(self.incoming)
+
+
+def test_receive_stream():
+    socket = FakeSocket([
+        Envelope.new(STREAM_CHUNK_MIMETYPE, 'a'),
+        Envelope.new(STREAM_CHUNK_MIMETYPE, 'b'),
+        Envelope.new(STREAM_END_MIMETYPE, '2'),
+    ])
+    eq_(list(receive_stream(socket)), ['a', 'b'])
+    eq_(socket.sent, [])
+
+
+@raises(StreamError)
+def test_receive_stream_missing_chunks():
+    socket = FakeSocket([
+        Envelope.new(STREAM_CHUNK_MIMETYPE, 'a'),
+        Envelope.new(STREAM_END_MIMETYPE, '2'),
+    ])
+    list(receive_stream(socket))
+
+
+@raises(StreamError)
+def test_receive_stream_unexpected_envelope():
+    socket = FakeSocket([Envelope.new('text/plain', 'a')])
+    list(receive_stream(socket))
+
+
+@raises(StreamError)
+def test_receive_stream_from_other_stream():
+    socket = FakeSocket([
+        Envelope.new(STREAM_CHUNK_MIMETYPE, 'a', id='stream'),
+        Envelope.new(STREAM_CHUNK_MIMETYPE, 'b', id='stale'),
+        Envelope.new(STREAM_END_MIMETYPE, '2', id='stream'),
+    ])
+    list(receive_stream(socket))
+
+
+@raises(StreamTimeout)
+def test_receive_stream_timeout():
+    socket = FakeSocket([Envelope.new(STREAM_CHUNK_MIMETYPE, 'a')])
+    list(receive_stream(socket, timeout=0.1))
+
+
+def test_receive_stream_grants_credits():
+    socket = FakeSocket([Envelope.new(STREAM_CHUNK_MIMETYPE, str(i))
+            for i in range(5)] + [Envelope.new(STREAM_END_MIMETYPE, '5')])
+    eq_(len(list(receive_stream(socket, window=2))), 5)
+    eq_([(envelope.mimetype, envelope.data) for envelope in socket.sent],
+            [(STREAM_CREDIT_MIMETYPE, '2')] * 2)
+
+
+def test_send_stream():
+    socket = FakeSocket()
+    count = send_stream(socket, ['a', 'b'], id='stream')
+    eq_(count, 2)
+    eq_([(envelope.id, envelope.mimetype, envelope.data)
+            for envelope in socket.sent], [
+        ('stream', STREAM_CHUNK_MIMETYPE, 'a'),
+        ('stream', STREAM_CHUNK_MIMETYPE, 'b'),
+        ('stream', STREAM_END_MIMETYPE, '2'),
+    ])
+
+
+def test_send_stream_waits_for_credits():
+    credit = Envelope.new(STREAM_CREDIT_MIMETYPE, '2')
+    socket = FakeSocket([credit, credit])
+    sent_before_credit = []
+    receive_envelope = socket.receive_envelope
+
+    def fake_receive_envelope():
+        sent_before_credit.append(len(socket.sent))
+        return receive_envelope()
+    socket.receive_envelope = fake_receive_envelope
+
+    send_stream(socket, ['a', 'b', 'c', 'd'], window=2)
+
+    # Waits before the third chunk and for the last full window at the end
+    eq_(sent_before_credit, [2, 5])
+    eq_(socket.incoming, [])
+
+
+@raises(StreamError)
+def test_send_stream_unexpected_envelope():
+    socket = FakeSocket([Envelope.new('text/plain', 'a')])
+    send_stream(socket, ['a', 'b'], window=1)
+
+
+@raises(StreamError)
+def test_send_stream_credits_for_other_stream():
+    socket = FakeSocket([Envelope.new(STREAM_CREDIT_MIMETYPE, '1',
+        id='other')])
+    send_stream(socket, ['a', 'b'], id='stream', window=1)
+
+
+@raises(StreamTimeout)
+def test_send_stream_timeout():
+    send_stream(FakeSocket(), ['a', 'b'], window=1, timeout=0.1)
+
+
+class TestStreamOverSockets(object):
+    def setup(self):
+        self.context = Context.new()
+        self.receiver = self.context.socket('pair')
+        self.receiver.bind('inproc://stream-test')
+        self.sender = self.context.socket('pair')
+        self.sender.connect('inproc://stream-test')
+
+    def teardown(self):
+        self.sender.close(linger=0)
+        self.receiver.close(linger=0)
+
+    def test_stream_with_credits(self):
+        data = ''.join(chr(i % 256) for i in xrange(10000))
+        results = []
+
+        def send():
+            results.append(self.sender.send_stream(StringIO(data),
+                    chunk_size=100, window=4))
+        sender_thread = threading.Thread(target=send)
+        sender_thread.start()
+
+        received = ''.join(self.receiver.receive_stream(window=4))
+        sender_thread.join(5)
+
+        eq_(received, data)
+        eq_(results, [100])
+
+    def test_sender_times_out_when_receiver_stops(self):
+        errors = []
+
+        def send():
+            try:
+                self.sender.send_stream(['a'] * 10, window=2, timeout=0.2)
+            except StreamTimeout:
+                errors.append(True)
+        sender_thread = threading.Thread(target=send)
+        sender_thread.start()
+
+        for chunk in self.receiver.receive_stream(window=2):
+            break
+        sender_thread.join(5)
+
+        assert not sender_thread.is_alive()
+        eq_(errors, [True])
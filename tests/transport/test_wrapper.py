@@ -1,7 +1,9 @@
+import zlib
 import zmq
-from mock import patch, Mock
+from mock import patch, Mock, call
 from nose.tools import eq_, raises
 from dploylib.transport.wrapper import *
+from dploylib.transport.compression import Compression, DecompressedTooLarge
 
 
 @patch('zmq.Context')
@@ -31,6 +33,20 @@ def test_socket_created_correctly(mock_context_cls):
     eq_(socket, mock_context.socket.return_value)
 
 
+def test_bind_new_sets_options_before_binding():
+    mock_context = Mock()
+    mock_socket = mock_context.socket.return_value
+
+    socket = Socket.bind_new('push', 'uri', options=[('hwm', 10)],
+            context=mock_context)
+
+    eq_(mock_socket.method_calls, [
+        call.set_option('hwm', 10),
+        call.bind('uri'),
+    ])
+    eq_(socket, mock_socket)
+
+
 class TestSocket(object):
     def setup(self):
         self.mock_zmq_socket = Mock()
@@ -56,16 +72,23 @@ class TestSocket(object):
 
     def test_socket_set_option(self):
         tests = [
-            ['hwm', 0, zmq.HWM],
-            ['swap', 1, zmq.SWAP],
             ['affinity', 2, zmq.AFFINITY],
             ['identity', 3, zmq.IDENTITY],
             ['subscribe', u'a', zmq.SUBSCRIBE],
             ['unsubscribe', u'b', zmq.UNSUBSCRIBE],
         ]
+        # Only zeromq 2 has these options
+        if hasattr(zmq, 'SWAP'):
+            tests.append(['swap', 1, zmq.SWAP])
         for option, value, expected_opt in tests:
             yield self.do_set_option, option, value, expected_opt
 
+    def test_socket_set_hwm(self):
+        self.socket.set_option('hwm', 10)
+
+        calls = [call(option, value) for option, value in hwm_options(10)]
+        eq_(self.mock_zmq_socket.setsockopt.call_args_list, calls)
+
     def do_set_option(self, option, value, expected_opt):
         self.socket.set_option(option, value)
 
@@ -79,6 +102,11 @@ class TestSocket(object):
 
         self.mock_zmq_socket.bind.assert_called_with(uri)
 
+    def test_close(self):
+        self.socket.close(linger=0)
+
+        self.mock_zmq_socket.close.assert_called_with(linger=0)
+
     def test_connect(self):
         uri = 'uri'
 
@@ -86,7 +114,7 @@ class TestSocket(object):
 
         self.mock_zmq_socket.connect.assert_called_with(uri)
 
-    @patch('json.dumps')
+    @patch('dploylib.transport.codec.json.dumps')
     @patch('dploylib.transport.wrapper.Envelope')
     def test_send_obj(self, mock_envelope_cls, mock_dumps):
         mock_obj = Mock()
@@ -98,16 +126,69 @@ class TestSocket(object):
         mock_dumps.assert_called_with(mock_serial)
         mock_json_str = mock_dumps.return_value
         mock_envelope_cls.new.assert_called_with(
-                'application/json', mock_json_str, id='')
+                'application/json', mock_json_str, id='', header=None)
 
         mock_envelope = mock_envelope_cls.new.return_value
         mock_send_envelope.assert_called_with(mock_envelope)
 
+    @patch('dploylib.transport.wrapper.Envelope')
+    def test_obj_envelope_does_not_send(self, mock_envelope_cls):
+        mock_obj = Mock()
+        mock_obj.serialize.return_value = 'hello'
+        self.socket.send_envelope = Mock()
+
+        envelope = self.socket.obj_envelope(mock_obj, id='a')
+
+        mock_envelope_cls.new.assert_called_with('application/json',
+                '"hello"', id='a', header=None)
+        eq_(envelope, mock_envelope_cls.new.return_value)
+        eq_(self.socket.send_envelope.called, False)
+
+    @patch('dploylib.transport.wrapper.codecs')
+    @patch('dploylib.transport.wrapper.Envelope')
+    def test_send_obj_with_mimetype(self, mock_envelope_cls, mock_codecs):
+        mock_obj = Mock()
+        self.socket.send_envelope = Mock()
+
+        self.socket.send_obj(mock_obj, mimetype='application/x-msgpack')
+
+        mock_codecs.encode.assert_called_with('application/x-msgpack',
+                mock_obj.serialize.return_value)
+        mock_envelope_cls.new.assert_called_with('application/x-msgpack',
+                mock_codecs.encode.return_value, id='', header=None)
+
+    def test_try_send_envelope(self):
+        mock_envelope = Mock()
+
+        sent = self.socket.try_send_envelope(mock_envelope)
+
+        self.mock_zmq_socket.send_multipart.assert_called_with(
+                mock_envelope.transfer_object.return_value, zmq.NOBLOCK,
+                copy=True)
+        eq_(sent, True)
+
+    def test_try_send_envelope_at_hwm(self):
+        self.mock_zmq_socket.send_multipart.side_effect = zmq.Again
+
+        eq_(self.socket.try_send_envelope(Mock()), False)
+
     def test_send_envelope(self):
         mock_envelope = Mock()
         self.socket.send_envelope(mock_envelope)
         self.mock_zmq_socket.send_multipart.assert_called_with(
-                mock_envelope.transfer_object.return_value)
+                mock_envelope.transfer_object.return_value, copy=True,
+                track=False)
+
+    def test_send_envelope_tracked(self):
+        mock_envelope = Mock()
+        mock_envelope.transfer_object.return_value = ['id', 'mime', 'data']
+
+        tracker = self.socket.send_envelope(mock_envelope, copy=False,
+                track=True)
+
+        self.mock_zmq_socket.send_multipart.assert_called_with(
+                ['id', 'mime', 'data'], copy=False, track=True)
+        eq_(tracker, self.mock_zmq_socket.send_multipart.return_value)
 
     @patch('dploylib.transport.wrapper.Envelope')
     def test_send_text(self, mock_envelope_cls):
@@ -116,14 +197,16 @@ class TestSocket(object):
 
         self.socket.send_text(text)
 
-        mock_envelope_cls.new.assert_called_with(TEXT_MIMETYPE, text, id='')
+        mock_envelope_cls.new.assert_called_with(TEXT_MIMETYPE, text, id='',
+                header=None)
         mock_envelope = mock_envelope_cls.new.return_value
         mock_send_envelope.assert_called_with(mock_envelope)
 
-    @patch('json.loads')
+    @patch('dploylib.transport.codec.json.loads')
     def test_receive_obj(self, mock_loads):
         mock_handler = Mock()
         mock_recv_envelope = self.socket.receive_envelope = Mock()
+        mock_recv_envelope.return_value.mimetype = 'application/json'
 
         obj = self.socket.receive_obj(mock_handler)
 
@@ -133,10 +216,99 @@ class TestSocket(object):
         mock_handler.assert_called_with(mock_json_str)
         eq_(obj, mock_handler.return_value)
 
+    @patch('dploylib.transport.wrapper.codecs')
+    def test_receive_obj_decodes_by_mimetype(self, mock_codecs):
+        mock_handler = Mock()
+        mock_recv_envelope = self.socket.receive_envelope = Mock()
+        mock_envelope = mock_recv_envelope.return_value
+        mock_envelope.mimetype = 'application/x-msgpack'
+
+        self.socket.receive_obj(mock_handler)
+
+        mock_codecs.decode.assert_called_with('application/x-msgpack',
+                mock_envelope.data)
+        mock_handler.assert_called_with(mock_codecs.decode.return_value)
+
+    def test_send_text_compressed(self):
+        self.socket.send_envelope = Mock()
+        text = 'a' * 2000
+
+        self.socket.send_text(text, compression=Compression())
+
+        envelope = self.socket.send_envelope.call_args[0][0]
+        eq_(envelope.mimetype, 'text/plain; compression=zlib')
+        eq_(zlib.decompress(envelope.data), text)
+
+    def test_send_obj_uses_socket_compression(self):
+        self.socket.send_envelope = Mock()
+        self.socket.compression = Compression()
+        mock_obj = Mock()
+        mock_obj.serialize.return_value = ['a'] * 1000
+
+        self.socket.send_obj(mock_obj)
+
+        envelope = self.socket.send_envelope.call_args[0][0]
+        eq_(envelope.mimetype, 'application/json; compression=zlib')
+
+    def test_send_text_below_threshold_is_not_compressed(self):
+        self.socket.send_envelope = Mock()
+        self.socket.compression = Compression()
+
+        self.socket.send_text('short')
+
+        envelope = self.socket.send_envelope.call_args[0][0]
+        eq_(envelope.mimetype, 'text/plain')
+        eq_(envelope.data, 'short')
+
+    def test_receive_text_compressed(self):
+        mock_recv_envelope = self.socket.receive_envelope = Mock()
+        mock_envelope = mock_recv_envelope.return_value
+        mock_envelope.mimetype = 'text/plain; compression=zlib'
+        mock_envelope.data = zlib.compress('text')
+
+        eq_(self.socket.receive_text(), 'text')
+
+    @raises(DecompressedTooLarge)
+    def test_receive_text_uses_socket_decompression_limit(self):
+        self.socket.compression = Compression(max_size=3)
+        mock_recv_envelope = self.socket.receive_envelope = Mock()
+        mock_envelope = mock_recv_envelope.return_value
+        mock_envelope.mimetype = 'text/plain; compression=zlib'
+        mock_envelope.data = zlib.compress('text')
+
+        self.socket.receive_text()
+
     @patch('dploylib.transport.wrapper.Envelope')
     def test_receive_envelope(self, mock_envelope_cls):
         self.socket.receive_envelope()
-        self.mock_zmq_socket.recv_multipart.assert_called_with()
+        self.mock_zmq_socket.recv_multipart.assert_called_with(0, copy=True)
+
+    @patch('dploylib.transport.wrapper.Envelope')
+    def test_receive_envelope_without_blocking(self, mock_envelope_cls):
+        envelope = self.socket.receive_envelope(block=False)
+
+        self.mock_zmq_socket.recv_multipart.assert_called_with(zmq.NOBLOCK,
+                copy=True)
+        eq_(envelope, mock_envelope_cls.from_raw.return_value)
+
+    def test_receive_envelope_without_blocking_nothing_received(self):
+        self.mock_zmq_socket.recv_multipart.side_effect = zmq.Again
+
+        envelope = self.socket.receive_envelope(block=False)
+
+        eq_(envelope, None)
+
+    @patch('dploylib.transport.wrapper.Envelope')
+    def test_receive_envelope_without_copy(self, mock_envelope_cls):
+        socket = Socket(self.mock_zmq_socket, self.mock_zmq_context,
+                copy=False)
+
+        envelope = socket.receive_envelope()
+
+        self.mock_zmq_socket.recv_multipart.assert_called_with(0, copy=False)
+        mock_raw = self.mock_zmq_socket.recv_multipart.return_value
+        mock_envelope_cls.from_raw.assert_called_with(mock_raw)
+        eq_(envelope, mock_envelope_cls.from_raw.return_value)
 
     def test_receive_text(self):
         mock_recv_envelope = self.socket.receive_envelope = Mock()